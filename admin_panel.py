@@ -1,9 +1,11 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from config import ADMIN_USERS, BOT_SIGNATURE
+from config import ADMIN_USERS, BOT_SIGNATURE, GROUP_SEARCH_PAGE_SIZE
 from datetime import datetime
+from message_stream import TELEGRAM_MESSAGE_LIMIT
 import logging
 import asyncio
+import html
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +23,10 @@ def get_admin_keyboard():
         [InlineKeyboardButton("⭐ إضافة مستخدم مميز", callback_data="add_premium"),
          InlineKeyboardButton("❌ إزالة مستخدم مميز", callback_data="remove_premium")],
         [InlineKeyboardButton("👑 عرض المستخدمين المميزين", callback_data="list_premium")],
-        [InlineKeyboardButton("🏢 إدارة المجموعات", callback_data="admin_groups")],
-        [InlineKeyboardButton("📤 تحويل إعلان", callback_data="forward_ad")],
+        [InlineKeyboardButton("🏢 إدارة المجموعات", callback_data="admin_groups"),
+         InlineKeyboardButton("🗃 ذاكرة الردود", callback_data="admin_cache")],
+        [InlineKeyboardButton("📤 تحويل إعلان", callback_data="forward_ad"),
+         InlineKeyboardButton("🔑 مفاتيح Gemini", callback_data="admin_keys")],
         [InlineKeyboardButton("🚪 تسجيل الخروج", callback_data="admin_logout")]
     ]
     return InlineKeyboardMarkup(keyboard)
@@ -75,6 +79,8 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     if query.data == "admin_stats":
         await show_statistics(query, db)
+    elif query.data.startswith("stats_"):
+        await show_statistics_section(query, query.data, context.bot_data)
     elif query.data == "admin_users":
         await show_users(query, db)
     elif query.data == "admin_broadcast":
@@ -129,7 +135,7 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
         if user_id and confirm_msg:
             try:
-                db.add_premium_user(user_id)
+                await db.add_premium_user(user_id)
                 await confirm_msg.edit_text(f"✅ تم إضافة المستخدم {user_id} كمستخدم مميز بنجاح!")
             except Exception as e:
                 await confirm_msg.edit_text(f"❌ حدث خطأ: {str(e)}")
@@ -147,7 +153,7 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
         if user_id and confirm_msg:
             try:
-                db.remove_premium_user(user_id)
+                await db.remove_premium_user(user_id)
                 await confirm_msg.edit_text(f"✅ تم إزالة المستخدم {user_id} من المستخدمين المميزين بنجاح!")
             except Exception as e:
                 await confirm_msg.edit_text(f"❌ حدث خطأ: {str(e)}")
@@ -178,6 +184,28 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         await query.message.edit_text("تم تسجيل الخروج بنجاح من لوحة التحكم. ✅")
     elif query.data == "list_premium":
         await show_premium_users(query, db)
+    elif query.data in ("admin_cache", "cache_purge", "cache_toggle"):
+        cache = context.bot_data.get("response_cache")
+        similar_cache = context.bot_data.get("semantic_cache")
+        image_cache = context.bot_data.get("image_cache")
+        notice = ""
+        if cache is not None and query.data == "cache_purge":
+            removed = cache.purge() + (similar_cache.purge() if similar_cache is not None else 0)
+            removed += image_cache.purge() if image_cache is not None else 0
+            notice = f"✅ تم حذف {removed} رد من الذاكرة\n\n"
+        elif cache is not None and query.data == "cache_toggle":
+            cache.enabled = not cache.enabled
+            if similar_cache is not None:
+                similar_cache.enabled = cache.enabled
+            if image_cache is not None:
+                image_cache.enabled = cache.enabled
+        await show_response_cache(query, cache, similar_cache, notice, image_cache)
+    elif query.data == "admin_keys":
+        await show_api_keys(query, context.bot_data.get("gemini"))
+    elif query.data.startswith("group_search_page:"):
+        page = int(query.data.split(":", 1)[1])
+        search_query = context.user_data.get('group_search_query', '')
+        await show_group_search_results(query.message.edit_text, search_query, page, db)
     elif query.data == "forward_ad":
         await start_forward_ad(query, context)
     elif query.data == "confirm_broadcast":
@@ -191,14 +219,15 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
             fail_count = 0
             
             # Get all users from database
-            all_users = db.data["users"].keys()
+            all_users = await db.get_all_user_ids()
+            banned_users = set(await db.get_banned_users())
             total_users = len(all_users)
             
             # Send to each user
             for user_id in all_users:
                 try:
                     # Skip banned users
-                    if user_id in db.data["banned_users"]:
+                    if user_id in banned_users:
                         continue
                         
                     if broadcast_msg.photo:
@@ -266,7 +295,8 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
             fail_count = 0
             
             # Get all users from database
-            all_users = db.data["users"].keys()
+            all_users = await db.get_all_user_ids()
+            banned_users = set(await db.get_banned_users())
             total_users = len(all_users)
             
             # Handle forwarded advertisement
@@ -304,7 +334,7 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
             for user_id in all_users:
                 try:
                     # Skip banned users
-                    if user_id in db.data["banned_users"]:
+                    if user_id in banned_users:
                         continue
                         
                     if forward_msg.photo:
@@ -369,9 +399,10 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         if user_id:
             try:
                 # تنفيذ الحظر
-                db.ban_user(user_id)
-                username = db.data["users"][str(user_id)].get("username", "")
-                first_name = db.data["users"][str(user_id)].get("first_name", "")
+                await db.ban_user(user_id)
+                user_info = await db.get_user_info(user_id) or {}
+                username = user_info.get("username", "")
+                first_name = user_info.get("first_name", "")
                 
                 # محاولة إرسال إشعار للمستخدم
                 try:
@@ -406,9 +437,10 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         if user_id:
             try:
                 # تنفيذ إلغاء الحظر
-                db.unban_user(user_id)
-                username = db.data["users"][str(user_id)].get("username", "")
-                first_name = db.data["users"][str(user_id)].get("first_name", "")
+                await db.unban_user(user_id)
+                user_info = await db.get_user_info(user_id) or {}
+                username = user_info.get("username", "")
+                first_name = user_info.get("first_name", "")
                 
                 # محاولة إرسال إشعار للمستخدم
                 try:
@@ -471,19 +503,20 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         try:
             user_id = int(message_text)
             # التحقق من وجود المستخدم في قاعدة البيانات
-            if str(user_id) not in db.data["users"]:
+            if not await db.user_exists(user_id):
                 await update.message.reply_text("❌ المستخدم غير موجود في قاعدة البيانات.")
                 return
             
             # التحقق مما إذا كان المستخدم محظوراً بالفعل
-            if str(user_id) in db.data["banned_users"]:
+            if await db.is_user_banned(user_id):
                 await update.message.reply_text("❌ هذا المستخدم محظور بالفعل!")
                 return
             
             # حفظ معرف المستخدم وإرسال رسالة التأكيد
             context.user_data['ban_user_id'] = user_id
-            username = db.data["users"][str(user_id)].get("username", "")
-            first_name = db.data["users"][str(user_id)].get("first_name", "")
+            user_info = await db.get_user_info(user_id) or {}
+            username = user_info.get("username", "")
+            first_name = user_info.get("first_name", "")
             
             await update.message.reply_text(
                 f"⚠️ تأكيد حظر المستخدم\n\n"
@@ -508,14 +541,15 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         try:
             user_id = int(message_text)
             # التحقق من أن المستخدم محظور
-            if str(user_id) not in db.data["banned_users"]:
+            if not await db.is_user_banned(user_id):
                 await update.message.reply_text("❌ هذا المستخدم غير محظور!")
                 return
             
             # حفظ معرف المستخدم وإرسال رسالة التأكيد
             context.user_data['unban_user_id'] = user_id
-            username = db.data["users"][str(user_id)].get("username", "")
-            first_name = db.data["users"][str(user_id)].get("first_name", "")
+            user_info = await db.get_user_info(user_id) or {}
+            username = user_info.get("username", "")
+            first_name = user_info.get("first_name", "")
             
             await update.message.reply_text(
                 f"⚠️ تأكيد إلغاء حظر المستخدم\n\n"
@@ -539,8 +573,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     # Handle other admin states...
     if admin_state == 'waiting_for_broadcast':
         # Get all users from database
-        all_users = db.data["users"].keys()
-        total_users = len(all_users)
+        total_users = await db.get_total_users()
         
         # Send confirmation message with user count
         confirm_msg = await update.message.reply_text(
@@ -565,16 +598,23 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         await handle_groups_broadcast(update.message, context, db)
         return
 
+    elif admin_state == 'waiting_group_search':
+        # تبقى الحالة كما هي ليتمكن المشرف من إرسال بحث جديد مباشرة
+        search_query = message_text.strip()
+        context.user_data['group_search_query'] = search_query
+        await show_group_search_results(update.message.reply_text, search_query, 1, db)
+        return
+
     elif admin_state == 'waiting_add_premium':
         try:
             user_id = message_text.strip()
             # التحقق من وجود المستخدم في قاعدة البيانات
-            if str(user_id) not in db.data["users"]:
+            if not await db.user_exists(user_id):
                 await update.message.reply_text("❌ المستخدم غير موجود في قاعدة البيانات.")
                 return
             
             # التحقق مما إذا كان المستخدم مميزاً بالفعل
-            if user_id in db.data.get("premium_users", []):
+            if await db.is_user_premium(user_id):
                 await update.message.reply_text("❌ هذا المستخدم مميز بالفعل!")
                 return
             
@@ -600,7 +640,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         try:
             user_id = message_text.strip()
             # التحقق من وجود المستخدم في قائمة المميزين
-            if user_id not in db.data.get("premium_users", []):
+            if not await db.is_user_premium(user_id):
                 await update.message.reply_text("❌ هذا المستخدم ليس مميزاً!")
                 return
             
@@ -649,19 +689,20 @@ async def handle_ban_unban_message(update: Update, context: ContextTypes.DEFAULT
         try:
             user_id = int(message_text)
             # التحقق من وجود المستخدم في قاعدة البيانات
-            if str(user_id) not in db.data["users"]:
+            if not await db.user_exists(user_id):
                 await update.message.reply_text("❌ المستخدم غير موجود في قاعدة البيانات.")
                 return
             
             # التحقق مما إذا كان المستخدم محظوراً بالفعل
-            if str(user_id) in db.data["banned_users"]:
+            if await db.is_user_banned(user_id):
                 await update.message.reply_text("❌ هذا المستخدم محظور بالفعل!")
                 return
             
             # حفظ معرف المستخدم وإرسال رسالة التأكيد
             context.user_data['ban_user_id'] = user_id
-            username = db.data["users"][str(user_id)].get("username", "")
-            first_name = db.data["users"][str(user_id)].get("first_name", "")
+            user_info = await db.get_user_info(user_id) or {}
+            username = user_info.get("username", "")
+            first_name = user_info.get("first_name", "")
             
             await update.message.reply_text(
                 f"⚠️ تأكيد حظر المستخدم\n\n"
@@ -686,14 +727,15 @@ async def handle_ban_unban_message(update: Update, context: ContextTypes.DEFAULT
         try:
             user_id = int(message_text)
             # التحقق من أن المستخدم محظور
-            if str(user_id) not in db.data["banned_users"]:
+            if not await db.is_user_banned(user_id):
                 await update.message.reply_text("❌ هذا المستخدم غير محظور!")
                 return
             
             # حفظ معرف المستخدم وإرسال رسالة التأكيد
             context.user_data['unban_user_id'] = user_id
-            username = db.data["users"][str(user_id)].get("username", "")
-            first_name = db.data["users"][str(user_id)].get("first_name", "")
+            user_info = await db.get_user_info(user_id) or {}
+            username = user_info.get("username", "")
+            first_name = user_info.get("first_name", "")
             
             await update.message.reply_text(
                 f"⚠️ تأكيد إلغاء حظر المستخدم\n\n"
@@ -714,10 +756,30 @@ async def handle_ban_unban_message(update: Update, context: ContextTypes.DEFAULT
             await update.message.reply_text("❌ الرجاء إدخال رقم معرف صحيح.")
         return
 
+def get_statistics_keyboard():
+    """Get the keyboard of the statistics sub-screens."""
+    keyboard = [
+        [InlineKeyboardButton("🤖 Gemini", callback_data="stats_gemini"),
+         InlineKeyboardButton("🧭 النماذج والطابور", callback_data="stats_routing")],
+        [InlineKeyboardButton("💬 المحادثات", callback_data="stats_conversations"),
+         InlineKeyboardButton("🖼 الصور", callback_data="stats_images")],
+        [InlineKeyboardButton("👥 رسائل المجموعات", callback_data="stats_groups")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="admin_back")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def fit_message(text: str) -> str:
+    """Cut text to Telegram's message limit so edit_text doesn't fail on long statistics."""
+    if len(text) <= TELEGRAM_MESSAGE_LIMIT:
+        return text
+    return text[:TELEGRAM_MESSAGE_LIMIT - 2] + "\n…"
+
 async def show_statistics(query, db):
     """Show bot statistics."""
-    stats = db.get_total_stats()
-    daily_stats = db.get_daily_stats()
+    stats = await db.get_total_stats()
+    daily_stats = await db.get_daily_stats()
+    weekly_stats = await db.get_daily_series(7)
+    storage_stats = await db.get_storage_stats()
     stats_text = f"""📊 إحصائيات البوت:
 
 👥 عدد المستخدمين: {stats['total_users']}
@@ -726,23 +788,272 @@ async def show_statistics(query, db):
 
 📅 إحصائيات اليوم:
 📝 الرسائل: {daily_stats['messages']}
-🖼 الصور: {daily_stats['images']}"""
-    
-    await query.message.edit_text(stats_text, reply_markup=get_admin_keyboard())
+🖼 الصور: {daily_stats['images']}
+👤 مستخدمون جدد: {daily_stats['new_users']}
+👥 رسائل المجموعات: {daily_stats['group_messages']}
+🤖 طلبات Gemini: {daily_stats['gemini_calls']}
+
+📈 آخر 7 أيام (📝 | 🖼 | 👤 | 👥 | 🤖):
+{format_daily_series(weekly_stats)}
+
+{format_storage_stats(storage_stats)}"""
+
+    await query.message.edit_text(fit_message(stats_text), reply_markup=get_statistics_keyboard())
+
+async def show_statistics_section(query, section: str, bot_data: dict):
+    """Show one statistics sub-screen (stats_gemini, stats_routing...)."""
+    gemini = bot_data.get("gemini")
+    parts = []
+    if section == "stats_gemini" and gemini is not None:
+        parts.append(format_gemini_stats(gemini.get_stats()))
+    elif section == "stats_routing" and gemini is not None:
+        stats = gemini.get_stats()
+        parts.append(format_router_stats(stats["router"]))
+        if "scheduler" in stats:
+            parts.append(format_scheduler_stats(stats["scheduler"]))
+    elif section == "stats_conversations":
+        if bot_data.get("conversation_window") is not None:
+            parts.append(format_window_stats(bot_data["conversation_window"].get_stats()))
+        if bot_data.get("conversation_summarizer") is not None:
+            parts.append(format_summary_stats(bot_data["conversation_summarizer"].get_stats()))
+    elif section == "stats_images" and bot_data.get("image_preprocessor") is not None:
+        parts.append(format_image_stats(bot_data["image_preprocessor"].get_stats()))
+    elif section == "stats_groups" and bot_data.get("group_filter") is not None:
+        group_filter = bot_data["group_filter"]
+        parts.append(format_group_filter_stats(group_filter.get_stats(), group_filter.counters))
+
+    text = "\n\n".join(parts) or "لا توجد إحصائيات لهذا القسم."
+    await query.message.edit_text(fit_message(text), reply_markup=get_statistics_keyboard())
+
+def format_daily_series(series: list) -> str:
+    """Format per-day counters as one line per day."""
+    return "\n".join(
+        f"{day[5:]}: {counts['messages']} | {counts['images']} | {counts['new_users']}"
+        f" | {counts['group_messages']} | {counts['gemini_calls']}"
+        for day, counts in series
+    )
+
+def format_gemini_stats(stats: dict) -> str:
+    """Format the request counters of the Gemini client (since start-up)."""
+    lines = [
+        "🤖 Gemini منذ التشغيل:",
+        f"📨 الطلبات: {stats['requests']} | المرسلة فعلياً: {stats['upstream_calls']}"
+        f" | محاولات HTTP: {stats['attempts']}",
+        f"🔗 طلبات مكررة تمت مشاركتها: {stats['coalesced']} ({stats['saved_rate']:.0%})"
+        f" | قيد التنفيذ: {stats['in_flight']}",
+        f"⚡️ ردود متدفقة: {stats['streams']} | متوسط زمن أول جزء: {stats['first_token_avg']:.2f} ث",
+        f"✅ ناجحة: {stats['succeeded']} (بعد إعادة المحاولة: {stats['succeeded_after_retry']})"
+        f" | 🔁 إعادات: {stats['retries']} | ❌ فاشلة: {stats['failed']}"
+        f" | ⛔️ مرفوضة مباشرة: {stats['short_circuited']}",
+        f"🔤 متوسط التوكنات لكل طلب: دخل {stats['avg_input_tokens']:.0f} | خرج {stats['avg_output_tokens']:.0f}"
+        f" | دقة التقدير المحلي: {stats['estimate_ratio']:.2f}",
+    ]
+    if "breaker" in stats:
+        lines.append(format_breaker_stats(stats["breaker"]))
+    if "hedge" in stats:
+        lines.append(format_hedge_stats(stats["hedge"]))
+    return "\n".join(lines)
+
+def format_window_stats(stats: dict) -> str:
+    """Format the sizes of the conversation windows sent from private chats."""
+    return (
+        f"💬 سياق المحادثات (حد {stats['budget']} توكن):\n"
+        f"متوسط {stats['avg_tokens']:.0f} توكن و {stats['avg_turns']:.1f} رسالة لكل طلب"
+        f" | الأقصى {stats['max_tokens']} | رسائل خارج السياق: {stats['dropped_turns']}"
+        f" | طلبات مع ملخص: {stats['summarized']}"
+    )
+
+def format_summary_stats(stats: dict) -> str:
+    """Format the running summaries of long private conversations."""
+    return (
+        f"📝 ملخصات المحادثات: {stats['summaries']} (فشل {stats['failed']} | قيد الإعداد {stats['pending']})"
+        f" | مستخدمون: {stats['users']}\n"
+        f"رسائل مختصرة: {stats['folded_turns']} ({stats['folded_tokens']} ← {stats['summary_tokens']} توكن،"
+        f" {stats['compression']:.0%}) | تكلفة التلخيص: دخل {stats['input_tokens']} | خرج {stats['output_tokens']}"
+    )
+
+def format_image_stats(stats: dict) -> str:
+    """Format the bytes saved by downloading and shrinking photos before Gemini."""
+    return (
+        f"🖼 الصور المرسلة إلى Gemini: {stats['images']} (مصغرة: {stats['resized']})\n"
+        f"الحجم: {stats['sent_bytes'] / 1024:.0f} KB بدلاً من {stats['largest_bytes'] / 1024:.0f} KB"
+        f" | توفير {stats['bytes_saved'] / 1024:.0f} KB ({stats['saved_rate']:.0%})\n"
+        f"⏱ التحضير: {stats['avg_prepare_seconds']:.2f} ث | حتى الرد: {stats['avg_total_seconds']:.1f} ث"
+        f" (الأقصى {stats['max_total_seconds']:.1f} ث)"
+        f" | تحميل متدفق: {stats['streamed']}"
+        + (format_media_budget(stats["budget"]) if stats["budget"] else "")
+    )
+
+def format_media_budget(stats: dict) -> str:
+    """Format the in-flight image bytes budget."""
+    return (
+        f"\n📦 الصور قيد المعالجة: {stats['in_flight'] / 1024:.0f} / {stats['max_bytes'] / 1024:.0f} KB"
+        f" (الأقصى {stats['max_in_flight'] / 1024:.0f} KB) | انتظرت: {stats['waited']}"
+        f" ({stats['wait_seconds']:.1f} ث) | تنتظر الآن: {stats['waiting']} | رُفضت: {stats['rejected']}"
+    )
+
+def format_group_filter_stats(stats: dict, counters: dict, top: int = 5) -> str:
+    """Format the group messages the bot answered and the ones dropped without any work."""
+    lines = [
+        f"🧹 رسائل المجموعات: {stats['processed']} تمت معالجتها | {stats['dropped']} مستبعدة ({stats['drop_rate']:.0%})",
+        f"صور بدون الكلمة: {stats['photo_no_trigger']} | نصوص بدون الكلمة: {stats['no_trigger']}"
+        f" | ليست نصاً: {stats['not_text']} | مجموعات موقوفة: {stats['disabled']} ({stats['disabled_chats']})",
+    ]
+    busiest = sorted(counters.items(), key=lambda item: -(item[1]["processed"] + item[1]["dropped"]))[:top]
+    for chat_id, chat in busiest:
+        lines.append(f"• {chat_id}: {chat['processed']} معالجة | {chat['dropped']} مستبعدة")
+    return "\n".join(lines)
+
+def format_router_stats(stats: dict) -> str:
+    """Format the latency and errors of each Gemini model per route."""
+    lines = [f"🧭 النماذج (تحويل تلقائي: {stats['rerouted']} | بديل بعد فشل: {stats['fallbacks']}):"]
+    for route, model in stats["routes"].items():
+        lines.append(f"• {route} ← {model}")
+    for name, model in stats["models"].items():
+        if not model["samples"]:
+            continue
+        latency = f"p50 {model['p50']:.1f} / p95 {model['p95']:.1f} ث" if model["p50"] is not None else "—"
+        lines.append(f"{name}: {model['samples']} طلب | {latency} | أخطاء {model['error_rate']:.0%}")
+    return "\n".join(lines)
+
+def format_breaker_stats(stats: dict) -> str:
+    """Format the state of the Gemini circuit breaker."""
+    states = {"closed": "🟢 مغلق", "open": "🔴 مفتوح", "half_open": "🟡 تجربة"}
+    text = (f"🔌 قاطع الدائرة: {states.get(stats['state'], stats['state'])}"
+            f" | فشل آخر دقيقة: {stats['window_failures']}/{stats['window_requests']}"
+            f" | مرات الفتح: {stats['opened']}")
+    if stats["state"] == "open":
+        text += f" | يعود بعد {stats['retry_in']:.0f} ث"
+    return text
+
+def format_hedge_stats(stats: dict) -> str:
+    """Format the hedged Gemini calls and the latency they saved."""
+    lines = [
+        f"🪞 طلبات مكررة للتحوط: {stats['hedged']} من {stats['requests']} ({stats['rate']:.0%})"
+        f" | فاز المكرر: {stats['won']} | توكنات إضافية: {stats['extra_tokens']}"
+        f" | تجاوز الحد: {stats['capped']} | بلا مفتاح: {stats['no_key']}"
+    ]
+    names = {"stream": "أول جزء", "post": "الرد كاملاً"}
+    for name, kind in stats["kinds"].items():
+        if kind["p99"] is None:
+            continue
+        delay = f"{kind['delay']:.1f} ث" if kind["delay"] is not None else "—"
+        lines.append(
+            f"{names.get(name, name)}: p99 المحاولة الأولى ≥ {kind['p99']:.1f} ث ← المُقدَّم {kind['served_p99']:.1f} ث"
+            f" (p50 {kind['served_p50']:.1f}) | مهلة التكرار {delay}"
+        )
+    return "\n".join(lines)
+
+def format_scheduler_stats(stats: dict) -> str:
+    """Format the queues of the Gemini request scheduler."""
+    names = {"premium": "⭐️ المميزون", "private": "👤 الخاص", "group": "👥 المجموعات", "background": "🗂 الخلفية"}
+    lines = [f"🚦 طابور Gemini (قيد التنفيذ {stats['running']} من {stats['max_concurrent']}):",
+             "الانتظار الآن | أقصى طابور | متوسط/أقصى انتظار | المنتهية مهلتها"]
+    for name, queue in stats["classes"].items():
+        lines.append(
+            f"{names.get(name, name)}: {queue['depth']} | {queue['max_depth']}"
+            f" | {queue['avg_wait_seconds']:.1f}/{queue['max_wait_seconds']:.1f} ث | {queue['expired']}"
+        )
+    return "\n".join(lines)
+
+def format_storage_stats(stats: dict) -> str:
+    """Format the write counters of the database storage engine."""
+    text = f"💾 التخزين ({stats.get('mode', '-')}):"
+    if "mutations" in stats:
+        text += f"\n✏️ التعديلات: {stats['mutations']}"
+    if "writes" in stats:
+        text += f"\n📝 عمليات الكتابة: {stats['writes']}"
+    if "coalesced_mutations" in stats:
+        text += f"\n🧩 التعديلات المدمجة: {stats['coalesced_mutations']}"
+    if "bytes_written" in stats:
+        text += f"\n📦 البيانات المكتوبة: {stats['bytes_written'] / 1024:.1f} KB"
+    if "file_bytes" in stats:
+        text += f"\n📦 حجم قاعدة البيانات: {stats['file_bytes'] / 1024:.1f} KB"
+    if stats.get("writes") and "last_flush_ms" in stats:
+        text += (
+            f"\n⏱ زمن الكتابة: آخر {stats['last_flush_ms']:.1f} ms"
+            f" | متوسط {stats['avg_flush_ms']:.1f} ms | أقصى {stats['max_flush_ms']:.1f} ms"
+        )
+    return text
+
+def get_cache_keyboard(enabled: bool):
+    """Get response cache keyboard."""
+    keyboard = [
+        [InlineKeyboardButton("🧹 مسح الذاكرة", callback_data="cache_purge"),
+         InlineKeyboardButton("⏸ إيقاف" if enabled else "▶️ تشغيل", callback_data="cache_toggle")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="admin_back")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_response_cache(query, cache, similar_cache=None, notice: str = "", image_cache=None):
+    """Show response cache statistics."""
+    if cache is None:
+        await query.message.edit_text("ذاكرة الردود غير مفعلة.", reply_markup=get_admin_keyboard())
+        return
+
+    stats = cache.get_stats()
+    text = notice + (
+        f"🗃 ذاكرة الردود ({'تعمل ✅' if stats['enabled'] else 'متوقفة ⏸'}):\n\n"
+        f"📦 الردود المحفوظة: {stats['entries']}\n"
+        f"💾 الحجم: {stats['bytes'] / 1024:.0f} / {stats['max_bytes'] / 1024:.0f} KB\n"
+        f"🎯 الإصابات: {stats['hits']} | الإخفاقات: {stats['misses']} ({stats['hit_rate']:.0%})\n"
+        f"♻️ المحذوفة لامتلاء الذاكرة: {stats['evictions']} | المنتهية: {stats['expirations']}"
+    )
+    if similar_cache is not None:
+        similar = similar_cache.get_stats()
+        text += (
+            f"\n\n🔎 الأسئلة المشابهة (حد التشابه {similar['threshold']:.2f}):\n"
+            f"📦 الأسئلة المحفوظة: {similar['entries']}\n"
+            f"🎯 الإصابات: {similar['hits']} من {similar['lookups']} ({similar['hit_rate']:.0%})"
+            f" | غير المتطابقة حرفياً: {similar['near_hits']}\n"
+            f"🧪 المراجَعة: {similar['audits']} | الخاطئة: {similar['false_positives']}"
+            f" ({similar['false_positive_rate']:.0%})"
+        )
+    if image_cache is not None:
+        images = image_cache.get_stats()
+        phash = f"{images['phash_hits']} من {images['phash_lookups']}" if images['phash'] else "غير مفعلة"
+        text += (
+            f"\n\n🖼 تحليلات الصور:\n"
+            f"📦 المحفوظة: {images['entries']} | 💾 {images['bytes'] / 1024:.0f} / {images['max_bytes'] / 1024:.0f} KB\n"
+            f"🎯 الإصابات: {images['hits'] + images['phash_hits']} من {images['lookups']} ({images['hit_rate']:.0%})"
+            f" | بالبصمة: {phash}\n"
+            f"♻️ المحذوفة لامتلاء الذاكرة: {images['evictions']} | المنتهية: {images['expirations']}"
+        )
+    await query.message.edit_text(text, reply_markup=get_cache_keyboard(stats['enabled']))
+
+async def show_api_keys(query, gemini):
+    """Show the utilization of each Gemini API key."""
+    if gemini is None:
+        await query.message.edit_text("عميل Gemini غير متاح.", reply_markup=get_admin_keyboard())
+        return
+
+    text = "🔑 مفاتيح Gemini (الاستخدام خلال الدقيقة الأخيرة):\n"
+    for key in gemini.keys.get_stats():
+        status = f"⏸ متوقف {key['cooldown']:.0f} ث" if key['cooldown'] else "✅ متاح"
+        text += (
+            f"\n{key['label']} — {status}\n"
+            f"📨 الطلبات: {key['rpm_used']:.0%} | 🔤 التوكنات: {key['tpm_used']:.0%}\n"
+            f"المجموع: {key['requests']} طلب | {key['tokens']} توكن"
+            f" | 429: {key['rate_limited']} | أخطاء: {key['errors']}\n"
+        )
+    text += f"\n🕒 آخر تحديث: {datetime.now().strftime('%H:%M:%S')}"
+    await query.message.edit_text(text, reply_markup=InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 تحديث", callback_data="admin_keys")],
+        [InlineKeyboardButton("🔙 رجوع", callback_data="admin_back")]
+    ]))
 
 async def show_users(query, db):
     """Show users information."""
-    users = db.get_all_users()
-    active_users = [u for u in users if datetime.fromisoformat(u['last_active']).date() == datetime.now().date()]
+    total_users = await db.get_total_users()
+    active_today = await db.get_active_today_count()
     users_text = f"""👥 معلومات المستخدمين:
 
-📊 إجمالي المستخدمين: {len(users)}
-📱 المستخدمين النشطين اليوم: {len(active_users)}
+📊 إجمالي المستخدمين: {total_users}
+📱 المستخدمين النشطين اليوم: {active_today}
 
 آخر 5 مستخدمين نشطين:"""
 
-    sorted_users = sorted(users, key=lambda x: x['last_active'], reverse=True)[:5]
-    for user in sorted_users:
+    for user in await db.get_recent_active_users(5):
         users_text += f"\n- {user['first_name']} (@{user['username']}) | الرسائل: {user['message_count']}"
 
     await query.message.edit_text(users_text, reply_markup=get_admin_keyboard())
@@ -801,7 +1112,7 @@ async def start_unban(query: Update.callback_query, context: ContextTypes.DEFAUL
 
 async def show_premium_users(query, db):
     """Show list of premium users."""
-    premium_users = db.get_premium_users()
+    premium_users = await db.get_premium_users()
     
     if not premium_users:
         await query.message.edit_text(
@@ -813,7 +1124,7 @@ async def show_premium_users(query, db):
     # Get user details for each premium user
     premium_users_details = []
     for user_id in premium_users:
-        user_data = db.get_user_stats(int(user_id))
+        user_data = await db.get_user_stats(int(user_id))
         if user_data:
             username = user_data.get('username', 'غير معروف')
             first_name = user_data.get('first_name', 'غير معروف')
@@ -835,7 +1146,7 @@ async def show_premium_users(query, db):
 
 async def show_banned_users(query, db):
     """Show list of banned users."""
-    banned_users = db.data["banned_users"]
+    banned_users = await db.get_banned_users()
     if not banned_users:
         await query.message.edit_text(
             "لا يوجد مستخدمين محظورين حالياً. ✅",
@@ -845,7 +1156,7 @@ async def show_banned_users(query, db):
 
     banned_users_text = "📋 قائمة المستخدمين المحظورين:\n\n"
     for user_id in banned_users:
-        user_data = db.data["users"].get(str(user_id), {})
+        user_data = await db.get_user_info(user_id) or {}
         username = user_data.get("username", "")
         first_name = user_data.get("first_name", "")
         banned_users_text += f"- الاسم: {first_name}\n  المعرف: @{username}\n  رقم المعرف: {user_id}\n\n"
@@ -890,8 +1201,7 @@ async def handle_forward_ad_message(update: Update, context: ContextTypes.DEFAUL
 
     if context.user_data["admin_state"] == "waiting_forward_ad":
         # Get all users from database
-        all_users = db.data["users"].keys()
-        total_users = len(all_users)
+        total_users = await db.get_total_users()
         
         # Send confirmation message with user count
         confirm_msg = await message.reply_text(
@@ -914,20 +1224,18 @@ async def handle_forward_ad_message(update: Update, context: ContextTypes.DEFAUL
 async def show_groups(query, db):
     """Show groups information."""
     try:
-        groups = db.get_all_groups()
-        total_groups = len(groups)
-        active_groups = sum(1 for g in groups if g.get('message_count', 0) > 0)
+        counts = await db.get_group_counts()
         
         message = (
             f"📊 *إحصائيات المجموعات*\n\n"
-            f"📱 العدد الكلي: `{total_groups}`\n"
-            f"✅ المجموعات النشطة: `{active_groups}`\n"
-            f"⚠️ المجموعات غير النشطة: `{total_groups - active_groups}`\n\n"
+            f"📱 العدد الكلي: `{counts['total']}`\n"
+            f"✅ المجموعات النشطة: `{counts['active']}`\n"
+            f"⚠️ المجموعات غير النشطة: `{counts['inactive']}`\n\n"
             f"📋 *آخر 5 مجموعات:*\n"
         )
         
         # عرض آخر 5 مجموعات فقط لتجنب الرسائل الطويلة
-        for i, group in enumerate(groups[:5], 1):
+        for i, group in enumerate(await db.get_all_groups(limit=5), 1):
             group_name = group.get('title', 'مجموعة غير معروفة')
             message_count = group.get('message_count', 0)
             last_active = datetime.fromisoformat(group.get('last_active', datetime.now().isoformat()))
@@ -957,6 +1265,38 @@ async def show_groups(query, db):
         )
         logging.error(f"Error in show_groups: {str(e)}")
 
+async def show_group_search_results(send, search_query: str, page: int, db):
+    """عرض صفحة من نتائج البحث عن المجموعات.
+
+    send هي reply_text لرسالة جديدة أو edit_text عند التنقل بين الصفحات.
+    """
+    results, total = await db.search_groups_page(search_query, page)
+    page_size = GROUP_SEARCH_PAGE_SIZE
+    pages = max((total + page_size - 1) // page_size, 1)
+    page = min(max(page, 1), pages)
+
+    if not total:
+        message = f"🔍 لا توجد نتائج لـ <code>{html.escape(search_query)}</code>\n\nأرسل اسماً آخر للبحث"
+    else:
+        message = f"🔍 <b>نتائج البحث:</b> <code>{total}</code> (الصفحة {page}/{pages})\n"
+        for i, group in enumerate(results, (page - 1) * page_size + 1):
+            status = "✅ نشطة" if group.get('message_count', 0) > 0 else "⚠️ غير نشطة"
+            message += (
+                f"\n{i}. <b>{html.escape(group.get('title') or 'مجموعة غير معروفة')}</b>\n"
+                f"   📱 المعرف: <code>{group.get('chat_id')}</code>\n"
+                f"   💬 الرسائل: <code>{group.get('message_count', 0)}</code> | {status}\n"
+            )
+
+    navigation = []
+    if page > 1:
+        navigation.append(InlineKeyboardButton("⬅️ السابق", callback_data=f"group_search_page:{page - 1}"))
+    if page < pages:
+        navigation.append(InlineKeyboardButton("التالي ➡️", callback_data=f"group_search_page:{page + 1}"))
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_groups")])
+
+    await send(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+
 async def start_groups_broadcast(query: Update.callback_query, context: ContextTypes.DEFAULT_TYPE):
     """بدء عملية إرسال رسالة للمجموعات."""
     context.user_data['admin_state'] = 'waiting_groups_broadcast'
@@ -986,7 +1326,7 @@ async def start_groups_broadcast(query: Update.callback_query, context: ContextT
 async def handle_groups_broadcast(message: str, context: ContextTypes.DEFAULT_TYPE, db) -> None:
     """معالجة إرسال الرسالة للمجموعات."""
     try:
-        groups = db.get_all_groups()
+        groups = await db.get_all_groups()
         if not groups:
             await message.reply_text(
                 "⚠️ لا توجد مجموعات متاحة للإرسال",
@@ -1044,7 +1384,7 @@ async def execute_groups_broadcast(query: Update.callback_query, context: Contex
         "0% مكتمل"
     )
 
-    groups = db.get_all_groups()
+    groups = await db.get_all_groups()
     success_count = 0
     fail_count = 0
     total = len(groups)
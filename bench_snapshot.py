@@ -0,0 +1,99 @@
+"""Compare the start-up time of the JSON database file and the binary snapshot.
+
+    python bench_snapshot.py --users 10000 100000 1000000
+
+For each size a synthetic database is written in both formats to a temporary
+directory, then loaded the way Database does it: json.load + UserRecord for every
+user, versus opening the snapshot and decoding a sample of users on access.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import UserRecord
+from storage import Snapshot, write_snapshot
+
+
+def make_database(users: int) -> dict:
+    now = datetime.now()
+    data = {"users": {}, "banned_users": [], "premium_users": [], "groups": {},
+            "statistics": {"total_messages": 0, "total_images": 0, "daily_messages": {}}}
+    for user_id in range(100000000, 100000000 + users):
+        joined = now - timedelta(seconds=random.randint(0, 365 * 86400))
+        data["users"][str(user_id)] = {
+            "username": f"user{user_id}",
+            "first_name": random.choice(["محمد", "أحمد", "Sara", "John", "عبدالله"]),
+            "join_date": joined.isoformat(),
+            "message_count": random.randint(0, 5000),
+            "image_count": random.randint(0, 200),
+            "daily_image_count": {now.date().isoformat(): random.randint(0, 5)},
+            "last_active": (joined + timedelta(seconds=random.randint(0, 86400))).isoformat(),
+        }
+    return data
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def load_json(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {int(user_id): UserRecord.from_dict(user) for user_id, user in data.pop("users").items()}
+
+
+def load_snapshot(path: str, user_ids: list) -> int:
+    snapshot = Snapshot(path)
+    try:
+        for user_id in user_ids:
+            UserRecord(*snapshot.fields(snapshot.find(user_id))[1:])
+        return snapshot.count
+    finally:
+        snapshot.close()
+
+
+def bench(users: int, sample: int, directory: str) -> dict:
+    data = make_database(users)
+    json_file = os.path.join(directory, f"bench_{users}.json")
+    snapshot_file = os.path.join(directory, f"bench_{users}.snapshot")
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+    records = {int(user_id): UserRecord.from_dict(user) for user_id, user in data["users"].items()}
+    meta = {table: value for table, value in data.items() if table != "users"}
+    _, write_seconds = timed(lambda: write_snapshot(
+        snapshot_file, meta, (user.fields(user_id) for user_id, user in records.items())))
+
+    sample_ids = random.sample(list(records), min(sample, users))
+    del data, records
+    loaded, json_seconds = timed(lambda: load_json(json_file))
+    del loaded
+    _, snapshot_seconds = timed(lambda: load_snapshot(snapshot_file, sample_ids))
+    return {
+        "users": users,
+        "json_mb": os.path.getsize(json_file) / 1e6,
+        "snapshot_mb": os.path.getsize(snapshot_file) / 1e6,
+        "json_s": json_seconds,
+        "snapshot_s": snapshot_seconds,
+        "snapshot_write_s": write_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON vs binary snapshot start-up.")
+    parser.add_argument("--users", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--sample", type=int, default=1000, help="users decoded after opening the snapshot")
+    args = parser.parse_args()
+
+    print(f"{'users':>9} {'json MB':>8} {'snap MB':>8} {'json load':>10} {'snap load':>10} {'snap write':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for users in args.users:
+            result = bench(users, args.sample, directory)
+            print(f"{result['users']:>9} {result['json_mb']:>8.1f} {result['snapshot_mb']:>8.1f} "
+                  f"{result['json_s']:>9.2f}s {result['snapshot_s']:>9.3f}s {result['snapshot_write_s']:>10.2f}s")
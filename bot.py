@@ -1,15 +1,43 @@
 import logging
 import json
-import requests
 import time
-import base64
 import asyncio
+import signal
 from typing import Dict, List
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
-from config import TELEGRAM_TOKEN, GEMINI_API_KEY, GEMINI_API_URL, BOT_SIGNATURE, ADMIN_NOTIFICATION_ID
-from database import Database
+from telegram.error import BadRequest
+from config import (
+    TELEGRAM_TOKEN, GEMINI_VISION_TIMEOUT, BOT_SIGNATURE, ADMIN_NOTIFICATION_ID,
+    GEMINI_STREAMING, STREAM_EDIT_INTERVAL, BOT_CONCURRENT_UPDATES, CONVERSATION_TOKEN_BUDGET,
+    CONVERSATION_SUMMARY, CONVERSATION_SUMMARY_TRIGGER_TOKENS, CONVERSATION_SUMMARY_KEEP_TURNS,
+    CONVERSATION_SUMMARY_MAX_TOKENS, IMAGE_TARGET_SIDE, IMAGE_MAX_BYTES, IMAGE_JPEG_QUALITY, IMAGE_RESIZE,
+    MEDIA_MAX_INFLIGHT_BYTES, MEDIA_MAX_WAIT,
+    IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL, IMAGE_CACHE_PHASH_DISTANCE, GROUP_TRIGGER, GROUP_DISABLED_CHATS,
+    GEMINI_API_KEYS, GEMINI_KEY_RPM, GEMINI_KEY_TPM, GEMINI_KEY_COOLDOWN, GEMINI_KEY_MAX_WAIT,
+    GEMINI_MAX_CONCURRENT, GEMINI_QUEUE_WEIGHTS, GEMINI_QUEUE_MAX_WAIT,
+    GEMINI_RETRY_ATTEMPTS, GEMINI_RETRY_BASE_DELAY, GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BUDGET,
+    GEMINI_BREAKER_WINDOW, GEMINI_BREAKER_MIN_REQUESTS, GEMINI_BREAKER_FAILURE_RATE, GEMINI_BREAKER_OPEN_SECONDS,
+    GEMINI_HEDGING, GEMINI_HEDGE_PRIORITIES, GEMINI_HEDGE_QUANTILE, GEMINI_HEDGE_MIN_DELAY, GEMINI_HEDGE_MAX_RATE,
+    GEMINI_HEDGE_WINDOW, GEMINI_HEDGE_MIN_SAMPLES, GEMINI_HEDGE_OTHER_MODEL,
+    RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE,
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_AUDIT_RATE,
+    STATS_RECORD_INTERVAL,
+)
+from conversation import ConversationSummarizer, ConversationWindow
+from database import AsyncDatabase, create_database
+from gemini_client import GeminiAPIError, GeminiBusyError, GeminiClient, GeminiConnectionError, GeminiError
+from group_filter import GroupFilter
+from image_cache import ImageAnalysisCache
+from key_pool import KeyPool
+from media import ImagePreprocessor, MediaBudget, MediaBusyError
+from message_stream import MessageStreamer
+from resilience import CircuitBreaker, HedgePolicy, RetryPolicy
+from response_cache import ResponseCache, make_key
+from router import ROUTE_SHORT
+from scheduler import PRIORITY_PREMIUM, PRIORITY_PRIVATE, RequestScheduler
+from semantic_cache import SemanticCache
 from admin_panel import (
     admin_panel, 
     handle_admin_callback, 
@@ -43,10 +71,55 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize database
-db = Database()
+db = AsyncDatabase(create_database())
+
+# Shared Gemini HTTP client (connection pool used by every handler); calls are spread over
+# the API keys, the scheduler caps concurrent calls and serves premium users, private chats
+# and groups by priority, transient errors are retried, a circuit breaker stops calls
+# while Gemini is failing and slow private-chat calls can be hedged
+gemini = GeminiClient(
+    db,
+    keys=KeyPool(GEMINI_API_KEYS, GEMINI_KEY_RPM, GEMINI_KEY_TPM, GEMINI_KEY_COOLDOWN, GEMINI_KEY_MAX_WAIT),
+    scheduler=RequestScheduler(GEMINI_MAX_CONCURRENT, GEMINI_QUEUE_WEIGHTS, GEMINI_QUEUE_MAX_WAIT),
+    retry=RetryPolicy(GEMINI_RETRY_ATTEMPTS, GEMINI_RETRY_BASE_DELAY, GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BUDGET),
+    breaker=CircuitBreaker(
+        GEMINI_BREAKER_WINDOW, GEMINI_BREAKER_MIN_REQUESTS, GEMINI_BREAKER_FAILURE_RATE, GEMINI_BREAKER_OPEN_SECONDS
+    ),
+    hedge=HedgePolicy(
+        GEMINI_HEDGE_QUANTILE, GEMINI_HEDGE_MIN_DELAY, GEMINI_HEDGE_MAX_RATE, GEMINI_HEDGE_WINDOW,
+        GEMINI_HEDGE_MIN_SAMPLES, GEMINI_HEDGE_PRIORITIES, GEMINI_HEDGE_OTHER_MODEL,
+    ) if GEMINI_HEDGING else None,
+)
+
+# Answers to repeated and similar questions (shared with the group handler, purged from the admin panel)
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE)
+semantic_cache = SemanticCache(
+    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_AUDIT_RATE
+)
+
+# Photos are downloaded at the size Gemini needs, base64-encoded while they arrive, and
+# limited to MEDIA_MAX_INFLIGHT_BYTES at a time (shared with the group handler)
+image_preprocessor = ImagePreprocessor(
+    IMAGE_TARGET_SIDE, IMAGE_MAX_BYTES, IMAGE_JPEG_QUALITY, IMAGE_RESIZE,
+    budget=MediaBudget(MEDIA_MAX_INFLIGHT_BYTES, MEDIA_MAX_WAIT),
+)
+# Analyses of images that were already asked about (also shared with the group handler)
+image_cache = ImageAnalysisCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL, IMAGE_CACHE_PHASH_DISTANCE)
 
 # Dictionary to store conversation history
 conversation_history: Dict[int, List[Dict]] = {}
+# Turns of the history sent with each request (by estimated input tokens)
+conversation_window = ConversationWindow(CONVERSATION_TOKEN_BUDGET)
+# Running summaries of the older turns of long conversations (None when disabled)
+conversation_summarizer = ConversationSummarizer(
+    gemini, CONVERSATION_SUMMARY_TRIGGER_TOKENS, CONVERSATION_SUMMARY_KEEP_TURNS, CONVERSATION_SUMMARY_MAX_TOKENS
+) if CONVERSATION_SUMMARY else None
+
+def reset_conversation(user_id: int) -> None:
+    conversation_history[user_id] = []
+    if conversation_summarizer is not None:
+        conversation_summarizer.reset(user_id)
+
 
 def get_base_keyboard():
     """Get the base keyboard markup with 'محادثة جديدة' button."""
@@ -87,8 +160,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text(f"Your numeric ID is: {user_id}")
     
     # Add user to database
-    is_new_user = str(user_id) not in db.data["users"]
-    db.add_user(user_id, user.username or "", user.first_name)
+    is_new_user = not await db.user_exists(user_id)
+    await db.add_user(user_id, user.username or "", user.first_name)
     
     # Send notification to admin about new user
     if is_new_user:
@@ -104,11 +177,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             logger.error(f"Failed to send admin notification: {e}")
     
     # Check if user is banned
-    if db.is_user_banned(user_id):
+    if await db.is_user_banned(user_id):
         await update.message.reply_text("عذراً، تم حظرك من استخدام البوت.")
         return
 
-    conversation_history[user_id] = []
+    reset_conversation(user_id)
     welcome_message = (
         f"مرحباً بك {user.first_name} في بوت المساعد الذكي للطلاب! 👋\n\n"
         "يمكنني مساعدتك في:\n"
@@ -197,6 +270,30 @@ def format_text(text: str) -> str:
     final_text = '\n\n'.join(part for part in formatted_parts if part.strip())
     return final_text
 
+def rewrite_credit(text: str) -> str:
+    """Replace Gemini's "trained by Google" line with the bot's own credit."""
+    return text.replace("تم تدريبي بواسطة جوجل", "تم تدريبي بواسطة جوجل وتم ربطي في البوت وبرمجتي لاتعامل مع المستخدمين من قبل وهيب الشرعبي")
+
+async def send_final_answer(update: Update, placeholder, text: str, streamer=None):
+    """Show the complete answer in the placeholder it was streamed into. Without streamed
+    edits (or when the edit is rejected: too long, invalid HTML) the placeholder is
+    replaced by a new message as before."""
+    if streamer is not None and streamer.edits:
+        try:
+            return await placeholder.edit_text(text, parse_mode='HTML')
+        except BadRequest as e:
+            logger.error(f"Could not edit streamed answer: {str(e)}")
+    await placeholder.delete()
+    return await update.message.reply_text(text, reply_markup=get_base_keyboard(), parse_mode='HTML')
+
+async def reply_cached_analysis(update: Update, text: str):
+    """Answer a photo with an analysis from the image cache."""
+    await update.message.reply_text(
+        f"{format_text(text)}{BOT_SIGNATURE}",
+        reply_markup=get_base_keyboard(),
+        parse_mode='HTML'
+    )
+
 def add_signature(text: str):
     """Add a signature to long messages"""
     signature = "\n\n━━━━━━━━━━━━━━\n📢 قناة التلجرام: @SyberSc71\n👨‍💻 برمجة: @WAT4F"
@@ -221,7 +318,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         user_message = update.message.text
 
         # Check if user is banned
-        if db.is_user_banned(user_id):
+        if await db.is_user_banned(user_id):
             await update.message.reply_text("عذراً، تم حظرك من استخدام البوت.")
             return
 
@@ -238,7 +335,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         # Check if user clicked "محادثة جديدة" button
         if user_message == "🔄 محادثة جديدة":
-            conversation_history[user_id] = []
+            reset_conversation(user_id)
             await update.message.reply_text(
                 f"تم بدء محادثة جديدة! كيف يمكنني مساعدتك؟{BOT_SIGNATURE}",
                 reply_markup=get_base_keyboard()
@@ -246,7 +343,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
         
         # Update user activity in database
-        db.update_user_activity(user_id, "text")
+        await db.update_user_activity(user_id, "text")
         
         # Initialize conversation history if it doesn't exist
         if user_id not in conversation_history:
@@ -258,9 +355,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "parts": [{"text": f"{user_message} ( استخدم ايموجات تفاعلية اذا لزم الامر بس اذا كان كود برمجي مافيش داعي  )"}]
         })
         
-        # Prepare conversation context
-        # Keep last 10 messages for better context understanding
-        messages = conversation_history[user_id][-10:]
+        # Prepare conversation context: the summary of older turns and the most recent
+        # turns that fit in the token budget
+        summary = conversation_summarizer.summary(user_id) if conversation_summarizer else None
+        messages = conversation_window.build(conversation_history[user_id], summary)
         
         # Prepare the request payload with conversation history
         payload = {
@@ -273,57 +371,81 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             }
         }
         
-        # Make request to Gemini API
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Send "thinking" message
-        thinking_message = await update.message.reply_text("جار التفكير... ⏳")
-        
-        try:
-            response = requests.post(
-                f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-                headers=headers,
-                json=payload,
-                timeout=30  # Add timeout
-            )
-            
-            # Delete thinking message
-            await thinking_message.delete()
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                ai_response = response_data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', 'عذراً، لم أستطع فهم الرسالة.')
-                
-                # Format the response text
-                parts = ai_response.split("تم تدريبي بواسطة جوجل")
-                ai_response = "تم تدريبي بواسطة جوجل وتم ربطي في البوت وبرمجتي لاتعامل مع المستخدمين من قبل وهيب الشرعبي".join(parts)
-
-                ai_response = format_text(ai_response)
-                
-                # Add AI response to history
+        # The first message of a conversation doesn't depend on earlier turns, so its answer can be cached
+        cache_key = similar = None
+        if len(conversation_history[user_id]) == 1 and summary is None:
+            cache_key = make_key(messages[0]["parts"][0]["text"], payload["generationConfig"], ROUTE_SHORT)
+            cached_response = response_cache.get(cache_key)
+            if cached_response is None:
+                similar = semantic_cache.lookup(user_message, "private")
+                if similar is not None and not similar.audit:
+                    cached_response = similar.answer
+            if cached_response is not None:
                 conversation_history[user_id].append({
                     "role": "assistant",
-                    "parts": [{"text": ai_response}]
+                    "parts": [{"text": cached_response}]
                 })
-                
                 await update.message.reply_text(
-                    f"{ai_response}{BOT_SIGNATURE}",
-                    reply_markup=get_base_keyboard(),
-                    parse_mode='HTML'
-                )
-            else:
-                error_message = f"خطأ في الAPI: {response.status_code}\n{response.text}"
-                logger.error(error_message)
-                await thinking_message.delete()
-                await update.message.reply_text(
-                    f"عذراً، حدث خطأ في معالجة طلبك. الرجاء المحاولة مرة أخرى.{BOT_SIGNATURE}",
+                    f"{cached_response}{BOT_SIGNATURE}",
                     reply_markup=get_base_keyboard(),
                     parse_mode='HTML'
                 )
+                return
+        
+        # Send "thinking" message
+        thinking_message = await update.message.reply_text("جار التفكير... ⏳")
+        
+        streamer = None
+        if GEMINI_STREAMING:
+            streamer = MessageStreamer(
+                thinking_message, lambda text: format_text(rewrite_credit(text)), STREAM_EDIT_INTERVAL
+            )
+        
+        try:
+            priority = PRIORITY_PREMIUM if await db.is_user_premium(user_id) else PRIORITY_PRIVATE
+            result = await gemini.generate(payload, on_text=streamer.update if streamer else None,
+                                           priority=priority, user_id=user_id)
+            
+            ai_response = result.text or 'عذراً، لم أستطع فهم الرسالة.'
+            
+            # Format the response text
+            ai_response = format_text(rewrite_credit(ai_response))
+            if cache_key and result.text:
+                response_cache.put(cache_key, ai_response)
+                semantic_cache.add(user_message, ai_response, "private")
+                if similar is not None:
+                    semantic_cache.record_audit(similar, ai_response)
+            
+            # Add AI response to history
+            conversation_history[user_id].append({
+                "role": "assistant",
+                "parts": [{"text": ai_response}]
+            })
+            if conversation_summarizer is not None:
+                conversation_summarizer.maybe_summarize(user_id, conversation_history[user_id])
+            
+            await send_final_answer(update, thinking_message, f"{ai_response}{BOT_SIGNATURE}", streamer)
                 
-        except requests.exceptions.RequestException as e:
+        except GeminiAPIError as e:
+            error_message = f"خطأ في الAPI: {e.status}\n{e.body[:500]}"
+            logger.error(error_message)
+            await thinking_message.delete()
+            # 429/5xx that outlasted the retries: ask to wait instead of inviting an immediate resend
+            await update.message.reply_text(
+                f"عذراً، هناك ضغط كبير على البوت حالياً. الرجاء المحاولة بعد قليل.{BOT_SIGNATURE}" if e.retryable else
+                f"عذراً، حدث خطأ في معالجة طلبك. الرجاء المحاولة مرة أخرى.{BOT_SIGNATURE}",
+                reply_markup=get_base_keyboard(),
+                parse_mode='HTML'
+            )
+        except GeminiBusyError as e:
+            logger.error(str(e))
+            await thinking_message.delete()
+            await update.message.reply_text(
+                f"عذراً، هناك ضغط كبير على البوت حالياً. الرجاء المحاولة بعد قليل.{BOT_SIGNATURE}",
+                reply_markup=get_base_keyboard(),
+                parse_mode='HTML'
+            )
+        except GeminiConnectionError as e:
             logger.error(f"Network error in API request: {str(e)}")
             await thinking_message.delete()
             await update.message.reply_text(
@@ -354,17 +476,19 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
     
     try:
+        started = time.monotonic()
         user = update.effective_user
         user_id = user.id
 
         # Check if user is banned
-        if db.is_user_banned(user_id):
+        if await db.is_user_banned(user_id):
             await update.message.reply_text("عذراً، تم حظرك من استخدام البوت.")
             return
 
         # Check daily image limit for non-premium users
-        if not db.is_user_premium(user_id):
-            daily_count = db.get_daily_image_count(user_id)
+        is_premium = await db.is_user_premium(user_id)
+        if not is_premium:
+            daily_count = await db.get_daily_image_count(user_id)
             if daily_count >= 5:
                 keyboard = [
                     [InlineKeyboardButton("⭐️ الترقية للعضوية المميزة", url="https://t.me/WAT4F")],
@@ -379,86 +503,93 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
                 return
 
         # Update user activity in database
-        db.update_user_activity(user_id, "image")
-        
-        # Get the photo file
-        photo = update.message.photo[-1]  # Get the largest photo size
-        photo_file = await context.bot.get_file(photo.file_id)
-        
-        # Download the photo
-        photo_data = await photo_file.download_as_bytearray()
+        await db.update_user_activity(user_id, "image")
         
-        # Convert the photo to base64
-        base64_image = base64.b64encode(photo_data).decode('utf-8')
+        # The same image with the same question was already analyzed (forwarded copies share file_unique_id)
+        file_unique_id = update.message.photo[-1].file_unique_id
+        question = update.message.caption
+        cached_response = image_cache.get(file_unique_id, question, "private")
+        if cached_response is not None:
+            await reply_cached_analysis(update, cached_response)
+            return
         
-        # Get caption if exists
-        caption = update.message.caption or "قم بتحليل هذه الصورة وشرح محتواها"
-        caption = f"{caption} (ملاحظه لا تكتبها بالرساله (استخدم ايموجات تفاعلية بالنص وحاول التنسيق بين الغات  بحث يسهل القراءه واجعل الشرح مفهوم  .لا تكتب بالرد اني قلت لك كذه ) )"
+        # Wait while too many image bytes are being processed (MEDIA_MAX_INFLIGHT_BYTES)
+        async with image_preprocessor.hold(update.message.photo):
+            # Download the photo (the smallest size that is still large enough), base64-encoded as it arrives
+            image = await image_preprocessor.prepare(context.bot, update.message.photo)
+            # A re-uploaded copy of a cached image has another file_unique_id but a close perceptual hash
+            image_hash = await image_cache.fingerprint(image)
+            cached_response = image_cache.get_similar(image_hash, question, "private")
+            if cached_response is not None:
+                image_cache.put(file_unique_id, question, "private", cached_response, image_hash)
+                await reply_cached_analysis(update, cached_response)
+                return
+            
+            # Get caption if exists
+            caption = update.message.caption or "قم بتحليل هذه الصورة وشرح محتواها"
+            caption = f"{caption} (ملاحظه لا تكتبها بالرساله (استخدم ايموجات تفاعلية بالنص وحاول التنسيق بين الغات  بحث يسهل القراءه واجعل الشرح مفهوم  .لا تكتب بالرد اني قلت لك كذه ) )"
         
-        # Prepare the request payload
-        payload = {
-            "contents": [{
-                "role": "user",
-                "parts": [
-                    {"text": caption},
-                    {
-                        "inline_data": {
-                            "mime_type": "image/jpeg",
-                            "data": base64_image
+            # Prepare the request payload
+            payload = {
+                "contents": [{
+                    "role": "user",
+                    "parts": [
+                        {"text": caption},
+                        {
+                            "inline_data": {
+                                "mime_type": "image/jpeg",
+                                "data": image
+                            }
                         }
-                    }
-                ]
-            }],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 32,
-                "topP": 1,
-                "maxOutputTokens": 4096,
+                    ]
+                }],
+                "generationConfig": {
+                    "temperature": 0.7,
+                    "topK": 32,
+                    "topP": 1,
+                    "maxOutputTokens": 4096,
+                }
             }
-        }
-        
-        # Send waiting message
-        processing_message = await update.message.reply_text("جاري معالجة الصورة... ⏳")
         
-        # Make request to Gemini Vision API
-        headers = {
-            "Content-Type": "application/json"
-        }
+            # Send waiting message
+            processing_message = await update.message.reply_text("جاري معالجة الصورة... ⏳")
         
-        vision_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+            streamer = MessageStreamer(processing_message, format_text, STREAM_EDIT_INTERVAL) if GEMINI_STREAMING else None
         
-        response = requests.post(
-            f"{vision_url}?key={GEMINI_API_KEY}",
-            headers=headers,
-            json=payload
-        )
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            ai_response = response_data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', 'عذراً، لم أستطع تحليل الصورة.')
-            
-            # Format the response text using the same formatting function
-            formatted_response = format_text(ai_response)
+            try:
+                result = await gemini.generate(payload, timeout=GEMINI_VISION_TIMEOUT,
+                                               on_text=streamer.update if streamer else None,
+                                               priority=PRIORITY_PREMIUM if is_premium else PRIORITY_PRIVATE,
+                                               user_id=user_id)
+                ai_response = result.text or 'عذراً، لم أستطع تحليل الصورة.'
+                if result.text:
+                    image_cache.put(file_unique_id, question, "private", result.text, image_hash)
             
-            # Delete processing message
-            await processing_message.delete()
+                # Format the response text using the same formatting function
+                formatted_response = format_text(ai_response)
             
-            # Send the analysis with HTML formatting
-            await update.message.reply_text(
-                f"{formatted_response}{BOT_SIGNATURE}",
-                reply_markup=get_base_keyboard(),
-                parse_mode='HTML'
-            )
-        else:
-            await processing_message.delete()
-            error_message = f"خطأ في الAPI: {response.status_code}\n{response.text}"
-            logger.error(error_message)
-            await update.message.reply_text(
-                f"عذراً، حدث خطأ في معالجة الصورة. الرجاء المحاولة مرة أخرى.{BOT_SIGNATURE}",
-                reply_markup=get_base_keyboard(),
-                parse_mode='HTML'
-            )
+                # Send the analysis with HTML formatting
+                await send_final_answer(update, processing_message, f"{formatted_response}{BOT_SIGNATURE}", streamer)
+                image_preprocessor.record_answer(time.monotonic() - started)
+            except GeminiError as e:
+                await processing_message.delete()
+                error_message = f"خطأ في الAPI: {e.status}\n{e.body[:500] or e}"
+                logger.error(error_message)
+                busy = isinstance(e, GeminiBusyError) or e.retryable
+                await update.message.reply_text(
+                    f"عذراً، هناك ضغط كبير على البوت حالياً. الرجاء المحاولة بعد قليل.{BOT_SIGNATURE}" if busy else
+                    f"عذراً، حدث خطأ في معالجة الصورة. الرجاء المحاولة مرة أخرى.{BOT_SIGNATURE}",
+                    reply_markup=get_base_keyboard(),
+                    parse_mode='HTML'
+                )
             
+    except MediaBusyError as e:
+        logger.error(f"Error in handle_photo: {str(e)}")
+        await update.message.reply_text(
+            f"عذراً، هناك ضغط كبير على البوت حالياً. الرجاء المحاولة بعد قليل.{BOT_SIGNATURE}",
+            reply_markup=get_base_keyboard(),
+            parse_mode='HTML'
+        )
     except Exception as e:
         logger.error(f"Error in handle_photo: {str(e)}")
         await update.message.reply_text(
@@ -492,7 +623,7 @@ async def admin_callback_wrapper(update: Update, context: ContextTypes.DEFAULT_T
                     parse_mode='Markdown'
                 )
             elif query.data == "groups_inactive":
-                inactive_groups = [g for g in db.get_all_groups() if g.get('message_count', 0) == 0]
+                inactive_groups = await db.get_inactive_groups()
                 message = "⚠️ *المجموعات غير النشطة*\n\n"
                 
                 if not inactive_groups:
@@ -501,8 +632,8 @@ async def admin_callback_wrapper(update: Update, context: ContextTypes.DEFAULT_T
                     for i, group in enumerate(inactive_groups, 1):
                         message += f"{i}. *{group.get('title', 'مجموعة غير معروفة')}*\n"
                         message += f"   📱 المعرف: `{group.get('chat_id')}`\n"
-                        join_date = datetime.fromisoformat(group.get('join_date', datetime.now().isoformat()))
-                        days_since_join = (datetime.now() - join_date).days
+                        join_date = datetime.datetime.fromisoformat(group.get('join_date', datetime.datetime.now().isoformat()))
+                        days_since_join = (datetime.datetime.now() - join_date).days
                         message += f"   ⏰ مضى على الانضمام: `{days_since_join} يوم`\n\n"
                 
                 await query.message.edit_text(
@@ -517,21 +648,21 @@ async def admin_callback_wrapper(update: Update, context: ContextTypes.DEFAULT_T
                     reply_markup=None
                 )
                 
-                groups = db.get_all_groups()
+                groups = await db.get_all_groups()
                 updated = 0
                 removed = 0
                 
                 for group in groups:
                     try:
                         chat = await context.bot.get_chat(int(group['chat_id']))
-                        db.update_group_info(group['chat_id'], {
+                        await db.update_group_info(group['chat_id'], {
                             'title': chat.title,
-                            'members_count': chat.get_member_count()
+                            'members_count': await chat.get_member_count()
                         })
                         updated += 1
                     except telegram.error.BadRequest:
                         # المجموعة غير موجودة أو تم طرد البوت
-                        db.remove_group(group['chat_id'])
+                        await db.remove_group(group['chat_id'])
                         removed += 1
                     except Exception as e:
                         logging.error(f"Error updating group {group['chat_id']}: {str(e)}")
@@ -546,8 +677,8 @@ async def admin_callback_wrapper(update: Update, context: ContextTypes.DEFAULT_T
                     parse_mode='Markdown'
                 )
             elif query.data == "groups_cleanup":
-                inactive_groups = [g for g in db.get_all_groups() if g.get('message_count', 0) == 0]
-                if not inactive_groups:
+                inactive_count = (await db.get_group_counts())['inactive']
+                if not inactive_count:
                     await query.message.edit_text(
                         "✨ لا توجد مجموعات غير نشطة للحذف!",
                         reply_markup=get_groups_keyboard()
@@ -557,7 +688,7 @@ async def admin_callback_wrapper(update: Update, context: ContextTypes.DEFAULT_T
                 # تأكيد الحذف
                 await query.message.edit_text(
                     f"⚠️ *تأكيد الحذف*\n\n"
-                    f"سيتم حذف {len(inactive_groups)} مجموعة غير نشطة.\n"
+                    f"سيتم حذف {inactive_count} مجموعة غير نشطة.\n"
                     f"هل أنت متأكد؟",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("✅ نعم، احذف", callback_data="confirm_cleanup"),
@@ -626,16 +757,48 @@ async def clear_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in clear_messages: {str(e)}")
         await update.message.reply_text("حدث خطأ أثناء محاولة حذف الرسائل.")
 
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(0)
+
+async def _post_init(application: Application) -> None:
+    # فتح الاتصال مع Gemini مسبقاً حتى لا يدفع أول مستخدم تكلفة الاتصال
+    await gemini.warm_up()
+    application.bot_data["gemini_calls_task"] = asyncio.create_task(
+        gemini.record_calls_periodically(STATS_RECORD_INTERVAL)
+    )
+
+async def _post_shutdown(application: Application) -> None:
+    task = application.bot_data.pop("gemini_calls_task", None)
+    if task is not None:
+        task.cancel()
+    await gemini.record_calls()
+    await gemini.close()
+    await image_preprocessor.close()
+    response_cache.save()
+
 def main() -> None:
     """Start the bot."""
-    # Initialize the database
-    db = Database()
-
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(TELEGRAM_TOKEN).connect_timeout(30).read_timeout(30).write_timeout(30).pool_timeout(30).build()
+    application = (
+        Application.builder().token(TELEGRAM_TOKEN)
+        .connect_timeout(30).read_timeout(30).write_timeout(30).pool_timeout(30)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .post_init(_post_init).post_shutdown(_post_shutdown)
+        .build()
+    )
 
     # إنشاء معالج المجموعات
-    group_handler = GroupHandler(db)
+    group_filter = GroupFilter(GROUP_TRIGGER, GROUP_DISABLED_CHATS)
+    group_handler = GroupHandler(db, gemini, response_cache, semantic_cache, image_preprocessor, image_cache,
+                                 group_filter)
+    application.bot_data["gemini"] = gemini
+    application.bot_data["conversation_window"] = conversation_window
+    application.bot_data["conversation_summarizer"] = conversation_summarizer
+    application.bot_data["response_cache"] = response_cache
+    application.bot_data["semantic_cache"] = semantic_cache
+    application.bot_data["image_preprocessor"] = image_preprocessor
+    application.bot_data["image_cache"] = image_cache
+    application.bot_data["group_filter"] = group_filter
 
     # Add conversation handler
     application.add_handler(CallbackQueryHandler(check_subscription_callback, pattern="^check_subscription$"))
@@ -667,13 +830,20 @@ def main() -> None:
     ))
 
     # Start the Bot
-    while True:
-        try:
-            application.run_polling(allowed_updates=Update.ALL_TYPES)
-        except Exception as e:
-            logger.error(f"An error occurred: {e}. Retrying in 10 seconds...")
-            time.sleep(10)
-            continue
+    try:
+        while True:
+            # run_polling stops cleanly on SIGINT/SIGTERM; outside of it turn SIGTERM
+            # into SystemExit so the database is still flushed below
+            signal.signal(signal.SIGTERM, _exit_on_sigterm)
+            try:
+                application.run_polling(allowed_updates=Update.ALL_TYPES)
+                break  # stopped by a signal, not by an error
+            except Exception as e:
+                logger.error(f"An error occurred: {e}. Retrying in 10 seconds...")
+                time.sleep(10)
+                continue
+    finally:
+        db.close()
 
 if __name__ == "__main__":
     main()
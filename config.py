@@ -3,9 +3,135 @@ TELEGRAM_TOKEN = "5967242705:AAHctMo6B6How2_8HHo00xtsuOHQX2K4hG4"
 
 # Google Gemini API Key
 GEMINI_API_KEY = "API Key"
+# All keys the bot may use; calls go to the least loaded key with quota left
+GEMINI_API_KEYS = [GEMINI_API_KEY]
+# Client-side quota of each key; set them to the key's tier (free tier of 1.5 Flash: 15 / 1000000)
+GEMINI_KEY_RPM = None  # requests per minute allowed for each key (None = no limit)
+GEMINI_KEY_TPM = None  # tokens per minute for each key (None = no limit)
+GEMINI_KEY_COOLDOWN = 60  # seconds a key rests after a 429 without Retry-After
+GEMINI_KEY_MAX_WAIT = 10  # seconds a call may wait for a key with quota before "busy"
 # Gemini API endpoint
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
-GEMINI_VISION_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+GEMINI_MODELS_URL = GEMINI_BASE_URL
+
+# Models for each kind of request (router.py), preferred first: the next one is used when
+# a model fails or its p95 latency over the last GEMINI_ROUTER_WINDOW seconds passes
+# GEMINI_ROUTE_MAX_P95 / its error rate passes GEMINI_ROUTER_MAX_ERROR_RATE
+GEMINI_MODEL_ROUTES = {
+    "short": ["gemini-1.5-flash-latest", "gemini-1.5-flash-8b-latest"],
+    "long": ["gemini-1.5-flash-latest", "gemini-1.5-flash-8b-latest"],
+    "image": ["gemini-1.5-flash", "gemini-1.5-flash-8b"],
+}
+GEMINI_LONG_CONTEXT_TOKENS = 2000  # estimated prompt tokens from which a conversation is "long"
+GEMINI_ROUTE_MAX_P95 = {"short": 10, "long": 20, "image": 30}  # seconds
+GEMINI_ROUTER_MAX_ERROR_RATE = 0.3
+GEMINI_ROUTER_MIN_SAMPLES = 10
+GEMINI_ROUTER_WINDOW = 300  # seconds
+
+# Gemini HTTP client (gemini_client.py): timeouts in seconds and connection pool size
+GEMINI_TIMEOUT = 30
+GEMINI_VISION_TIMEOUT = 60  # image requests upload the photo and take longer
+GEMINI_CONNECT_TIMEOUT = 10
+GEMINI_MAX_CONNECTIONS = 20
+GEMINI_KEEPALIVE_EXPIRY = 120  # seconds an idle connection is kept open
+
+# Gemini request scheduler (scheduler.py): at most GEMINI_MAX_CONCURRENT calls run at once,
+# the others wait in the queue of their class. Free slots go to the classes in proportion
+# to GEMINI_QUEUE_WEIGHTS and users of a class take turns; a request that waited
+# GEMINI_QUEUE_MAX_WAIT seconds is answered with "busy"
+GEMINI_MAX_CONCURRENT = 8
+GEMINI_QUEUE_WEIGHTS = {"premium": 4, "private": 2, "group": 1, "background": 1}
+GEMINI_QUEUE_MAX_WAIT = {"premium": 60, "private": 30, "group": 20, "background": 120}
+
+# Retries of 429/5xx answers and network errors: jittered exponential backoff (or the
+# server's Retry-After when longer), at most GEMINI_RETRY_ATTEMPTS attempts and
+# GEMINI_RETRY_BUDGET seconds from the first attempt
+GEMINI_RETRY_ATTEMPTS = 3
+GEMINI_RETRY_BASE_DELAY = 0.5  # seconds
+GEMINI_RETRY_MAX_DELAY = 8
+GEMINI_RETRY_BUDGET = 20
+
+# Circuit breaker: when GEMINI_BREAKER_FAILURE_RATE of the attempts in the last
+# GEMINI_BREAKER_WINDOW seconds failed (at least GEMINI_BREAKER_MIN_REQUESTS attempts),
+# requests are answered with "busy" for GEMINI_BREAKER_OPEN_SECONDS, then one trial call is made
+GEMINI_BREAKER_WINDOW = 60
+GEMINI_BREAKER_MIN_REQUESTS = 10
+GEMINI_BREAKER_FAILURE_RATE = 0.5
+GEMINI_BREAKER_OPEN_SECONDS = 30
+
+# Request hedging for private chats: a call that hasn't answered (or streamed its first text)
+# after the GEMINI_HEDGE_QUANTILE of the recent latencies (at least GEMINI_HEDGE_MIN_DELAY)
+# is sent again on another API key - or the next model of the route with
+# GEMINI_HEDGE_OTHER_MODEL - and the slower call is cancelled. At most GEMINI_HEDGE_MAX_RATE
+# of the last GEMINI_HEDGE_WINDOW requests are hedged. Hedges spend extra quota, so it is opt-in.
+GEMINI_HEDGING = False
+GEMINI_HEDGE_PRIORITIES = ["premium", "private"]
+GEMINI_HEDGE_QUANTILE = 0.95
+GEMINI_HEDGE_MIN_DELAY = 2.0  # seconds
+GEMINI_HEDGE_MAX_RATE = 0.1
+GEMINI_HEDGE_WINDOW = 200
+GEMINI_HEDGE_MIN_SAMPLES = 20
+GEMINI_HEDGE_OTHER_MODEL = False
+
+# Updates handled at the same time (python-telegram-bot processes one at a time by default)
+BOT_CONCURRENT_UPDATES = 64
+
+# Groups: the bot only answers photos whose caption contains GROUP_TRIGGER, texts that start
+# with it and replies to its own messages; chats in GROUP_DISABLED_CHATS are ignored
+GROUP_TRIGGER = "cyber"
+GROUP_DISABLED_CHATS = []  # chat ids, e.g. [-1001234567890]
+
+# Stream answers (streamGenerateContent) and edit the "thinking" message as the text arrives.
+# Telegram rate-limits edits, so a message is edited at most once per interval and only
+# after STREAM_MIN_CHARS new characters
+GEMINI_STREAMING = True
+STREAM_EDIT_INTERVAL = 1.0  # seconds, private chats
+STREAM_GROUP_EDIT_INTERVAL = 3.0  # seconds, groups allow about 20 edits a minute
+STREAM_MIN_CHARS = 40
+
+# Private chats send the most recent turns that fit in this many estimated input tokens
+CONVERSATION_TOKEN_BUDGET = 6000
+
+# Once a private conversation passes CONVERSATION_SUMMARY_TRIGGER_TOKENS, everything but the
+# last CONVERSATION_SUMMARY_KEEP_TURNS turns is folded into a running summary (made in the
+# background, at most CONVERSATION_SUMMARY_MAX_TOKENS long) that is sent in front of the window
+CONVERSATION_SUMMARY = True
+CONVERSATION_SUMMARY_TRIGGER_TOKENS = 3000
+CONVERSATION_SUMMARY_KEEP_TURNS = 6
+CONVERSATION_SUMMARY_MAX_TOKENS = 400
+
+# Photos: the smallest Telegram size whose longer side reaches IMAGE_TARGET_SIDE pixels is
+# downloaded; with Pillow installed and IMAGE_RESIZE on, a larger result is downscaled and
+# recompressed as JPEG to fit in IMAGE_MAX_BYTES
+IMAGE_TARGET_SIDE = 1280
+IMAGE_MAX_BYTES = 400 * 1024
+IMAGE_JPEG_QUALITY = 85
+IMAGE_RESIZE = True
+
+# At most MEDIA_MAX_INFLIGHT_BYTES of (base64) image data are downloaded and sent to Gemini at
+# the same time; further photos wait up to MEDIA_MAX_WAIT seconds and are then answered "busy"
+MEDIA_MAX_INFLIGHT_BYTES = 32 * 1024 * 1024
+MEDIA_MAX_WAIT = 30  # seconds
+
+# Analyses of images (keyed by Telegram's file_unique_id and the caption) reused for the same
+# image and question. With Pillow, images within IMAGE_CACHE_PHASH_DISTANCE bits of perceptual
+# hash also match (re-uploaded copies); None turns that off
+IMAGE_CACHE_MAX_BYTES = 4 * 1024 * 1024
+IMAGE_CACHE_TTL = 24 * 3600  # seconds
+IMAGE_CACHE_PHASH_DISTANCE = 4
+
+# Exact-match cache of Gemini answers (group questions and first messages of private chats)
+RESPONSE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+RESPONSE_CACHE_TTL = 6 * 3600  # seconds
+RESPONSE_CACHE_FILE = "response_cache.json"  # None keeps the cache in memory only
+
+# Similar-question cache: answers are reused for questions whose normalized words are at
+# least SEMANTIC_CACHE_THRESHOLD similar (Jaccard of character trigrams, 0..1).
+# SEMANTIC_CACHE_AUDIT_RATE of the hits still go to Gemini to measure false positives.
+SEMANTIC_CACHE_THRESHOLD = 0.75
+SEMANTIC_CACHE_MAX_ENTRIES = 5000
+SEMANTIC_CACHE_TTL = 24 * 3600  # seconds
+SEMANTIC_CACHE_AUDIT_RATE = 0.05
 
 # OpenAI API Key
 OPENAI_API_KEY = "YOUR_OPENAI_API_KEY"  # قم بتغيير هذا المفتاح بمفتاح OpenAI API الخاص بك
@@ -19,5 +145,44 @@ ADMIN_NOTIFICATION_ID = 5887234832  # Replace with your actual numeric ID
 # Database file
 DB_FILE = "bot_database.json"
 
+# Database backend: "json" keeps everything in DB_FILE, "sqlite" uses DB_SQLITE_FILE
+# (run `python sqlite_database.py` once to migrate an existing DB_FILE)
+DB_BACKEND = "json"
+DB_SQLITE_FILE = "bot_database.sqlite3"
+
+# Storage mode of the "json" backend:
+# "json"    - rewrite DB_FILE on every change
+# "journal" - append each change to DB_JOURNAL_FILE and fold it into DB_FILE in the background
+# "write_behind" - keep changes in memory and write DB_FILE from a background thread
+#                  every DB_FLUSH_INTERVAL seconds or after DB_FLUSH_MAX_MUTATIONS changes
+# "sharded" - split users over DB_SHARD_COUNT files in DB_SHARD_DIR and only rewrite
+#             the files a change touches (created from DB_FILE on first start,
+#             `python storage.py reshard` changes the shard count offline)
+DB_STORAGE_MODE = "json"
+DB_JOURNAL_FILE = "bot_database.journal"
+DB_JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024  # compact once the journal passes 4 MB
+DB_FLUSH_INTERVAL = 5  # seconds
+DB_FLUSH_MAX_MUTATIONS = 1000
+DB_SHARD_DIR = "bot_database_shards"
+DB_SHARD_COUNT = 64
+
+# Binary snapshot written on shutdown and loaded on the next start instead of DB_FILE
+# when it is newer (users are decoded lazily). Not used by the "sharded" storage mode.
+DB_BINARY_SNAPSHOT = False
+DB_SNAPSHOT_FILE = "bot_database.snapshot"
+
+# Time-series statistics: hourly buckets are dropped and daily buckets are
+# rolled up into monthly totals once they are older than these limits
+STATS_DAILY_RETENTION_DAYS = 90
+STATS_HOURLY_RETENTION_HOURS = 48
+# Seconds between writes of the Gemini call count kept by the client into these statistics
+STATS_RECORD_INTERVAL = 60
+
+# How many most-recently-active users the database keeps track of for the admin panel
+RECENT_USERS_LIMIT = 50
+
+# Results per page of the admin group search
+GROUP_SEARCH_PAGE_SIZE = 10
+
 # Bot signature
 BOT_SIGNATURE = "\n\n━━━━━━━━━━━━━━\n📢 قناة التلجرام: @SyberSc71\n👨‍💻 برمجة:  @WAT4F"
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from gemini_client import GeminiError
+from router import ROUTE_SHORT
+from scheduler import PRIORITY_BACKGROUND
+from tokens import estimate_content_tokens, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Gemini only knows the roles "user" and "model"
+_ROLES = {"assistant": "model"}
+
+SUMMARY_PREFIX = "ملخص ما سبق من المحادثة (للسياق فقط):\n"
+
+SUMMARY_PROMPT = (
+    "لخص المحادثة التالية بين مستخدم ومساعد في فقرة قصيرة بنفس لغة المحادثة. "
+    "احتفظ بالموضوع، وما يدرسه المستخدم أو يعمل عليه، والمعلومات التي ذكرها عن نفسه، "
+    "والأسئلة التي تمت الإجابة عنها والنتائج والقرارات المهمة (مع أسماء الملفات والأوامر والأرقام). "
+    "لا تضف أي شيء غير موجود في المحادثة. اكتب الملخص فقط."
+)
+
+
+class ConversationWindow:
+    """Picks the turns of a conversation that are sent with the next request.
+
+    Turns are taken from the newest back while they fit in budget estimated
+    input tokens; the newest turn (the user's message) is always sent. The
+    window starts with a user turn, as Gemini expects. A summary of the older
+    turns, when there is one, is put in front of the first turn and counts
+    towards the budget. stats tracks the input tokens of each window and how
+    many turns were left out.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.stats = {"windows": 0, "tokens": 0, "max_tokens": 0, "turns": 0, "dropped_turns": 0,
+                      "summarized": 0}
+
+    def build(self, history: List[Dict], summary: Optional[str] = None) -> List[Dict]:
+        summary_part = {"text": SUMMARY_PREFIX + summary} if summary else None
+        window, total = [], estimate_tokens(summary_part["text"]) if summary_part else 0
+        for turn in reversed(history):
+            tokens = estimate_content_tokens(turn)
+            if window and total + tokens > self.budget:
+                break
+            window.append(turn)
+            total += tokens
+        window.reverse()
+        while len(window) > 1 and window[0].get("role") != "user":
+            total -= estimate_content_tokens(window.pop(0))
+
+        self.stats["windows"] += 1
+        self.stats["tokens"] += total
+        self.stats["max_tokens"] = max(self.stats["max_tokens"], total)
+        self.stats["turns"] += len(window)
+        self.stats["dropped_turns"] += len(history) - len(window)
+        window = [dict(turn, role=_ROLES.get(turn.get("role"), turn.get("role"))) for turn in window]
+        if summary_part and window:
+            self.stats["summarized"] += 1
+            window[0] = dict(window[0], parts=[summary_part] + list(window[0].get("parts", [])))
+        return window
+
+    def get_stats(self) -> dict:
+        windows = self.stats["windows"]
+        return dict(
+            self.stats,
+            budget=self.budget,
+            avg_tokens=self.stats["tokens"] / windows if windows else 0.0,
+            avg_turns=self.stats["turns"] / windows if windows else 0.0,
+        )
+
+
+class ConversationSummarizer:
+    """Folds the old turns of long private conversations into a running summary.
+
+    Once the turns of a history pass trigger_tokens estimated tokens, all but
+    the last keep_turns are summarized (together with the previous summary) by
+    a background Gemini call at the lowest priority, so the reply that
+    triggered it isn't delayed. When the summary arrives the folded turns are
+    removed from the history and the summary is sent in front of the window
+    instead; if the call fails the history is left as it was and the window
+    keeps working by budget alone. stats compares the estimated tokens of the
+    folded turns with the tokens of the summaries that replaced them.
+    """
+
+    def __init__(self, gemini, trigger_tokens: int, keep_turns: int, max_tokens: int):
+        self.gemini = gemini
+        self.trigger_tokens = trigger_tokens
+        self.keep_turns = keep_turns
+        self.max_tokens = max_tokens
+        self._summaries: Dict[int, str] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.stats = {"summaries": 0, "failed": 0, "folded_turns": 0, "folded_tokens": 0, "summary_tokens": 0,
+                      "input_tokens": 0, "output_tokens": 0}
+
+    def summary(self, user_id: int) -> Optional[str]:
+        return self._summaries.get(user_id)
+
+    def reset(self, user_id: int) -> None:
+        """Forget the summary of a user who started a new conversation."""
+        self._summaries.pop(user_id, None)
+        task = self._tasks.pop(user_id, None)
+        if task is not None:
+            task.cancel()
+
+    def maybe_summarize(self, user_id: int, history: List[Dict]) -> None:
+        """Start summarizing the old turns of history in the background if it grew past trigger_tokens."""
+        if user_id in self._tasks or len(history) <= self.keep_turns:
+            return
+        if sum(estimate_content_tokens(turn) for turn in history) <= self.trigger_tokens:
+            return
+        # The kept turns must start with a user message
+        split = len(history) - self.keep_turns
+        while split > 0 and history[split].get("role") != "user":
+            split -= 1
+        if split <= 0:
+            return
+        task = asyncio.ensure_future(self._summarize(user_id, history, history[:split]))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda done: self._finish(user_id, done))
+
+    def _finish(self, user_id: int, task: asyncio.Task) -> None:
+        if self._tasks.get(user_id) is task:
+            del self._tasks[user_id]
+
+    async def _summarize(self, user_id: int, history: List[Dict], turns: List[Dict]) -> None:
+        previous = self._summaries.get(user_id)
+        lines = [f"ملخص سابق: {previous}"] if previous else []
+        for turn in turns:
+            speaker = "المستخدم" if turn.get("role") == "user" else "المساعد"
+            text = " ".join(part["text"] for part in turn.get("parts", []) if "text" in part)
+            lines.append(f"{speaker}: {text}")
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": SUMMARY_PROMPT + "\n\n" + "\n\n".join(lines)}]}],
+            "generationConfig": {"temperature": 0.2, "maxOutputTokens": self.max_tokens},
+        }
+        try:
+            result = await self.gemini.generate(payload, priority=PRIORITY_BACKGROUND, user_id=user_id,
+                                                route=ROUTE_SHORT)
+        except GeminiError as e:
+            self.stats["failed"] += 1
+            logger.error(f"Conversation summary failed: {str(e)}")
+            return
+        text = result.text.strip()
+        # The history was cleared (new conversation) or changed while the summary was made
+        if not text or len(history) < len(turns) or any(a is not b for a, b in zip(history, turns)):
+            self.stats["failed"] += 1
+            return
+
+        del history[:len(turns)]
+        self._summaries[user_id] = text
+        self.stats["summaries"] += 1
+        self.stats["folded_turns"] += len(turns)
+        self.stats["folded_tokens"] += sum(estimate_content_tokens(turn) for turn in turns)
+        self.stats["summary_tokens"] += estimate_tokens(text)
+        self.stats["input_tokens"] += result.usage.get("promptTokenCount", 0)
+        self.stats["output_tokens"] += result.usage.get("candidatesTokenCount", 0)
+
+    def get_stats(self) -> dict:
+        folded = self.stats["folded_tokens"]
+        return dict(
+            self.stats,
+            users=len(self._summaries),
+            pending=len(self._tasks),
+            # < 1: the share of the folded turns' tokens a summary costs on each later request
+            compression=self.stats["summary_tokens"] / folded if folded else 0.0,
+        )
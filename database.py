@@ -1,19 +1,368 @@
-import json
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
 import os
-from datetime import datetime
-from typing import Dict, List, Optional
-from config import DB_FILE
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import (
+    DB_FILE, DB_BACKEND, DB_BINARY_SNAPSHOT, DB_SNAPSHOT_FILE, STATS_DAILY_RETENTION_DAYS,
+    STATS_HOURLY_RETENTION_HOURS, RECENT_USERS_LIMIT, GROUP_SEARCH_PAGE_SIZE,
+)
+from search_index import GroupSearchIndex
+from storage import Snapshot, create_store, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def _locked(method):
+    """Run a mutating method under the database lock so background writers see consistent data."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class UserRecord:
+    """Compact in-memory user entry.
+
+    Timestamps are kept as epoch seconds and only the latest day of the daily
+    image counter is kept (day ordinal + count). to_dict()/from_dict() convert
+    to and from the dict stored in the database file.
+    """
+
+    __slots__ = ("username", "first_name", "join_ts", "last_active_ts", "message_count",
+                 "image_count", "image_day", "image_day_count", "extra")
+
+    def __init__(self, username: str, first_name: str, join_ts: float, last_active_ts: float,
+                 message_count: int = 0, image_count: int = 0, image_day: int = 0,
+                 image_day_count: int = 0, extra: Optional[dict] = None):
+        self.username = username
+        self.first_name = first_name
+        self.join_ts = join_ts
+        self.last_active_ts = last_active_ts
+        self.message_count = message_count
+        self.image_count = image_count
+        self.image_day = image_day
+        self.image_day_count = image_day_count
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, user: dict) -> "UserRecord":
+        now = datetime.now().isoformat()
+        daily = user.get("daily_image_count") or {}
+        day = max(daily) if daily else None
+        extra = {k: v for k, v in user.items() if k not in USER_FIELDS}
+        return cls(
+            username=user.get("username", ""),
+            first_name=user.get("first_name", ""),
+            join_ts=datetime.fromisoformat(user.get("join_date", now)).timestamp(),
+            last_active_ts=datetime.fromisoformat(user.get("last_active", now)).timestamp(),
+            message_count=user.get("message_count", 0),
+            image_count=user.get("image_count", 0),
+            image_day=date.fromisoformat(day).toordinal() if day else 0,
+            image_day_count=daily.get(day, 0),
+            extra=extra or None,
+        )
+
+    def to_dict(self) -> dict:
+        user = {
+            "username": self.username,
+            "first_name": self.first_name,
+            "join_date": datetime.fromtimestamp(self.join_ts).isoformat(),
+            "message_count": self.message_count,
+            "image_count": self.image_count,
+            "daily_image_count": {},
+            "last_active": datetime.fromtimestamp(self.last_active_ts).isoformat(),
+        }
+        if self.image_day:
+            user["daily_image_count"][date.fromordinal(self.image_day).isoformat()] = self.image_day_count
+        if self.extra:
+            user.update(self.extra)
+        return user
+
+    def fields(self, user_id: int) -> tuple:
+        """(user_id, *slots), the layout used by binary snapshots."""
+        return (user_id, self.username, self.first_name, self.join_ts, self.last_active_ts, self.message_count,
+                self.image_count, self.image_day, self.image_day_count, self.extra)
+
+    def daily_images(self, day: int) -> int:
+        return self.image_day_count if self.image_day == day else 0
+
+    def add_daily_image(self, day: int):
+        if self.image_day != day:
+            self.image_day = day
+            self.image_day_count = 0
+        self.image_day_count += 1
+
+
+class UserTable:
+    """Users keyed by int id, split into shards by user_id % shard count.
+
+    Without a sharded store there is a single shard holding everyone. With one,
+    each shard is read from the store on first access, so a message only loads
+    the shard of its sender; len() uses the per-shard counts of the store
+    manifest until a shard is loaded.
+    """
+
+    def __init__(self, records: Optional[Dict[int, UserRecord]] = None, store=None, snapshot=None):
+        self.store = store
+        shard_count = store.shard_count if store is not None else 1
+        self.shards: List[Dict[int, UserRecord]] = [{} for _ in range(shard_count)]
+        self.loaded = [store is None] * shard_count
+        if records:
+            self.shards[0] = records
+
+        # Users of a binary snapshot are decoded into shard 0 on first access;
+        # _added keeps the users that aren't in the snapshot, in insertion order
+        self.snapshot = snapshot
+        self._added: Dict[int, None] = {}
+        if snapshot is not None:
+            self._added = dict.fromkeys(user_id for user_id in self.shards[0] if snapshot.find(user_id) < 0)
+
+    def shard_index(self, user_id: int) -> int:
+        return int(user_id) % len(self.shards)
+
+    def shard(self, index: int) -> Dict[int, UserRecord]:
+        if not self.loaded[index]:
+            self.shards[index] = {
+                int(user_id): UserRecord.from_dict(user)
+                for user_id, user in self.store.load_shard(index).items()
+            }
+            self.loaded[index] = True
+        return self.shards[index]
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        user = self.shard(self.shard_index(user_id)).get(user_id)
+        if user is None and self.snapshot is not None:
+            position = self.snapshot.find(user_id)
+            if position >= 0:
+                user = self.shards[0][user_id] = UserRecord(*self.snapshot.fields(position)[1:])
+        return user
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self.shard(self.shard_index(user_id)):
+            return True
+        return self.snapshot is not None and self.snapshot.find(user_id) >= 0
+
+    def __setitem__(self, user_id: int, user: UserRecord):
+        if self.snapshot is not None and user_id not in self:
+            self._added[user_id] = None
+        self.shard(self.shard_index(user_id))[user_id] = user
+
+    def __len__(self) -> int:
+        if self.snapshot is not None:
+            return self.snapshot.count + len(self._added)
+        return sum(
+            len(shard) if loaded else self.store.shard_size(index)
+            for index, (shard, loaded) in enumerate(zip(self.shards, self.loaded))
+        )
+
+    def items(self):
+        if self.snapshot is None:
+            for index in range(len(self.shards)):
+                yield from self.shard(index).items()
+            return
+
+        # Snapshot users not accessed yet are decoded without being kept in memory
+        users = self.shards[0]
+        for position in range(self.snapshot.count):
+            user_id = self.snapshot.user_id_at(position)
+            user = users.get(user_id)
+            yield user_id, user if user is not None else UserRecord(*self.snapshot.fields(position)[1:])
+        for user_id in self._added:
+            yield user_id, users[user_id]
+
+    def snapshot_records(self):
+        """Every user for write_snapshot, reusing the encoded records of untouched snapshot users."""
+        if self.snapshot is None:
+            for user_id, user in self.items():
+                yield user.fields(user_id)
+            return
+
+        users = self.shards[0]
+        for position in range(self.snapshot.count):
+            user_id = self.snapshot.user_id_at(position)
+            user = users.get(user_id)
+            yield self.snapshot.raw(position) if user is None else user.fields(user_id)
+        for user_id in self._added:
+            yield users[user_id].fields(user_id)
+
+    def values(self):
+        for _, user in self.items():
+            yield user
+
+    def __iter__(self):
+        if self.snapshot is not None:
+            for position in range(self.snapshot.count):
+                yield self.snapshot.user_id_at(position)
+            yield from self._added
+            return
+        for user_id, _ in self.items():
+            yield user_id
+
+
+USER_FIELDS = ("username", "first_name", "join_date", "message_count", "image_count", "daily_image_count", "last_active")
+
+# Events counted per hour and per day by TimeSeriesCounters
+# ("active_users" counts each user once per day, on their first activity of the day)
+COUNTER_METRICS = ("messages", "images", "new_users", "active_users", "group_messages", "gemini_calls")
+
+
+class TimeSeriesCounters:
+    """Per-hour and per-day event counters with bounded retention.
+
+    Buckets live in one flat dict keyed "h:YYYY-MM-DDTHH", "d:YYYY-MM-DD" and
+    "m:YYYY-MM", each holding {metric: count}, so a store can persist a single
+    bucket. increment() touches two buckets; once per hour it also drops hourly
+    buckets past their retention (their day bucket already has the totals) and
+    rolls day buckets past their retention up into their month bucket.
+    """
+
+    def __init__(self, buckets: dict, daily_retention: int = STATS_DAILY_RETENTION_DAYS,
+                 hourly_retention: int = STATS_HOURLY_RETENTION_HOURS):
+        self.buckets = buckets
+        self.daily_retention = daily_retention
+        self.hourly_retention = hourly_retention
+        self._current_hour = None
+
+    @staticmethod
+    def bucket_keys(now: datetime) -> Tuple[str, str]:
+        return now.strftime("h:%Y-%m-%dT%H"), now.strftime("d:%Y-%m-%d")
+
+    def cutoffs(self, now: datetime) -> Tuple[str, str]:
+        """Oldest hour and day bucket keys that are still kept."""
+        return (
+            (now - timedelta(hours=self.hourly_retention)).strftime("h:%Y-%m-%dT%H"),
+            (now - timedelta(days=self.daily_retention)).strftime("d:%Y-%m-%d"),
+        )
+
+    def increment(self, metric: str, amount: int = 1, now: Optional[datetime] = None) -> List[str]:
+        """Count amount events of metric. Returns the keys of the buckets that changed."""
+        now = now or datetime.now()
+        hour_key, day_key = self.bucket_keys(now)
+        changed = [hour_key, day_key]
+        if hour_key != self._current_hour:
+            self._current_hour = hour_key
+            changed += self.expire(now)
+
+        for key in (hour_key, day_key):
+            bucket = self.buckets.setdefault(key, {})
+            bucket[metric] = bucket.get(metric, 0) + amount
+        return changed
+
+    def expire(self, now: datetime) -> List[str]:
+        hour_cutoff, day_cutoff = self.cutoffs(now)
+        changed = []
+        for key in list(self.buckets):
+            if key.startswith("h:") and key < hour_cutoff:
+                del self.buckets[key]
+                changed.append(key)
+            elif key.startswith("d:") and key < day_cutoff:
+                month_key = "m:" + key[2:9]
+                month = self.buckets.setdefault(month_key, {})
+                for metric, count in self.buckets.pop(key).items():
+                    month[metric] = month.get(metric, 0) + count
+                changed += [key, month_key]
+        return changed
+
+    def import_legacy(self, daily_messages: dict):
+        """Use the old statistics.daily_messages entries for days without a bucket.
+
+        Days past the retention whose month bucket exists were already rolled up into it.
+        """
+        _, day_cutoff = self.cutoffs(datetime.now())
+        for day, counts in daily_messages.items():
+            key = f"d:{day}"
+            if key < day_cutoff and f"m:{day[:7]}" in self.buckets:
+                continue
+            self.buckets.setdefault(key, dict(counts))
+
+    @staticmethod
+    def _counts(bucket: Optional[dict]) -> dict:
+        counts = dict.fromkeys(COUNTER_METRICS, 0)
+        counts.update(bucket or {})
+        return counts
+
+    def get_day(self, day: date) -> dict:
+        return self._counts(self.buckets.get(day.strftime("d:%Y-%m-%d")))
+
+    def get_days(self, days: int, now: Optional[datetime] = None) -> List[Tuple[str, dict]]:
+        """Counts of the last `days` days, oldest first."""
+        today = (now or datetime.now()).date()
+        return [
+            (day.isoformat(), self.get_day(day))
+            for day in (today - timedelta(days=offset) for offset in range(days - 1, -1, -1))
+        ]
+
+    def get_hours(self, hours: int, now: Optional[datetime] = None) -> List[Tuple[str, dict]]:
+        """Counts of the last `hours` hours, oldest first."""
+        now = now or datetime.now()
+        result = []
+        for offset in range(hours - 1, -1, -1):
+            hour_key, _ = self.bucket_keys(now - timedelta(hours=offset))
+            result.append((hour_key[2:], self._counts(self.buckets.get(hour_key))))
+        return result
+
+
+# Tables kept as id sets in memory and as lists of string ids on disk
+MEMBERSHIP_TABLES = ("banned_users", "premium_users")
+
 
 class Database:
     def __init__(self):
         self.db_file = DB_FILE
+        self.lock = threading.RLock()
+        self.store = create_store(self.db_file, self.lock)
+        self.snapshot_file = DB_SNAPSHOT_FILE if DB_BINARY_SNAPSHOT and not getattr(self.store, "shard_count", None) else None
+        self.snapshot: Optional[Snapshot] = None
         self.data = self._load_data()
 
+        # Users, bans and premium membership live outside self.data, keyed by int id.
+        # Dicts with None values act as insertion-ordered sets for the memberships.
+        records = {int(user_id): UserRecord.from_dict(user) for user_id, user in self.data.pop("users", {}).items()}
+        self.users = UserTable(records, self.store if getattr(self.store, "shard_count", None) else None, self.snapshot)
+        self.banned_users: Dict[int, None] = dict.fromkeys(int(u) for u in self.data.pop("banned_users", []))
+        self.premium_users: Dict[int, None] = dict.fromkeys(int(u) for u in self.data.pop("premium_users", []))
+
+        self.counters = TimeSeriesCounters(self.data.setdefault("timeseries", {}))
+        self.counters.import_legacy(self.data["statistics"].get("daily_messages", {}))
+        # Buckets changed by record_event() that still have to be written with the next save
+        self._dirty_buckets = set()
+
+        # Aggregates for the admin screens, kept up to date by the write methods.
+        # The recent-users list is built on first use so sharded mode doesn't load every shard at startup.
+        self._recent_users: Optional[OrderedDict] = None
+        self._inactive_groups: Dict[str, None] = dict.fromkeys(
+            chat_id for chat_id, group in self.data.setdefault("groups", {}).items() if not group.get("message_count", 0)
+        )
+        self.group_index = GroupSearchIndex()
+        for chat_id, group in self.data["groups"].items():
+            self.group_index.add(chat_id, group.get("title", ""))
+
+    def _open_snapshot(self) -> Optional[Snapshot]:
+        """The binary snapshot, if enabled and newer than the JSON database file."""
+        if not self.snapshot_file or not os.path.exists(self.snapshot_file):
+            return None
+        if os.path.exists(self.db_file) and os.stat(self.db_file).st_mtime_ns >= os.stat(self.snapshot_file).st_mtime_ns:
+            return None
+        try:
+            return Snapshot(self.snapshot_file)
+        except Exception as e:
+            logger.error(f"Ignoring binary snapshot {self.snapshot_file}: {str(e)}")
+            return None
+
     def _load_data(self) -> dict:
-        if os.path.exists(self.db_file):
-            with open(self.db_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {
+        # Users of the snapshot stay in the mapped file, the other tables are loaded now
+        self.snapshot = self._open_snapshot()
+        base = dict(self.snapshot.data, users={}) if self.snapshot is not None else None
+        return self.store.load({
             "users": {},
             "banned_users": [],
             "premium_users": [],
@@ -23,169 +372,263 @@ class Database:
                 "total_images": 0,
                 "daily_messages": {},
             }
+        }, base)
+
+    def _save_data(self, *changes):
+        """Persist changes, each a (table, key) or (table,) tuple. No changes means everything."""
+        if changes and self._dirty_buckets:
+            changes += tuple(("timeseries", key) for key in self._dirty_buckets)
+        self._dirty_buckets.clear()
+        self.store.save(self, changes)
+
+    def to_dict(self, include_users: bool = True) -> dict:
+        """The whole database in the on-disk format."""
+        data = {
+            "banned_users": [str(user_id) for user_id in self.banned_users],
+            "premium_users": [str(user_id) for user_id in self.premium_users],
         }
+        if include_users:
+            data = {"users": self.export_entry("users"), **data}
+        data.update(self.data)
+        return data
+
+    def export_shard(self, index: int) -> dict:
+        """On-disk users of one shard of the user table."""
+        return {str(user_id): user.to_dict() for user_id, user in self.users.shard(index).items()}
+
+    def export_entry(self, table: str, key=None):
+        """On-disk value of one table, or of one entry of it when key is given."""
+        if table == "users":
+            if key is None:
+                return {str(user_id): user.to_dict() for user_id, user in self.users.items()}
+            user = self.users.get(int(key))
+            return user.to_dict() if user else None
+        if table in MEMBERSHIP_TABLES:
+            members = getattr(self, table)
+            if key is None:
+                return [str(user_id) for user_id in members]
+            return int(key) in members
+        rows = self.data.get(table)
+        if key is None:
+            return rows
+        return (rows or {}).get(str(key))
+
+    def close(self):
+        """Flush pending writes and release the storage files."""
+        with self.lock:
+            if self._dirty_buckets:
+                self._save_data(*[("timeseries", key) for key in self._dirty_buckets])
+        self.store.close()
+        if self.snapshot_file:
+            with self.lock:
+                self._write_snapshot()
 
-    def _save_data(self):
-        with open(self.db_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+    def _write_snapshot(self):
+        """Write the binary snapshot the next start loads from."""
+        started = time.perf_counter()
+        try:
+            size = write_snapshot(self.snapshot_file, self.to_dict(include_users=False), self.users.snapshot_records())
+            logger.info(f"Wrote {self.snapshot_file} ({size} bytes) in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Writing binary snapshot failed: {str(e)}")
+        finally:
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = self.users.snapshot = None
 
+    def get_storage_stats(self) -> dict:
+        """Write counters of the storage engine (writes, bytes written, flush latency...)."""
+        return self.store.get_stats()
+
+    @_locked
     def add_user(self, user_id: int, username: str, first_name: str):
-        if str(user_id) not in self.data["users"]:
-            self.data["users"][str(user_id)] = {
-                "username": username,
-                "first_name": first_name,
-                "join_date": datetime.now().isoformat(),
-                "message_count": 0,
-                "image_count": 0,
-                "daily_image_count": {},
-                "last_active": datetime.now().isoformat()
-            }
-            self._save_data()
+        if int(user_id) not in self.users:
+            now = time.time()
+            self.users[int(user_id)] = UserRecord(username, first_name, now, now)
+            self._touch_recent(int(user_id))
+            self._save_data(("users", user_id), *self._count("new_users"), *self._count("active_users"))
 
+    @_locked
     def update_user_activity(self, user_id: int, message_type: str = "text"):
-        today = datetime.now().strftime("%Y-%m-%d")
-        
         # Update user statistics
-        if str(user_id) in self.data["users"]:
-            user = self.data["users"][str(user_id)]
+        user = self.users.get(int(user_id))
+        if user is not None:
+            changes = [("users", user_id), ("statistics",)]
             if message_type == "text":
-                user["message_count"] += 1
+                user.message_count += 1
                 self.data["statistics"]["total_messages"] += 1
+                changes += self._count("messages")
             elif message_type in ["photo", "image"]:
-                user["image_count"] += 1
+                user.image_count += 1
                 self.data["statistics"]["total_images"] += 1
+                changes += self._count("images")
                 
                 # Update daily image count
-                if "daily_image_count" not in user:
-                    user["daily_image_count"] = {}
-                if today not in user["daily_image_count"]:
-                    user["daily_image_count"] = {today: 0}
-                user["daily_image_count"][today] = user["daily_image_count"].get(today, 0) + 1
+                user.add_daily_image(date.today().toordinal())
                 
-            user["last_active"] = datetime.now().isoformat()
-            self._save_data()
+            now = time.time()
+            if date.fromtimestamp(user.last_active_ts) != date.fromtimestamp(now):
+                changes += self._count("active_users")
+            user.last_active_ts = now
+            self._touch_recent(int(user_id))
+            self._save_data(*changes)
+
+    def user_exists(self, user_id: int) -> bool:
+        return int(user_id) in self.users
 
     def get_user_stats(self, user_id: int) -> Optional[dict]:
-        return self.data["users"].get(str(user_id))
+        user = self.users.get(int(user_id))
+        return user.to_dict() if user else None
 
     def get_all_users(self) -> List[dict]:
-        return list(self.data["users"].values())
+        return [user.to_dict() for user in self.users.values()]
+
+    def get_all_user_ids(self) -> List[str]:
+        return [str(user_id) for user_id in self.users]
 
     def get_total_users(self) -> int:
-        return len(self.data["users"])
+        return len(self.users)
+
+    def _touch_recent(self, user_id: int):
+        if self._recent_users is None:
+            return
+        self._recent_users[user_id] = None
+        self._recent_users.move_to_end(user_id)
+        if len(self._recent_users) > RECENT_USERS_LIMIT:
+            self._recent_users.popitem(last=False)
+
+    def get_active_today_count(self) -> int:
+        """Number of distinct users active today."""
+        return self.counters.get_day(date.today())["active_users"]
+
+    @_locked
+    def get_recent_active_users(self, limit: int = 5) -> List[dict]:
+        """The `limit` most recently active users, newest first, each with its user_id."""
+        if self._recent_users is None:
+            recent = heapq.nlargest(RECENT_USERS_LIMIT, self.users.items(), key=lambda item: item[1].last_active_ts)
+            self._recent_users = OrderedDict((user_id, None) for user_id, _ in reversed(recent))
+        result = []
+        for user_id in reversed(self._recent_users):
+            if len(result) == limit:
+                break
+            user = self.users.get(user_id)
+            if user is not None:
+                result.append({"user_id": str(user_id), **user.to_dict()})
+        return result
+
+    def _count(self, metric: str, amount: int = 1) -> List[Tuple[str, str]]:
+        """Increment a time-series counter and return the changes to persist."""
+        return [("timeseries", key) for key in self.counters.increment(metric, amount)]
+
+    @_locked
+    def record_event(self, metric: str, amount: int = 1):
+        """Count an event (group_messages, gemini_calls...) in the hourly and daily buckets.
+
+        Only the in-memory buckets change; they are written with the next save or on close().
+        """
+        self._dirty_buckets.update(self.counters.increment(metric, amount))
 
     def get_daily_stats(self) -> dict:
-        today = datetime.now().strftime("%Y-%m-%d")
-        return self.data["statistics"]["daily_messages"].get(today, {"messages": 0, "images": 0})
+        return self.counters.get_day(date.today())
+
+    def get_daily_series(self, days: int = 7) -> List[Tuple[str, dict]]:
+        """Per-day counters of the last `days` days, oldest first."""
+        return self.counters.get_days(days)
+
+    def get_hourly_series(self, hours: int = 24) -> List[Tuple[str, dict]]:
+        """Per-hour counters of the last `hours` hours, oldest first."""
+        return self.counters.get_hours(hours)
 
     def get_total_stats(self) -> dict:
         return {
             "total_messages": self.data["statistics"]["total_messages"],
             "total_images": self.data["statistics"]["total_images"],
-            "total_users": len(self.data["users"])
+            "total_users": len(self.users)
         }
 
     def get_daily_image_count(self, user_id: int) -> int:
-        today = datetime.now().strftime("%Y-%m-%d")
-        user = self.data["users"].get(str(user_id), {})
-        return user.get("daily_image_count", {}).get(today, 0)
+        user = self.users.get(int(user_id))
+        return user.daily_images(date.today().toordinal()) if user else 0
 
+    @_locked
     def ban_user(self, user_id: int):
-        if str(user_id) not in self.data["banned_users"]:
-            self.data["banned_users"].append(str(user_id))
-            self._save_data()
+        if int(user_id) not in self.banned_users:
+            self.banned_users[int(user_id)] = None
+            self._save_data(("banned_users", user_id))
 
+    @_locked
     def unban_user(self, user_id: int):
-        if str(user_id) in self.data["banned_users"]:
-            self.data["banned_users"].remove(str(user_id))
-            self._save_data()
+        if int(user_id) in self.banned_users:
+            del self.banned_users[int(user_id)]
+            self._save_data(("banned_users", user_id))
 
     def get_banned_users(self) -> list:
         """Get list of banned user IDs."""
-        return self.data["banned_users"]
+        return [str(user_id) for user_id in self.banned_users]
 
     def get_user_info(self, user_id: int) -> dict:
         """Get user information by ID."""
-        return self.data["users"].get(str(user_id))
+        return self.get_user_stats(user_id)
 
     def is_user_banned(self, user_id: int) -> bool:
         """Check if user is banned."""
-        return str(user_id) in self.data["banned_users"]
+        return int(user_id) in self.banned_users
 
     def is_user_premium(self, user_id: int) -> bool:
         """Check if user is premium."""
-        return str(user_id) in self.data.get("premium_users", [])
+        return int(user_id) in self.premium_users
 
+    @_locked
     def add_premium_user(self, user_id: int) -> bool:
         """Add user to premium users list. Returns True if user was added, False if already premium."""
-        if "premium_users" not in self.data:
-            self.data["premium_users"] = []
-        if str(user_id) not in self.data["premium_users"]:
-            self.data["premium_users"].append(str(user_id))
-            self._save_data()
+        if int(user_id) not in self.premium_users:
+            self.premium_users[int(user_id)] = None
+            self._save_data(("premium_users", user_id))
             return True
         return False
 
+    @_locked
     def remove_premium_user(self, user_id: int) -> bool:
         """Remove user from premium users list. Returns True if user was removed, False if not premium."""
-        if "premium_users" in self.data and str(user_id) in self.data["premium_users"]:
-            self.data["premium_users"].remove(str(user_id))
-            self._save_data()
+        if int(user_id) in self.premium_users:
+            del self.premium_users[int(user_id)]
+            self._save_data(("premium_users", user_id))
             return True
         return False
 
     def get_premium_users(self) -> List[str]:
-        return self.data.get("premium_users", [])
+        return [str(user_id) for user_id in self.premium_users]
 
     def broadcast_message(self, message: str) -> List[str]:
-        return list(self.data["users"].keys())
+        return self.get_all_user_ids()
 
     def can_send_image(self, user_id: int) -> bool:
         """Check if user can send more images today."""
-        # Ensure premium_users exists in data
-        if "premium_users" not in self.data:
-            self.data["premium_users"] = []
-            self._save_data()
-            
         # Check if user is premium
-        if str(user_id) in self.data["premium_users"]:
+        if int(user_id) in self.premium_users:
             return True  # Premium users have unlimited images
             
-        today = datetime.now().strftime("%Y-%m-%d")
-        user = self.data["users"].get(str(user_id))
-        if not user:
+        user = self.users.get(int(user_id))
+        if user is None:
             return False
             
-        # Ensure daily_image_count exists for user
-        if "daily_image_count" not in user:
-            user["daily_image_count"] = {}
-            
-        # Get today's count, default to 0 if not exists
-        daily_count = user["daily_image_count"].get(today, 0)
-        return daily_count < 5  # Regular users limited to 5 images per day
+        return user.daily_images(date.today().toordinal()) < 5  # Regular users limited to 5 images per day
 
+    @_locked
     def increment_daily_image_count(self, user_id: int):
         """Increment the user's daily image count."""
-        today = datetime.now().strftime("%Y-%m-%d")
-        user = self.data["users"].get(str(user_id))
-        if user:
-            # Ensure daily_image_count exists
-            if "daily_image_count" not in user:
-                user["daily_image_count"] = {}
-                
-            # Reset count if it's a new day
-            if today not in user["daily_image_count"]:
-                user["daily_image_count"][today] = 0
-                
-            # Increment count
-            user["daily_image_count"][today] += 1
+        user = self.users.get(int(user_id))
+        if user is not None:
+            # Reset count if it's a new day, then increment
+            user.add_daily_image(date.today().toordinal())
             
             # Update image count in user stats
-            user["image_count"] = user.get("image_count", 0) + 1
+            user.image_count += 1
             
             # Save changes
-            self._save_data()
+            self._save_data(("users", user_id))
 
+    @_locked
     def add_group(self, chat_id: int, title: str):
         """إضافة مجموعة جديدة أو تحديث معلوماتها"""
         if str(chat_id) not in self.data.get("groups", {}):
@@ -195,32 +638,50 @@ class Database:
                 "message_count": 0,
                 "last_active": datetime.now().isoformat()
             }
+            self._inactive_groups[str(chat_id)] = None
         else:
             # تحديث اسم المجموعة إذا تغير
             self.data["groups"][str(chat_id)]["title"] = title
             self.data["groups"][str(chat_id)]["last_active"] = datetime.now().isoformat()
-        self._save_data()
-
-    def get_all_groups(self) -> List[Dict]:
-        """الحصول على قائمة جميع المجموعات"""
-        groups = []
-        for chat_id, group_data in self.data.get("groups", {}).items():
-            groups.append({
-                "chat_id": chat_id,
-                "title": group_data["title"],
-                "join_date": group_data["join_date"],
-                "message_count": group_data["message_count"],
-                "last_active": group_data["last_active"]
-            })
-        return groups
+        self.group_index.add(chat_id, title)
+        self._save_data(("groups", chat_id))
+
+    @staticmethod
+    def _group_summary(chat_id: str, group_data: dict) -> Dict:
+        return {
+            "chat_id": chat_id,
+            "title": group_data["title"],
+            "join_date": group_data["join_date"],
+            "message_count": group_data["message_count"],
+            "last_active": group_data["last_active"]
+        }
 
+    def get_all_groups(self, limit: Optional[int] = None) -> List[Dict]:
+        """الحصول على قائمة جميع المجموعات (أو أول limit مجموعة)"""
+        groups = self.data.get("groups", {}).items()
+        return [self._group_summary(chat_id, group_data) for chat_id, group_data in itertools.islice(groups, limit)]
+
+    def get_group_counts(self) -> Dict[str, int]:
+        """عدد المجموعات الكلي والنشطة وغير النشطة"""
+        total = len(self.data.get("groups", {}))
+        inactive = len(self._inactive_groups)
+        return {"total": total, "active": total - inactive, "inactive": inactive}
+
+    def get_inactive_groups(self) -> List[Dict]:
+        """المجموعات التي لم تُرسل فيها أي رسالة"""
+        groups = self.data.get("groups", {})
+        return [self._group_summary(chat_id, groups[chat_id]) for chat_id in self._inactive_groups]
+
+    @_locked
     def update_group_activity(self, chat_id: int):
         """تحديث نشاط المجموعة"""
         if str(chat_id) in self.data.get("groups", {}):
             self.data["groups"][str(chat_id)]["message_count"] += 1
             self.data["groups"][str(chat_id)]["last_active"] = datetime.now().isoformat()
-            self._save_data()
+            self._inactive_groups.pop(str(chat_id), None)
+            self._save_data(("groups", chat_id))
 
+    @_locked
     def update_group_info(self, chat_id: str, info: dict) -> None:
         """تحديث معلومات المجموعة."""
         if 'groups' not in self.data:
@@ -228,44 +689,96 @@ class Database:
         
         if str(chat_id) in self.data['groups']:
             self.data['groups'][str(chat_id)].update(info)
-            self._save_data()
+            if 'title' in info:
+                self.group_index.add(chat_id, info['title'])
+            if self.data['groups'][str(chat_id)].get('message_count', 0):
+                self._inactive_groups.pop(str(chat_id), None)
+            else:
+                self._inactive_groups[str(chat_id)] = None
+            self._save_data(("groups", chat_id))
 
+    @_locked
     def remove_group(self, chat_id: str) -> None:
         """حذف مجموعة من قاعدة البيانات."""
         if 'groups' in self.data and str(chat_id) in self.data['groups']:
             del self.data['groups'][str(chat_id)]
-            self._save_data()
+            self._inactive_groups.pop(str(chat_id), None)
+            self.group_index.remove(chat_id)
+            self._save_data(("groups", chat_id))
 
     def search_groups(self, query: str) -> list:
         """البحث عن مجموعات باسمها أو معرفها."""
-        if 'groups' not in self.data:
-            return []
-        
-        results = []
-        query = query.lower()
-        
-        for chat_id, group in self.data['groups'].items():
-            if (query in str(chat_id).lower() or 
-                query in group.get('title', '').lower()):
-                results.append(group)
-        
-        return results
+        groups = self.data.get('groups', {})
+        return [groups[chat_id] for chat_id in self.group_index.search(query)]
+
+    def search_groups_page(self, query: str, page: int = 1,
+                           page_size: int = GROUP_SEARCH_PAGE_SIZE) -> Tuple[List[Dict], int]:
+        """صفحة من نتائج البحث عن المجموعات.
 
+        ترجع نتائج الصفحة المطلوبة مرتبة حسب التطابق، مع العدد الكلي للنتائج.
+        """
+        matches = self.group_index.search(query)
+        start = (max(page, 1) - 1) * page_size
+        groups = self.data.get('groups', {})
+        results = [self._group_summary(chat_id, groups[chat_id]) for chat_id in matches[start:start + page_size]]
+        return results, len(matches)
+
+    @_locked
     def cleanup_inactive_groups(self) -> tuple:
         """حذف المجموعات غير النشطة وإرجاع عدد المجموعات المحذوفة."""
         if 'groups' not in self.data:
             return 0, []
         
         inactive_groups = []
+        removed_ids = []
         removed_count = 0
         
-        for chat_id, group in list(self.data['groups'].items()):
-            if group.get('message_count', 0) == 0:
-                inactive_groups.append(group)
-                del self.data['groups'][chat_id]
-                removed_count += 1
+        for chat_id in list(self._inactive_groups):
+            inactive_groups.append(self.data['groups'].pop(chat_id))
+            self.group_index.remove(chat_id)
+            removed_ids.append(chat_id)
+            removed_count += 1
+        self._inactive_groups.clear()
         
         if removed_count > 0:
-            self._save_data()
+            self._save_data(*[("groups", chat_id) for chat_id in removed_ids])
         
         return removed_count, inactive_groups
+
+
+class AsyncDatabase:
+    """Awaitable wrapper running every Database call on a single worker thread.
+
+    Handlers `await db.method(...)` instead of blocking the event loop on disk or
+    SQLite I/O. One worker keeps the calls ordered and the backend single-threaded.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+        return call
+
+    def close(self):
+        """Wait for queued calls, then close the underlying database."""
+        self._executor.shutdown(wait=True)
+        self.db.close()
+
+
+def create_database():
+    """Create the database backend selected by DB_BACKEND in config.py."""
+    if DB_BACKEND == "json":
+        return Database()
+    if DB_BACKEND == "sqlite":
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase()
+    raise ValueError(f"Unknown DB_BACKEND: {DB_BACKEND}")
@@ -0,0 +1,570 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from key_pool import ApiKey, KeyPool, KeyPoolExhausted
+from media import InlineImage
+from resilience import RETRYABLE_STATUSES, CircuitBreaker, HedgePolicy, RetryPolicy, parse_retry_after
+from router import ModelRouter
+from scheduler import PRIORITY_PRIVATE, QueueTimeout, RequestScheduler
+from tokens import estimate_payload_tokens
+from config import (
+    GEMINI_API_KEY,
+    GEMINI_BASE_URL,
+    GEMINI_MODELS_URL,
+    GEMINI_MODEL_ROUTES,
+    GEMINI_LONG_CONTEXT_TOKENS,
+    GEMINI_ROUTE_MAX_P95,
+    GEMINI_ROUTER_MAX_ERROR_RATE,
+    GEMINI_ROUTER_MIN_SAMPLES,
+    GEMINI_ROUTER_WINDOW,
+    GEMINI_TIMEOUT,
+    GEMINI_CONNECT_TIMEOUT,
+    GEMINI_MAX_CONNECTIONS,
+    GEMINI_KEEPALIVE_EXPIRY,
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class GeminiError(Exception):
+    """A Gemini request that did not produce a response."""
+
+    def __init__(self, message: str, status: Optional[int] = None, body: str = "",
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+        self.retry_after = retry_after  # seconds the server asked us to wait (Retry-After / retryDelay)
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in RETRYABLE_STATUSES
+
+
+class GeminiAPIError(GeminiError):
+    """The API answered with a non-200 status."""
+
+
+class GeminiConnectionError(GeminiError):
+    """Network error or timeout before a response arrived."""
+
+
+class GeminiBusyError(GeminiError):
+    """The request was not sent: it waited in the scheduler queue past its deadline,
+    or the circuit breaker is open after too many failures."""
+
+    @property
+    def retryable(self) -> bool:
+        return False
+
+
+class GeminiResponse:
+    """Parsed generateContent response."""
+
+    __slots__ = ("text", "finish_reason", "block_reason", "usage", "data", "model")
+
+    def __init__(self, text: str, finish_reason: Optional[str], block_reason: Optional[str], usage: dict, data: dict,
+                 model: Optional[str] = None):
+        self.text = text
+        self.finish_reason = finish_reason
+        self.block_reason = block_reason
+        self.usage = usage
+        self.data = data
+        self.model = model  # the model that answered, set by GeminiClient
+
+
+def _image_digest(value):
+    """json.dumps default: an InlineImage is identified by the digest of its data."""
+    if isinstance(value, InlineImage):
+        return value.digest
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_body(payload: dict) -> List[bytes]:
+    """JSON body of a payload as a list of chunks; the base64 chunks of InlineImage values are
+    spliced in as they are instead of being copied into the JSON text."""
+    images = []
+    marker = uuid.uuid4().hex
+
+    def splice(value):
+        if isinstance(value, InlineImage):
+            images.append(value)
+            return marker
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+    text = json.dumps(payload, ensure_ascii=False, default=splice).encode('utf-8')
+    if not images:
+        return [text]
+    pieces = text.split(f'"{marker}"'.encode('ascii'))
+    chunks = [pieces[0]]
+    for image, piece in zip(images, pieces[1:]):
+        chunks.append(b'"')
+        chunks.extend(image.chunks)
+        chunks.append(b'"')
+        chunks.append(piece)
+    return chunks
+
+
+def _body_kwargs(payload: dict) -> dict:
+    """httpx arguments that send the body of payload (streamed from its chunks when it has images)."""
+    chunks = encode_body(payload)
+    if len(chunks) == 1:
+        return {"content": chunks[0]}
+
+    async def stream() -> AsyncIterator[bytes]:
+        for chunk in chunks:
+            yield chunk
+
+    return {"content": stream(), "headers": {"Content-Length": str(sum(len(chunk) for chunk in chunks))}}
+
+
+def stream_url(url: str) -> str:
+    """streamGenerateContent endpoint of a generateContent URL."""
+    return url.replace(":generateContent", ":streamGenerateContent")
+
+
+def request_key(route: str, payload: dict) -> str:
+    """Identity of a request for coalescing: same route and exactly the same payload."""
+    raw = json.dumps([route, payload], ensure_ascii=False, sort_keys=True, default=_image_digest)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def parse_response(data: dict) -> GeminiResponse:
+    """Join the text parts of the first candidate and pick out the finish/block reasons and token usage."""
+    candidates = data.get("candidates") or []
+    candidate = candidates[0] if candidates else {}
+    parts = (candidate.get("content") or {}).get("parts") or []
+    return GeminiResponse(
+        text="".join(part.get("text", "") for part in parts),
+        finish_reason=candidate.get("finishReason"),
+        block_reason=(data.get("promptFeedback") or {}).get("blockReason"),
+        usage=data.get("usageMetadata") or {},
+        data=data,
+    )
+
+
+class GeminiClient:
+    """Shared async client for the Gemini REST API.
+
+    One httpx.AsyncClient keeps a pool of keep-alive connections (HTTP/2 when
+    h2 is installed) for every handler, so calls don't block the event loop or
+    pay a TLS handshake each time. The pool is created on first use and again
+    after close(), since run_polling may be restarted by main().
+
+    Identical requests made while one is already in flight are coalesced
+    (single-flight): they wait for the same upstream call and all receive its
+    result or its error. stats counts the requests and the calls saved; the
+    HTTP attempts are added to the database's gemini_calls counter in batches
+    by record_calls().
+
+    With on_text the answer is streamed (streamGenerateContent over SSE) and
+    on_text is awaited with the text received so far after every chunk.
+
+    The router picks the model from the request class (route) and the models'
+    recent latency and errors; when a model fails (after its retries, or 404
+    for a retired model) the request falls back to the next one of the route.
+
+    With a scheduler, each upstream call first waits for a slot in the queue
+    of its priority class (coalesced requests don't take one).
+
+    With a retry policy, 429/5xx answers and network errors are retried with
+    jittered backoff (honouring Retry-After) inside the policy's time budget;
+    a streamed answer is not retried once text was shown. Each attempt takes
+    an API key from the key pool; after a 429 the retry goes to another key
+    right away when one has room. The circuit breaker
+    sees the outcome of every attempt and, while open, requests fail at once
+    with GeminiBusyError instead of queueing.
+
+    With a hedge policy, an attempt for one of its priorities that hasn't
+    answered (or streamed its first text) within the policy's delay gets a
+    duplicate on another key (optionally the next model of the route); the
+    first answer wins and the other call is cancelled. A streamed duplicate
+    only wins if it shows text first. The duplicate takes no scheduler slot.
+    """
+
+    def __init__(self, db=None, keys: Optional[KeyPool] = None, scheduler: Optional[RequestScheduler] = None,
+                 retry: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 router: Optional[ModelRouter] = None, hedge: Optional[HedgePolicy] = None):
+        self.db = db
+        self.keys = keys or KeyPool([GEMINI_API_KEY])
+        self.router = router or ModelRouter(
+            GEMINI_BASE_URL, GEMINI_MODEL_ROUTES, GEMINI_ROUTE_MAX_P95, GEMINI_ROUTER_MAX_ERROR_RATE,
+            GEMINI_ROUTER_MIN_SAMPLES, GEMINI_ROUTER_WINDOW, GEMINI_LONG_CONTEXT_TOKENS,
+        )
+        self.scheduler = scheduler
+        self.retry = retry
+        self.breaker = breaker
+        self.hedge = hedge
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._unrecorded_attempts = 0
+        self.stats = {"requests": 0, "upstream_calls": 0, "attempts": 0, "coalesced": 0, "streams": 0,
+                      "first_token_seconds": 0.0, "succeeded": 0, "succeeded_after_retry": 0, "retries": 0, "failed": 0, "short_circuited": 0,
+                      "usage_reports": 0, "input_tokens": 0, "input_tokens_estimated": 0, "output_tokens": 0}
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(GEMINI_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=GEMINI_MAX_CONNECTIONS,
+                    max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+                    keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY,
+                ),
+                headers={"Content-Type": "application/json"},
+            )
+        return self._client
+
+    async def warm_up(self) -> None:
+        """Open a connection ahead of the first user request (lists one model, costs no quota)."""
+        try:
+            response = await self._http().get(GEMINI_MODELS_URL, params={"key": self.keys.keys[0].key, "pageSize": 1})
+            logger.info(f"Gemini connection ready ({response.http_version}, status {response.status_code})")
+        except httpx.HTTPError as e:
+            logger.error(f"Gemini warm-up failed: {str(e)}")
+
+    async def generate(self, payload: dict, timeout: Optional[float] = None,
+                       on_text: Optional[Callable[[str], Awaitable]] = None,
+                       priority: str = PRIORITY_PRIVATE, user_id=None, route: Optional[str] = None) -> GeminiResponse:
+        """POST a generateContent request. timeout overrides the default read timeout for this call.
+
+        route is the request class of the model table (router.classify(payload) by default).
+        If an identical request is in flight, its result is shared instead of
+        calling Gemini again (the first caller's timeout, on_text and priority apply).
+        priority and user_id pick the scheduler queue.
+        """
+        self.stats["requests"] += 1
+        route = route or self.router.classify(payload)
+        key = request_key(route, payload)
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["upstream_calls"] += 1
+            task = asyncio.ensure_future(self._call(route, payload, timeout, on_text, priority, user_id))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish_flight(key, done))
+        else:
+            self.stats["coalesced"] += 1
+        # A cancelled waiter must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+    def _finish_flight(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here too, in case every waiter was cancelled
+
+    async def _call(self, route: str, payload: dict, timeout: Optional[float],
+                    on_text: Optional[Callable[[str], Awaitable]], priority: str, user_id) -> GeminiResponse:
+        if self.breaker is not None and not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            raise GeminiBusyError("Gemini circuit breaker is open")
+        hedge = self.hedge is not None and priority in self.hedge.priorities
+        if self.scheduler is None:
+            return await self._route(route, payload, timeout, on_text, hedge)
+        try:
+            async with self.scheduler.slot(priority, user_id):
+                return await self._route(route, payload, timeout, on_text, hedge)
+        except QueueTimeout as e:
+            raise GeminiBusyError(f"Gemini queue is full: {str(e)}") from e
+
+    async def _route(self, route: str, payload: dict, timeout: Optional[float],
+                     on_text: Optional[Callable[[str], Awaitable]], hedge: bool = False) -> GeminiResponse:
+        models = self.router.order(route)
+        if models[0] != self.router.routes[route][0]:
+            self.router.stats["rerouted"] += 1
+        shown = False
+
+        async def forward(text: str):
+            nonlocal shown
+            shown = True
+            await on_text(text)
+
+        for index, model in enumerate(models):
+            started = time.monotonic()
+            hedge_model = None
+            if hedge:
+                hedge_model = models[index + 1] if self.hedge.other_model and index + 1 < len(models) else model
+            try:
+                result = await self._request(self.router.url(model), payload, timeout,
+                                             forward if on_text is not None else None, hedge_model)
+            except GeminiBusyError:
+                raise
+            except GeminiError as e:
+                self.router.record(route, model, time.monotonic() - started, False)
+                # 404: the model was retired or renamed
+                if shown or index + 1 == len(models) or not (e.retryable or e.status == 404):
+                    raise
+                self.router.stats["fallbacks"] += 1
+                logger.warning(f"Gemini model {model} failed ({e.status or str(e)}), falling back to {models[index + 1]}")
+                continue
+            self.router.record(route, model, time.monotonic() - started, True)
+            result.model = result.model or model
+            return result
+
+    async def _request(self, url: str, payload: dict, timeout: Optional[float],
+                       on_text: Optional[Callable[[str], Awaitable]],
+                       hedge_model: Optional[str] = None) -> GeminiResponse:
+        started = time.monotonic()
+        shown = False
+
+        async def forward(text: str):
+            nonlocal shown
+            shown = True
+            await on_text(text)
+
+        reserved = estimate_payload_tokens(payload)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                key = await self.keys.acquire(reserved)
+            except KeyPoolExhausted as e:
+                self.stats["failed"] += 1
+                raise GeminiBusyError(f"No Gemini API key available: {str(e)}") from e
+            try:
+                if hedge_model is not None:
+                    result = await self._hedged(url, hedge_model, payload, timeout,
+                                                forward if on_text is not None else None, key, reserved)
+                else:
+                    result = await self._send(url, payload, timeout, forward if on_text is not None else None,
+                                              key, reserved)
+            except GeminiError as e:
+                if self.breaker is not None:
+                    # A rejected request (400, 403, 404...) says nothing about Gemini's health
+                    if not e.retryable and e.status is not None and 400 <= e.status < 500:
+                        self.breaker.release()
+                    else:
+                        self.breaker.record(False)
+                if not e.retryable or shown or self.retry is None:
+                    self.stats["failed"] += 1
+                    raise
+                # The quota of that key is used up, another key can take the request now
+                retry_after = e.retry_after
+                if e.status == 429 and self.keys.has_available(reserved):
+                    retry_after = None
+                delay = self.retry.delay(attempt, retry_after)
+                if (not self.retry.should_retry(attempt, time.monotonic() - started, delay)
+                        or (self.breaker is not None and not self.breaker.allow())):
+                    self.stats["failed"] += 1
+                    raise
+                self.stats["retries"] += 1
+                logger.info(f"Gemini attempt {attempt} failed ({e.status or str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            if "promptTokenCount" in result.usage:
+                self.stats["usage_reports"] += 1
+                self.stats["input_tokens"] += result.usage["promptTokenCount"]
+                self.stats["input_tokens_estimated"] += reserved
+                self.stats["output_tokens"] += result.usage.get("candidatesTokenCount", 0)
+            if self.breaker is not None:
+                self.breaker.record(True)
+            self.stats["succeeded"] += 1
+            if attempt > 1:
+                self.stats["succeeded_after_retry"] += 1
+            return result
+
+    async def _send(self, url: str, payload: dict, timeout: Optional[float],
+                    on_text: Optional[Callable[[str], Awaitable]], key: ApiKey, reserved: int) -> GeminiResponse:
+        """One call with key; the key's reservation is settled with the outcome."""
+        try:
+            if on_text is not None:
+                result = await self._stream(url, payload, timeout, key.key, on_text)
+            else:
+                result = await self._post(url, payload, timeout, key.key)
+        except GeminiError as e:
+            self.keys.settle(key, reserved, 0)
+            if e.status == 429:
+                self.keys.rate_limited(key, e.retry_after)
+            else:
+                key.stats["errors"] += 1
+            raise
+        except asyncio.CancelledError:
+            # Gemini may have billed the abandoned call, keep the reservation
+            self.keys.settle(key, reserved, reserved)
+            raise
+        self.keys.settle(key, reserved, result.usage.get("totalTokenCount", reserved))
+        return result
+
+    async def _hedged(self, url: str, hedge_model: str, payload: dict, timeout: Optional[float],
+                      on_text: Optional[Callable[[str], Awaitable]], key: ApiKey, reserved: int) -> GeminiResponse:
+        """_send, plus a duplicate call to hedge_model when the first one is slower than the hedge delay."""
+        streaming = on_text is not None
+        delay = self.hedge.delay(streaming)
+        started = time.monotonic()
+        tasks, answered = [], {}  # index -> seconds to the first text or the answer
+        winner = None
+
+        def forward(index: int):
+            async def forward_text(text: str):
+                nonlocal winner
+                if winner is None:
+                    winner = index
+                    answered[index] = time.monotonic() - started
+                    for other in tasks:
+                        if other is not tasks[index]:
+                            other.cancel()
+                if winner == index:
+                    await on_text(text)
+            return forward_text
+
+        def start(index: int, target: str, api_key: ApiKey) -> None:
+            task = asyncio.ensure_future(
+                self._send(target, payload, timeout, forward(index) if streaming else None, api_key, reserved)
+            )
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            tasks.append(task)
+
+        start(0, url, key)
+        try:
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not tasks[0].done() and winner is None and self.hedge.allow():
+                    hedge_key = self.keys.try_acquire(reserved, avoid=key)
+                    if hedge_key is None:
+                        self.hedge.stats["no_key"] += 1
+                    else:
+                        self.hedge.stats["hedged"] += 1
+                        self.hedge.stats["extra_tokens"] += reserved
+                        logger.info(f"Gemini call slower than {delay:.1f}s, hedging with {hedge_model}")
+                        start(1, self.router.url(hedge_model), hedge_key)
+
+            errors = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=tasks.index):
+                    index = tasks.index(task)
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        errors[index] = task.exception()
+                    elif winner in (None, index):
+                        winner = index
+                        answered.setdefault(index, time.monotonic() - started)
+                        result = task.result()
+                        if index == 1:
+                            self.hedge.stats["won"] += 1
+                            result.model = hedge_model
+                        return result
+            raise errors.get(0) or errors[1]
+        finally:
+            for task in tasks:
+                task.cancel()
+            # An abandoned first attempt had run at least this long
+            primary = answered.get(0)
+            if primary is None and winner == 1:
+                primary = time.monotonic() - started
+            self.hedge.record(streaming, primary, answered.get(winner), len(tasks) > 1)
+
+    @staticmethod
+    def _timeout(timeout: Optional[float]) -> dict:
+        if timeout is None:
+            return {}
+        return {"timeout": httpx.Timeout(timeout, connect=GEMINI_CONNECT_TIMEOUT)}
+
+    def _count_attempt(self) -> None:
+        self.stats["attempts"] += 1
+        self._unrecorded_attempts += 1
+
+    async def record_calls(self) -> None:
+        """Add the HTTP attempts made since the last call to the database's gemini_calls counter."""
+        attempts, self._unrecorded_attempts = self._unrecorded_attempts, 0
+        if attempts and self.db is not None:
+            try:
+                await self.db.record_event("gemini_calls", attempts)
+            except Exception as e:
+                logger.error(f"Recording Gemini calls failed: {str(e)}")
+
+    async def record_calls_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.record_calls()
+
+    async def _post(self, url: str, payload: dict, timeout: Optional[float], api_key: str) -> GeminiResponse:
+        kwargs = self._timeout(timeout)
+        self._count_attempt()
+        try:
+            response = await self._http().post(url, params={"key": api_key}, **_body_kwargs(payload), **kwargs)
+        except httpx.HTTPError as e:
+            raise GeminiConnectionError(f"Gemini request failed: {e!r}") from e
+
+        if response.status_code != 200:
+            raise GeminiAPIError(f"Gemini API error {response.status_code}", response.status_code, response.text,
+                                 parse_retry_after(response.headers.get("Retry-After"), response.text))
+        try:
+            return parse_response(response.json())
+        except ValueError as e:
+            raise GeminiAPIError("Gemini returned invalid JSON", response.status_code, response.text) from e
+
+    async def _stream(self, url: str, payload: dict, timeout: Optional[float], api_key: str,
+                      on_text: Callable[[str], Awaitable]) -> GeminiResponse:
+        started = time.monotonic()
+        texts, last = [], None
+        self._count_attempt()
+        try:
+            async with self._http().stream("POST", stream_url(url), params={"key": api_key, "alt": "sse"},
+                                           **_body_kwargs(payload), **self._timeout(timeout)) as response:
+                if response.status_code != 200:
+                    body = (await response.aread()).decode('utf-8', 'replace')
+                    raise GeminiAPIError(f"Gemini API error {response.status_code}", response.status_code, body,
+                                         parse_retry_after(response.headers.get("Retry-After"), body))
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    try:
+                        last = parse_response(json.loads(line[5:]))
+                    except ValueError as e:
+                        raise GeminiAPIError("Gemini returned invalid JSON", response.status_code, line) from e
+                    if not last.text:
+                        continue
+                    if not texts:
+                        self.stats["streams"] += 1
+                        self.stats["first_token_seconds"] += time.monotonic() - started
+                    texts.append(last.text)
+                    try:
+                        await on_text("".join(texts))
+                    except Exception as e:
+                        logger.error(f"Streaming callback failed: {str(e)}")
+        except httpx.HTTPError as e:
+            raise GeminiConnectionError(f"Gemini request failed: {e!r}") from e
+
+        if last is None:
+            return GeminiResponse("", None, None, {}, {})
+        # Every chunk carries the usage so far; the last one has the finish reason
+        return GeminiResponse("".join(texts), last.finish_reason, last.block_reason, last.usage, last.data)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats, in_flight=len(self._inflight))
+        if self.scheduler is not None:
+            stats["scheduler"] = self.scheduler.get_stats()
+        if self.breaker is not None:
+            stats["breaker"] = self.breaker.get_stats()
+        stats["keys"] = self.keys.get_stats()
+        stats["router"] = self.router.get_stats()
+        if self.hedge is not None:
+            stats["hedge"] = self.hedge.get_stats()
+        stats["first_token_avg"] = stats["first_token_seconds"] / stats["streams"] if stats["streams"] else 0.0
+        stats["saved_rate"] = stats["coalesced"] / stats["requests"] if stats["requests"] else 0.0
+        reports = stats["usage_reports"]
+        stats["avg_input_tokens"] = stats["input_tokens"] / reports if reports else 0.0
+        stats["avg_output_tokens"] = stats["output_tokens"] / reports if reports else 0.0
+        # > 1 means the local estimator counts more tokens than Gemini does
+        stats["estimate_ratio"] = stats["input_tokens_estimated"] / stats["input_tokens"] if stats["input_tokens"] else 0.0
+        return stats
+
+    async def close(self) -> None:
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
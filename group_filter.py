@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, Optional
+
+# What a group message asks the bot to do
+REQUEST_PHOTO = "photo"  # photo whose caption contains the trigger word
+REQUEST_QUERY = "query"  # text starting with the trigger word
+REQUEST_REPLY = "reply"  # text replying to one of the bot's messages
+
+
+class GroupRequest:
+    """A group message that needs an answer, with the question taken out of it."""
+
+    __slots__ = ("kind", "query")
+
+    def __init__(self, kind: str, query: str):
+        self.kind = kind
+        self.query = query
+
+
+class GroupFilter:
+    """Decides from the message alone whether a group update needs any work.
+
+    The bot sees every message of every group it is in, and only answers
+    photos captioned with the trigger word, texts starting with it and replies
+    to its own messages. check() sorts that out with one lowercase of the
+    text and no network I/O, so everything else is dropped before a photo is
+    downloaded or Gemini is called. Chats in disabled_chats are ignored
+    entirely. stats counts dropped updates by reason, and counters keeps the
+    processed/dropped updates of each chat.
+    """
+
+    def __init__(self, trigger: str, disabled_chats: Iterable[int] = ()):
+        self.trigger = trigger.lower()
+        self.disabled_chats = set(disabled_chats)
+        self.counters: Dict[int, Dict[str, int]] = {}
+        self.stats = {"processed": 0, "dropped": 0, "disabled": 0, "no_trigger": 0, "photo_no_trigger": 0,
+                      "not_text": 0}
+
+    def set_enabled(self, chat_id: int, enabled: bool) -> None:
+        if enabled:
+            self.disabled_chats.discard(chat_id)
+        else:
+            self.disabled_chats.add(chat_id)
+
+    def check(self, chat_id: int, message, bot_id: int) -> Optional[GroupRequest]:
+        """The request in message, or None when the bot has nothing to do with it."""
+        request, reason = self._classify(chat_id, message, bot_id)
+        counters = self.counters.setdefault(chat_id, {"processed": 0, "dropped": 0})
+        if request is None:
+            self.stats["dropped"] += 1
+            self.stats[reason] += 1
+            counters["dropped"] += 1
+        else:
+            self.stats["processed"] += 1
+            counters["processed"] += 1
+        return request
+
+    def _classify(self, chat_id: int, message, bot_id: int):
+        if chat_id in self.disabled_chats:
+            return None, "disabled"
+
+        if message.photo:
+            caption = (message.caption or "").lower()
+            if self.trigger not in caption:
+                return None, "photo_no_trigger"
+            return GroupRequest(REQUEST_PHOTO, caption.replace(self.trigger, "", 1).strip()), None
+
+        if not message.text:
+            return None, "not_text"
+        text = message.text.lower().strip()
+        if text.startswith(self.trigger):
+            return GroupRequest(REQUEST_QUERY, text.replace(self.trigger, "", 1).strip()), None
+
+        replied = message.reply_to_message
+        if replied is not None and replied.from_user is not None and replied.from_user.id == bot_id:
+            return GroupRequest(REQUEST_REPLY, message.text), None
+        return None, "no_trigger"
+
+    def get_stats(self) -> dict:
+        handled = self.stats["processed"] + self.stats["dropped"]
+        return dict(
+            self.stats,
+            chats=len(self.counters),
+            disabled_chats=len(self.disabled_chats),
+            drop_rate=self.stats["dropped"] / handled if handled else 0.0,
+        )
@@ -1,23 +1,56 @@
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
-import requests
-from config import GEMINI_API_KEY, GEMINI_API_URL, GEMINI_VISION_API_URL, BOT_SIGNATURE
+from config import (
+    GEMINI_VISION_TIMEOUT, BOT_SIGNATURE,
+    GEMINI_STREAMING, STREAM_GROUP_EDIT_INTERVAL,
+)
+from gemini_client import GeminiAPIError, GeminiBusyError, GeminiError
+from group_filter import REQUEST_PHOTO, REQUEST_QUERY, REQUEST_REPLY
+from media import MediaBusyError
+from message_stream import MessageStreamer
+from router import ROUTE_SHORT
+from scheduler import PRIORITY_GROUP
+from response_cache import make_key
 import re
 import html
 import time
 import asyncio
 from datetime import datetime, timedelta
-import base64
 import io
 import logging
 
 logger = logging.getLogger(__name__)
 
+# الرد عندما يكون Gemini مضغوطاً (429/5xx بعد إعادة المحاولة، أو الطابور ممتلئ)
+BUSY_REPLY = "⏳ البوت مشغول حالياً، الرجاء المحاولة بعد قليل."
+
 class GroupHandler:
-    def __init__(self, database):
+    def __init__(self, database, gemini, response_cache, semantic_cache, image_preprocessor, image_cache, group_filter):
         self.db = database
+        self.gemini = gemini
+        self.response_cache = response_cache
+        self.semantic_cache = semantic_cache
+        self.image_preprocessor = image_preprocessor
+        self.image_cache = image_cache
+        self.group_filter = group_filter
         self.message_history = {}  # Dictionary to store message history for each group
         self.cleanup_task = None
+
+    async def _reply_cached_analysis(self, message, chat_id, caption, text):
+        """الرد على صورة بتحليل محفوظ"""
+        final_response = add_signature(format_text(text))
+        sent_message = await message.reply_text(final_response, parse_mode='HTML')
+        self.message_history.setdefault(chat_id, {})[sent_message.message_id] = {
+            'question': f"[صورة] {caption}",
+            'response': final_response,
+            'timestamp': time.time()
+        }
+
+    def _streamer(self, message):
+        """يعرض الرد داخل رسالة الانتظار أثناء وصوله من Gemini"""
+        if not GEMINI_STREAMING:
+            return None
+        return MessageStreamer(message, lambda text: format_text(rewrite_credit(text)), STREAM_GROUP_EDIT_INTERVAL)
         
     async def start_cleanup_task(self):
         """بدء مهمة تنظيف الرسائل القديمة"""
@@ -56,7 +89,7 @@ class GroupHandler:
         chat_title = update.effective_chat.title
         
         if update.effective_chat.type in ['group', 'supergroup']:
-            self.db.add_group(chat_id, chat_title)
+            await self.db.add_group(chat_id, chat_title)
             await update.message.reply_text(
                 "شكراً لإضافتي إلى المجموعة! 🤖\n"
                 "يمكنك استخدام الأمر /help للحصول على قائمة الأوامر المتاحة."
@@ -95,36 +128,50 @@ cyber ما هو علم الأمن السيبراني؟
         """التعامل مع الرسائل في المجموعات"""
         message = update.message
         chat_id = update.effective_chat.id
-        
-        # التأكد من تشغيل مهمة التنظيف
-        await self.start_cleanup_task()
-        
+        started = time.monotonic()
+
         # التحقق من أن الرسالة في مجموعة
         if update.effective_chat.type not in ['group', 'supergroup']:
             return
 
-        # معالجة الصور (مع أو بدون نص)
-        if message.photo:
+        # كل رسائل المجموعات تُحسب في إحصائيات group_messages (عداد في الذاكرة فقط)
+        await self.db.record_event("group_messages")
+
+        # استبعاد الرسائل التي لا تخص البوت قبل أي عمل آخر (تُحسب في group_filter.counters)
+        request = self.group_filter.check(chat_id, message, context.bot.id)
+        if request is None:
+            return
+
+        # التأكد من تشغيل مهمة التنظيف
+        await self.start_cleanup_task()
+
+        # معالجة الصور التي يحمل تعليقها كلمة cyber
+        if request.kind == REQUEST_PHOTO:
             try:
-                # الحصول على أفضل نسخة من الصورة
-                photo = message.photo[-1]
-                photo_file = await context.bot.get_file(photo.file_id)
-                
-                # تحميل الصورة
-                photo_data = await photo_file.download_as_bytearray()
-                
-                # تحويل الصورة إلى base64
-                base64_image = base64.b64encode(photo_data).decode('utf-8')
-                
-                # تحضير النص للتحليل
-                caption = None
-                if message.caption and 'cyber' in message.caption.lower():
-                    # Remove the word 'cyber' and any extra spaces
-                    caption = message.caption.lower().replace('cyber', '', 1).strip()
+                # النص المطلوب تحليله (التعليق بدون كلمة cyber)
+                caption = request.query
+                # نفس الصورة بنفس السؤال تم تحليلها من قبل (في هذه المجموعة أو غيرها)
+                file_unique_id = message.photo[-1].file_unique_id
+                question = caption
+                cached_response = self.image_cache.get(file_unique_id, question, "group")
+                if cached_response is not None:
+                    await self._reply_cached_analysis(message, chat_id, caption, cached_response)
+                    return
                 
-                if caption is not None:
-                    caption = f"{caption}  )"
+                # انتظار إذا كان حجم الصور قيد المعالجة كبيراً (MEDIA_MAX_INFLIGHT_BYTES)
+                async with self.image_preprocessor.hold(message.photo):
+                    # تحميل أصغر نسخة من الصورة تكفي للتحليل وتحويلها إلى base64 أثناء التحميل
+                    image = await self.image_preprocessor.prepare(context.bot, message.photo)
+                    # نسخة أعيد رفعها من صورة محفوظة: معرف مختلف لكن بصمة متقاربة
+                    image_hash = await self.image_cache.fingerprint(image)
+                    cached_response = self.image_cache.get_similar(image_hash, question, "group")
+                    if cached_response is not None:
+                        self.image_cache.put(file_unique_id, question, "group", cached_response, image_hash)
+                        await self._reply_cached_analysis(message, chat_id, caption, cached_response)
+                        return
                     
+                    caption = f"{caption}  )"
+                
                     # تحضير الطلب
                     payload = {
                         "contents": [{
@@ -134,7 +181,7 @@ cyber ما هو علم الأمن السيبراني؟
                                 {
                                     "inline_data": {
                                         "mime_type": "image/jpeg",
-                                        "data": base64_image
+                                        "data": image
                                     }
                                 }
                             ]
@@ -146,38 +193,30 @@ cyber ما هو علم الأمن السيبراني؟
                             "maxOutputTokens": 4096,
                         }
                     }
-                    
+                
                     # إرسال رسالة انتظار
                     processing_msg = await message.reply_text("🔍 جاري تحليل الصورة...")
+                
+                    try:
+                        streamer = self._streamer(processing_msg)
+                        result = await self.gemini.generate(payload, timeout=GEMINI_VISION_TIMEOUT,
+                                                            on_text=streamer.update if streamer else None,
+                                                            priority=PRIORITY_GROUP, user_id=message.from_user.id)
+                        ai_response = result.text or 'عذراً، لم أستطع تحليل الصورة.'
                     
-                    # إرسال الطلب إلى Gemini Vision API
-                    headers = {
-                        "Content-Type": "application/json"
-                    }
-                    
-                    vision_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
-                    
-                    response = requests.post(
-                        f"{vision_url}?key={GEMINI_API_KEY}",
-                        headers=headers,
-                        json=payload
-                    )
-                    
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        ai_response = response_data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', 'عذراً، لم أستطع تحليل الصورة.')
-                        
                         # تعديل النص في اي مكان في الرسالة
-                        parts = ai_response.split("تم تدريبي بواسطة جوجل")
-                        ai_response = "تم تدريبي بواسطة جوجل وتم ربطي في البوت وبرمجتي لاتعامل مع المستخدمين من قبل وهيب الشرعبي".join(parts)
-                        
+                        ai_response = rewrite_credit(ai_response)
+                        if result.text:
+                            self.image_cache.put(file_unique_id, question, "group", ai_response, image_hash)
+                    
                         # تنسيق النص
                         formatted_response = format_text(ai_response)
                         final_response = add_signature(formatted_response)
-                        
+                    
                         # إرسال التحليل
                         sent_message = await processing_msg.edit_text(final_response, parse_mode='HTML')
-                        
+                        self.image_preprocessor.record_answer(time.monotonic() - started)
+                    
                         # حفظ الرد في التاريخ
                         if chat_id not in self.message_history:
                             self.message_history[chat_id] = {}
@@ -186,26 +225,30 @@ cyber ما هو علم الأمن السيبراني؟
                             'response': final_response,
                             'timestamp': time.time()
                         }
-                    else:
-                        await processing_msg.edit_text("⚠️ عذراً، حدث خطأ في معالجة الصورة. الرجاء المحاولة مرة أخرى.")
-                        logger.error(f"API Error: {response.status_code}\n{response.text}")
-                
+                    except GeminiError as e:
+                        if e.retryable or isinstance(e, GeminiBusyError):
+                            await processing_msg.edit_text(BUSY_REPLY)
+                        else:
+                            await processing_msg.edit_text("⚠️ عذراً، حدث خطأ في معالجة الصورة. الرجاء المحاولة مرة أخرى.")
+                        logger.error(f"API Error: {e.status}\n{e.body[:500] or e}")
+            
+            except MediaBusyError as e:
+                await message.reply_text(BUSY_REPLY)
+                logger.error(f"Error processing image: {str(e)}")
             except Exception as e:
                 await message.reply_text("⚠️ عذراً، حدث خطأ أثناء تحليل الصورة. الرجاء المحاولة مرة أخرى.")
                 logger.error(f"Error processing image: {str(e)}")
             return
 
-        # التحقق من نوع الرسالة
-        if not message.text:
-            return
-
         # الحالة الأولى: رسالة تبدأ بـ cyber
-        if message.text.lower().strip().startswith('cyber'):
-            query = message.text.lower().replace('cyber', '', 1).strip()
+        if request.kind == REQUEST_QUERY:
+            query = request.query
             if query:
                 try:
                     processing_msg = await message.reply_text("🤔 جاري التفكير...")
-                    response = await self.get_ai_response(query)
+                    response = await self.get_ai_response(
+                        query, streamer=self._streamer(processing_msg), user_id=message.from_user.id
+                    )
                     formatted_response = format_text(response)
                     full_response = f"{formatted_response}\n\n"
                     final_response = add_signature(full_response)
@@ -226,7 +269,7 @@ cyber ما هو علم الأمن السيبراني؟
             return
 
         # الحالة الثانية: رد على رسالة البوت
-        if message.reply_to_message and message.reply_to_message.from_user.id == context.bot.id:
+        if request.kind == REQUEST_REPLY:
             try:
                 # استرجاع السياق السابق من التاريخ
                 previous_context = ""
@@ -237,7 +280,10 @@ cyber ما هو علم الأمن السيبراني؟
                     previous_context = message.text
 
                 processing_msg = await message.reply_text("🤔 جاري التفكير...")
-                response = await self.get_ai_response(previous_context)
+                response = await self.get_ai_response(
+                    previous_context, match_similar=False, streamer=self._streamer(processing_msg),
+                    user_id=message.from_user.id
+                )
                 formatted_response = format_text(response)
                 full_response = f"{formatted_response}\n\n"
                 final_response = add_signature(full_response)
@@ -256,7 +302,7 @@ cyber ما هو علم الأمن السيبراني؟
 
     async def broadcast_message(self, context: ContextTypes.DEFAULT_TYPE, message: str):
         """إرسال رسالة إلى جميع المجموعات"""
-        groups = self.db.get_all_groups()
+        groups = await self.db.get_all_groups()
         success_count = 0
         fail_count = 0
         
@@ -270,13 +316,14 @@ cyber ما هو علم الأمن السيبراني؟
         
         return success_count, fail_count
 
-    async def get_ai_response(self, text: str) -> str:
-        """الحصول على رد من Gemini API"""
+    async def get_ai_response(self, text: str, match_similar: bool = True, streamer=None, user_id=None) -> str:
+        """الحصول على رد من Gemini API
+
+        match_similar يسمح بإعادة رد محفوظ لسؤال مشابه (لا يستخدم مع الردود التي تحمل سياقاً سابقاً).
+        streamer (MessageStreamer) يعرض الرد في رسالة الانتظار أثناء وصوله.
+        user_id يحدد دور المستخدم في طابور طلبات المجموعات.
+        """
         try:
-            headers = {
-                "Content-Type": "application/json",
-            }
-            
             data = {
                 "contents": [{
                     "parts": [{
@@ -285,74 +332,45 @@ cyber ما هو علم الأمن السيبراني؟
                 }]
             }
             
-            response = requests.post(
-                f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-                headers=headers,
-                json=data
-            )
+            # نفس السؤال يتكرر كثيراً في المجموعات، لذلك نعيد الرد المحفوظ إن وجد
+            cache_key = make_key(data["contents"][0]["parts"][0]["text"], model=ROUTE_SHORT)
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response
+            similar = self.semantic_cache.lookup(text, "group") if match_similar else None
+            if similar is not None and not similar.audit:
+                return similar.answer
             
-            if response.status_code == 200:
-                response_data = response.json()
-                if response_data.get("candidates"):
-                    ai_response = response_data["candidates"][0]["content"]["parts"][0]["text"]
-                    
-                    # تعديل النص في اي مكان في الرسالة
-                    parts = ai_response.split("تم تدريبي بواسطة جوجل")
-                    ai_response = "تم تدريبي بواسطة جوجل وتم ربطي في البوت وبرمجتي لاتعامل مع المستخدمين من قبل وهيب الشرعبي".join(parts)
-                    
-                    return ai_response
+            try:
+                result = await self.gemini.generate(
+                    data, on_text=streamer.update if streamer else None,
+                    priority=PRIORITY_GROUP, user_id=user_id
+                )
+            except GeminiBusyError as e:
+                logger.error(str(e))
+                return BUSY_REPLY
+            except GeminiAPIError as e:
+                logger.error(f"API Error: {e.status}\n{e.body[:500]}")
+                if e.retryable:
+                    return BUSY_REPLY
+                result = None
+            
+            if result is not None and result.text:
+                ai_response = result.text
+                
+                # تعديل النص في اي مكان في الرسالة
+                ai_response = rewrite_credit(ai_response)
+                
+                self.response_cache.put(cache_key, ai_response)
+                if match_similar:
+                    self.semantic_cache.add(text, ai_response, "group")
+                if similar is not None:
+                    self.semantic_cache.record_audit(similar, ai_response)
+                return ai_response
             return "عذراً، لم أستطع فهم طلبك. هل يمكنك إعادة صياغة السؤال؟"
         except Exception as e:
             raise Exception("حدث خطأ في الاتصال مع Gemini API")
 
-    async def get_image_analysis(self, image_data: bytes, text: str) -> str:
-        """تحليل الصورة باستخدام Gemini Vision API"""
-        try:
-            # تحويل الصورة إلى Base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            headers = {
-                "Content-Type": "application/json",
-            }
-            
-            data = {
-                "contents": [{
-                    "parts": [
-                        {
-                            "text": f"{text} (استخدم ايموجي تفاعلي مناسب مع كل فكرة في الرد)"
-                        },
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_base64
-                            }
-                        }
-                    ]
-                }]
-            }
-            
-            response = requests.post(
-                f"{GEMINI_VISION_API_URL}?key={GEMINI_API_KEY}",
-                headers=headers,
-                json=data
-            )
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                if response_data.get("candidates"):
-                    return response_data["candidates"][0]["content"]["parts"][0]["text"]
-            return "عذراً، لم أستطع تحليل الصورة. هل يمكنك المحاولة مرة أخرى؟"
-        except Exception as e:
-            raise Exception(f"حدث خطأ في تحليل الصورة: {str(e)}")
-
-    async def get_image_from_url(self, url: str) -> bytes:
-        """تحميل الصورة من عنوان URL"""
-        try:
-            response = requests.get(url)
-            return response.content
-        except Exception as e:
-            raise Exception(f"حدث خطأ في تحميل الصورة: {str(e)}")
-
 def format_text(text: str) -> str:
     """Format mixed text (Arabic/English) for better readability with HTML support."""
     # Split text into paragraphs while preserving code blocks
@@ -423,6 +441,10 @@ def format_text(text: str) -> str:
     final_text = '\n\n'.join(part for part in formatted_parts if part.strip())
     return final_text
 
+def rewrite_credit(text: str) -> str:
+    """استبدال عبارة "تم تدريبي بواسطة جوجل" بتعريف البوت"""
+    return text.replace("تم تدريبي بواسطة جوجل", "تم تدريبي بواسطة جوجل وتم ربطي في البوت وبرمجتي لاتعامل مع المستخدمين من قبل وهيب الشرعبي")
+
 def add_signature(text: str):
     """Add a signature to long messages"""
     signature = "\n\n━━━━━━━━━━━━━━\n📢 قناة التلجرام: @SyberSc71\n👨‍💻 برمجة: @WAT4F"
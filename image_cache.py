@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import io
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from media import PIL_AVAILABLE, InlineImage
+from response_cache import ENTRY_OVERHEAD
+from search_index import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def caption_key(caption: Optional[str], scope: str) -> str:
+    """Key of the question asked about an image: normalized caption and where it was asked."""
+    normalized = " ".join(normalize_text(caption or "").split())
+    return hashlib.sha256(f"{scope}\n{normalized}".encode('utf-8')).hexdigest()
+
+
+def perceptual_hash(data: bytes) -> int:
+    """64-bit difference hash (dHash): the brightness gradients of a 9x8 grayscale thumbnail.
+    Re-encoded, resized or lightly edited copies of an image get hashes a few bits apart."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+class ImageAnalysisCache:
+    """Gemini analyses of images, reused when the same image is asked about again.
+
+    Entries are keyed by the Telegram file_unique_id of the photo (the same for
+    every forwarded copy) plus the normalized caption and scope, so a hit skips
+    the download and the Gemini call. With phash_distance set (and Pillow
+    installed) a missed image is also compared by perceptual hash with the
+    cached images of the same question, which catches re-uploaded and
+    re-encoded copies; that needs the download but still saves the call.
+    Entries are kept in LRU order within max_bytes and expire after ttl.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, phash_distance: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.phash_distance = phash_distance if PIL_AVAILABLE else None
+        self.enabled = True
+        # (file_unique_id, caption key) -> (expires_at, text, size, image hash)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # caption key -> {image hash: entry key} of the entries that have a hash
+        self._hashes: Dict[str, Dict[int, tuple]] = {}
+        self._bytes = 0
+        self.stats = {"lookups": 0, "hits": 0, "phash_lookups": 0, "phash_hits": 0, "stores": 0,
+                      "evictions": 0, "expirations": 0, "purges": 0}
+
+    def _live(self, key: tuple) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.time():
+            self._drop(key)
+            self.stats["expirations"] += 1
+            return None
+        return entry
+
+    def get(self, file_unique_id: str, caption: Optional[str], scope: str) -> Optional[str]:
+        """Cached analysis of this exact image and question."""
+        if not self.enabled:
+            return None
+        self.stats["lookups"] += 1
+        key = (file_unique_id, caption_key(caption, scope))
+        entry = self._live(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    async def fingerprint(self, image: InlineImage) -> Optional[int]:
+        """Perceptual hash of a downloaded image, None when near-duplicate matching is off."""
+        if not self.enabled or self.phash_distance is None:
+            return None
+        try:
+            return await asyncio.to_thread(lambda: perceptual_hash(image.decode()))
+        except Exception as e:
+            logger.error(f"Perceptual hash failed: {str(e)}")
+            return None
+
+    def get_similar(self, image_hash: Optional[int], caption: Optional[str], scope: str) -> Optional[str]:
+        """Cached analysis of a near-duplicate image asked the same question."""
+        if not self.enabled or image_hash is None:
+            return None
+        self.stats["phash_lookups"] += 1
+        best, best_distance = None, self.phash_distance + 1
+        for other, key in list(self._hashes.get(caption_key(caption, scope), {}).items()):
+            distance = bin(image_hash ^ other).count("1")
+            if distance < best_distance and self._live(key) is not None:
+                best, best_distance = key, distance
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        self.stats["phash_hits"] += 1
+        return self._entries[best][1]
+
+    def put(self, file_unique_id: str, caption: Optional[str], scope: str, text: str,
+            image_hash: Optional[int] = None) -> None:
+        if not self.enabled or not text:
+            return
+        key = (file_unique_id, caption_key(caption, scope))
+        size = len(file_unique_id) + len(text.encode('utf-8')) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (time.time() + self.ttl, text, size, image_hash)
+        if image_hash is not None:
+            self._hashes.setdefault(key[1], {})[image_hash] = key
+        self._bytes += size
+        self.stats["stores"] += 1
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[2]
+        hashes = self._hashes.get(key[1])
+        if entry[3] is not None and hashes is not None and hashes.get(entry[3]) == key:
+            del hashes[entry[3]]
+            if not hashes:
+                del self._hashes[key[1]]
+
+    def purge(self) -> int:
+        """Remove every entry. Returns how many were removed."""
+        count = len(self._entries)
+        self._entries.clear()
+        self._hashes.clear()
+        self._bytes = 0
+        self.stats["purges"] += 1
+        return count
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["lookups"]
+        return dict(
+            self.stats,
+            enabled=self.enabled,
+            phash=self.phash_distance is not None,
+            entries=len(self._entries),
+            bytes=self._bytes,
+            max_bytes=self.max_bytes,
+            hit_rate=(self.stats["hits"] + self.stats["phash_hits"]) / lookups if lookups else 0.0,
+        )
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from typing import List, Optional
+
+
+class KeyPoolExhausted(Exception):
+    """No API key has quota left within the allowed wait."""
+
+
+class TokenBucket:
+    """Allowance of rate_per_minute units that refills continuously. None means unlimited."""
+
+    def __init__(self, rate_per_minute: Optional[float]):
+        self.capacity = rate_per_minute
+        self.level = rate_per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount (at most the whole capacity) is available."""
+        if self.capacity is None:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float) -> None:
+        """Use amount (negative gives it back); the level may go below zero."""
+        if self.capacity is not None:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+    def utilization(self) -> float:
+        if not self.capacity:
+            return 0.0
+        self._refill(time.monotonic())
+        return max(0.0, 1 - self.level / self.capacity)
+
+
+class ApiKey:
+    """One Gemini API key with its request (RPM) and token (TPM) buckets."""
+
+    def __init__(self, key: str, rpm: Optional[float], tpm: Optional[float]):
+        self.key = key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.stats = {"requests": 0, "tokens": 0, "rate_limited": 0, "errors": 0}
+
+    @property
+    def label(self) -> str:
+        return f"…{self.key[-4:]}"
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        return max(self.cooldown_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def load(self) -> float:
+        return max(self.requests.utilization(), self.tokens.utilization())
+
+
+class KeyPool:
+    """Spreads Gemini calls over several API keys.
+
+    Every key has token buckets for its requests and tokens per minute; a call
+    goes to the least loaded key that has room for it. Tokens are reserved from
+    an estimate and settled with the real usage afterwards. A key that gets a
+    429 cools down (for the server's Retry-After, or cooldown seconds). When no
+    key has room the call waits for one, at most max_wait seconds.
+    """
+
+    def __init__(self, keys: List[str], rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 cooldown: float = 60, max_wait: float = 10):
+        if not keys:
+            raise ValueError("at least one API key is needed")
+        self.keys = [ApiKey(key, rpm, tpm) for key in keys]
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+
+    async def acquire(self, tokens: int) -> ApiKey:
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            now = time.monotonic()
+            waits = [(key.wait_time(tokens, now), key.load(), index) for index, key in enumerate(self.keys)]
+            wait, _, index = min(waits)
+            if wait <= 0:
+                return self._take(self.keys[index], tokens)
+            if now + wait > deadline:
+                raise KeyPoolExhausted(f"all {len(self.keys)} API keys are at their limit for {wait:.0f}s")
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, tokens: int, avoid: Optional[ApiKey] = None) -> Optional[ApiKey]:
+        """A key with room right now, another one than avoid when possible; None instead of waiting."""
+        now = time.monotonic()
+        ready = [
+            (key is avoid, key.load(), index)
+            for index, key in enumerate(self.keys) if key.wait_time(tokens, now) <= 0
+        ]
+        if not ready:
+            return None
+        _, _, index = min(ready)
+        return self._take(self.keys[index], tokens)
+
+    @staticmethod
+    def _take(key: ApiKey, tokens: int) -> ApiKey:
+        key.requests.take(1)
+        key.tokens.take(tokens)
+        key.stats["requests"] += 1
+        return key
+
+    def settle(self, key: ApiKey, reserved: int, used: int) -> None:
+        """Correct the reservation with the tokens the call really used."""
+        key.tokens.take(used - reserved)
+        key.stats["tokens"] += used
+
+    def rate_limited(self, key: ApiKey, retry_after: Optional[float] = None) -> None:
+        key.stats["rate_limited"] += 1
+        key.cooldown_until = time.monotonic() + (retry_after if retry_after is not None else self.cooldown)
+
+    def has_available(self, tokens: int = 0) -> bool:
+        now = time.monotonic()
+        return any(key.wait_time(tokens, now) <= 0 for key in self.keys)
+
+    def get_stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [
+            dict(
+                key.stats,
+                label=key.label,
+                rpm_used=key.requests.utilization(),
+                tpm_used=key.tokens.utilization(),
+                cooldown=max(0.0, key.cooldown_until - now),
+            )
+            for key in self.keys
+        ]
@@ -0,0 +1,283 @@
+import asyncio
+import base64
+import hashlib
+import importlib.util
+import io
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Sequence
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Resizing and recompressing need the optional Pillow package (pip install Pillow);
+# without it the photo size Telegram already made is sent as is
+PIL_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+
+def pick_photo_size(sizes: Sequence, target_side: int):
+    """Smallest PhotoSize whose longer side reaches target_side, or the largest one."""
+    ordered = sorted(sizes, key=lambda size: max(size.width, size.height))
+    for size in ordered:
+        if max(size.width, size.height) >= target_side:
+            return size
+    return ordered[-1]
+
+
+class MediaBusyError(Exception):
+    """No room in the media byte budget within the allowed wait."""
+
+
+class InlineImage:
+    """Base64 text of an image, kept in the chunks it was encoded in.
+
+    GeminiClient writes the chunks into the request body as they are (see
+    gemini_client.encode_body), so the image is never copied into a str or
+    into the JSON text of the request. digest (sha256 of the image) stands in
+    for the data when requests are compared.
+    """
+
+    __slots__ = ("chunks", "size", "digest")
+
+    def __init__(self, chunks: List[bytes], size: int, digest: str):
+        self.chunks = chunks
+        self.size = size  # bytes of the image itself
+        self.digest = digest
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "InlineImage":
+        return cls([base64.b64encode(data)], len(data), hashlib.sha256(data).hexdigest())
+
+    @property
+    def encoded_size(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def decode(self) -> bytes:
+        return base64.b64decode(b"".join(self.chunks))
+
+
+class Base64Writer:
+    """Base64-encodes an image while it is downloaded (whole 3-byte groups at a time)."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self._carry = b""
+        self._hash = hashlib.sha256()
+
+    def write(self, data: bytes) -> None:
+        self._hash.update(data)
+        self.size += len(data)
+        data = self._carry + data
+        cut = len(data) - len(data) % 3
+        if cut:
+            self.chunks.append(base64.b64encode(data[:cut]))
+        self._carry = data[cut:]
+
+    def finish(self) -> InlineImage:
+        if self._carry:
+            self.chunks.append(base64.b64encode(self._carry))
+            self._carry = b""
+        return InlineImage(self.chunks, self.size, self._hash.hexdigest())
+
+
+class MediaBudget:
+    """Caps the image bytes being downloaded and sent to Gemini at the same time.
+
+    A photo holds its reservation from the download until its Gemini call is
+    over. When max_bytes are taken, new photos wait for earlier ones to finish
+    (backpressure on bursts of photos) and give up with MediaBusyError after
+    max_wait seconds. A single image larger than the whole budget only waits
+    for the budget to be empty.
+    """
+
+    def __init__(self, max_bytes: int, max_wait: float):
+        self.max_bytes = max_bytes
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._waiters: List[asyncio.Future] = []
+        self.stats = {"reservations": 0, "waited": 0, "wait_seconds": 0.0, "rejected": 0, "max_in_flight": 0}
+
+    @asynccontextmanager
+    async def hold(self, nbytes: int):
+        nbytes = min(nbytes, self.max_bytes)
+        await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    async def acquire(self, nbytes: int) -> None:
+        self.stats["reservations"] += 1
+        if self.in_flight + nbytes <= self.max_bytes and not self._waiters:
+            self._take(nbytes)
+            return
+
+        started = time.monotonic()
+        self.stats["waited"] += 1
+        while self.in_flight + nbytes > self.max_bytes:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await asyncio.wait_for(future, started + self.max_wait - time.monotonic())
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                raise MediaBusyError(f"{self.in_flight} bytes of images in flight for {self.max_wait}s") from None
+            finally:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+        self._take(nbytes)
+        self.stats["wait_seconds"] += time.monotonic() - started
+
+    def _take(self, nbytes: int) -> None:
+        self.in_flight += nbytes
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+
+    def release(self, nbytes: int) -> None:
+        self.in_flight -= nbytes
+        waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, in_flight=self.in_flight, max_bytes=self.max_bytes, waiting=len(self._waiters))
+
+
+def shrink_jpeg(data: bytes, target_side: int, max_bytes: int, quality: int) -> Optional[bytes]:
+    """Downscale to target_side and re-encode as JPEG, lowering the quality until it fits
+    in max_bytes. None if the result isn't smaller than data."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        if max(image.size) > target_side:
+            image.thumbnail((target_side, target_side), Image.LANCZOS)
+        best = None
+        while quality >= 40:
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            best = buffer.getvalue()
+            if len(best) <= max_bytes:
+                break
+            quality -= 15
+    return best if best is not None and len(best) < len(data) else None
+
+
+class ImagePreprocessor:
+    """Gets a photo ready for Gemini with as few bytes as needed.
+
+    Telegram keeps every photo in several sizes; the smallest one whose longer
+    side reaches target_side is downloaded instead of the largest (up to
+    2560px). With Pillow installed, a photo that is still larger than
+    target_side or max_bytes is downloaded whole, downscaled and recompressed
+    in a worker thread; any other photo is streamed from Telegram straight into
+    a base64 encoder, so its raw bytes are never held in full. With a budget,
+    hold() makes photos wait while too many image bytes are in flight.
+    stats compares the bytes sent with the size of the largest version and
+    tracks the preparation and end-to-end time per image.
+    """
+
+    def __init__(self, target_side: int, max_bytes: int, quality: int, resize: bool = True,
+                 budget: Optional[MediaBudget] = None):
+        self.target_side = target_side
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.resize = resize and PIL_AVAILABLE
+        self.budget = budget
+        self._client: Optional[httpx.AsyncClient] = None
+        self.stats = {"images": 0, "largest_bytes": 0, "downloaded_bytes": 0, "sent_bytes": 0, "resized": 0,
+                      "streamed": 0, "prepare_seconds": 0.0, "answered": 0, "total_seconds": 0.0,
+                      "max_total_seconds": 0.0}
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(30, connect=10))
+        return self._client
+
+    def _needs_resize(self, size) -> bool:
+        return self.resize and ((size.file_size or 0) > self.max_bytes
+                                or max(size.width, size.height) > self.target_side)
+
+    @asynccontextmanager
+    async def hold(self, sizes: Sequence):
+        """Reserve the base64 bytes of the photo that prepare() will download (see MediaBudget)."""
+        if self.budget is None:
+            yield
+            return
+        size = pick_photo_size(sizes, self.target_side)
+        async with self.budget.hold(((size.file_size or self.max_bytes) + 2) // 3 * 4):
+            yield
+
+    async def prepare(self, bot, sizes: Sequence) -> InlineImage:
+        """Base64 JPEG of a message's photo (message.photo) to send to Gemini as inline_data."""
+        started = time.monotonic()
+        size = pick_photo_size(sizes, self.target_side)
+        photo_file = await bot.get_file(size.file_id)
+        resized = False
+        if self._needs_resize(size):
+            data = bytes(await photo_file.download_as_bytearray())
+            downloaded = len(data)
+            try:
+                smaller = await asyncio.to_thread(shrink_jpeg, data, self.target_side, self.max_bytes, self.quality)
+            except Exception as e:
+                logger.error(f"Image resize failed: {str(e)}")
+                smaller = None
+            resized = smaller is not None
+            image = InlineImage.from_bytes(smaller if resized else data)
+            del data
+        elif photo_file.file_path.startswith(("https://", "http://")):
+            image = await self._stream(photo_file.file_path)
+            downloaded = image.size
+            self.stats["streamed"] += 1
+        else:
+            # Local Bot API server: file_path is a file on disk
+            image = InlineImage.from_bytes(bytes(await photo_file.download_as_bytearray()))
+            downloaded = image.size
+
+        largest = max(sizes, key=lambda item: max(item.width, item.height))
+        self.stats["images"] += 1
+        self.stats["resized"] += resized
+        self.stats["largest_bytes"] += largest.file_size or downloaded
+        self.stats["downloaded_bytes"] += downloaded
+        self.stats["sent_bytes"] += image.size
+        self.stats["prepare_seconds"] += time.monotonic() - started
+        return image
+
+    async def _stream(self, url: str) -> InlineImage:
+        writer = Base64Writer()
+        try:
+            async with self._http().stream("GET", url) as response:
+                if response.status_code != 200:
+                    raise RuntimeError(f"Photo download failed with status {response.status_code}")
+                async for chunk in response.aiter_bytes():
+                    writer.write(chunk)
+        except httpx.HTTPError as e:
+            # The file URL contains the bot token, keep it out of the logs
+            raise RuntimeError(f"Photo download failed: {type(e).__name__}") from None
+        return writer.finish()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    def record_answer(self, seconds: float) -> None:
+        """Time from receiving a photo to the final answer."""
+        self.stats["answered"] += 1
+        self.stats["total_seconds"] += seconds
+        self.stats["max_total_seconds"] = max(self.stats["max_total_seconds"], seconds)
+
+    def get_stats(self) -> dict:
+        images, answered = self.stats["images"], self.stats["answered"]
+        saved = self.stats["largest_bytes"] - self.stats["sent_bytes"]
+        return dict(
+            self.stats,
+            bytes_saved=saved,
+            saved_rate=saved / self.stats["largest_bytes"] if self.stats["largest_bytes"] else 0.0,
+            avg_prepare_seconds=self.stats["prepare_seconds"] / images if images else 0.0,
+            avg_total_seconds=self.stats["total_seconds"] / answered if answered else 0.0,
+            budget=self.budget.get_stats() if self.budget is not None else None,
+        )
@@ -0,0 +1,65 @@
+import html
+import logging
+import time
+from typing import Callable
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from config import STREAM_MIN_CHARS
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this (after entity parsing)
+TELEGRAM_MESSAGE_LIMIT = 4096
+CURSOR = " ▌"
+
+
+def close_open_markup(text: str) -> str:
+    """Partial answer with an unfinished ``` block closed, so it renders like the complete answer."""
+    if text.count("```") % 2:
+        text += "\n```"
+    return text
+
+
+class MessageStreamer:
+    """Shows a streamed answer by editing the placeholder message as it grows.
+
+    Pass update() as on_text to GeminiClient.generate. render turns the partial
+    text into the HTML shown (format_text); an unfinished code block is closed
+    first and if Telegram still rejects the HTML the partial text is shown
+    escaped. The final answer is sent by the caller as before.
+    """
+
+    def __init__(self, message, render: Callable[[str], str], interval: float, min_chars: int = STREAM_MIN_CHARS):
+        self.message = message
+        self.render = render
+        self.interval = interval
+        self.min_chars = min_chars
+        self.edits = 0
+        self._next_edit = 0.0  # the first chunk is shown right away
+        self._shown = 0
+
+    async def update(self, text: str) -> None:
+        now = time.monotonic()
+        if now < self._next_edit or (self._shown and len(text) - self._shown < self.min_chars):
+            return
+        formatted = self.render(close_open_markup(text))
+        if len(formatted) + len(CURSOR) > TELEGRAM_MESSAGE_LIMIT:
+            return  # too long for one message, the caller sends the full answer at the end
+        self._next_edit = now + self.interval
+        self._shown = len(text)
+        try:
+            await self.message.edit_text(formatted + CURSOR, parse_mode='HTML')
+            self.edits += 1
+        except RetryAfter as e:
+            self._next_edit = now + e.retry_after
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            try:
+                await self.message.edit_text(html.escape(text) + CURSOR, parse_mode='HTML')
+                self.edits += 1
+            except TelegramError as e:
+                logger.error(f"Could not show partial answer: {str(e)}")
+        except TelegramError as e:
+            logger.error(f"Could not show partial answer: {str(e)}")
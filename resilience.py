@@ -0,0 +1,191 @@
+import random
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Iterable, Optional
+
+from router import percentile
+
+# Statuses worth another attempt: rate limited, overloaded or a server-side error
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Gemini puts the wait in a RetryInfo detail of the error body, e.g. "retryDelay": "27s"
+_RETRY_DELAY = re.compile(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"')
+
+
+def parse_retry_after(header: Optional[str], body: str = "") -> Optional[float]:
+    """Seconds to wait from a Retry-After header (seconds or HTTP date) or the error body's retryDelay."""
+    if header:
+        header = header.strip()
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    match = _RETRY_DELAY.search(body or "")
+    return float(match.group(1)) if match else None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by a number of attempts and a total time budget."""
+
+    def __init__(self, attempts: int, base_delay: float, max_delay: float, budget: float):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Wait before attempt + 1. The server's Retry-After wins over the backoff when it is longer."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            return max(retry_after + random.uniform(0, self.base_delay), backoff)
+        return backoff
+
+    def should_retry(self, attempt: int, elapsed: float, delay: float) -> bool:
+        return attempt < self.attempts and elapsed + delay <= self.budget
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for a while.
+
+    Outcomes of the last window seconds are kept; when at least min_requests
+    were made and failure_rate of them failed the breaker opens and allow()
+    refuses calls for open_seconds. Then one trial call is let through
+    (half-open): its success closes the breaker, a failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window: float, min_requests: int, failure_rate: float, open_seconds: float):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opened = 0
+        self._outcomes = deque()  # (time, failed)
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_at = None  # when the half-open trial call was let through
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] <= now - self.window:
+            _, failed = self._outcomes.popleft()
+            self._failures -= failed
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN and now >= self._open_until:
+            self.state = self.HALF_OPEN
+            self._trial_at = None
+        # Another trial if the last one never reported back (cancelled)
+        if self.state == self.HALF_OPEN and (self._trial_at is None or now - self._trial_at > self.open_seconds):
+            self._trial_at = now
+            return True
+        return False
+
+    def record(self, success: bool) -> None:
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            if success:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+                self._failures = 0
+            else:
+                self._open(now)
+            return
+        self._outcomes.append((now, not success))
+        self._failures += not success
+        self._trim(now)
+        if (not success and self.state == self.CLOSED and len(self._outcomes) >= self.min_requests
+                and self._failures / len(self._outcomes) >= self.failure_rate):
+            self._open(now)
+
+    def release(self) -> None:
+        """A call ended without telling whether the service works (e.g. the request was
+        rejected as invalid): when half-open, the next call becomes the trial."""
+        if self.state == self.HALF_OPEN:
+            self._trial_at = None
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self.opened += 1
+        self._open_until = now + self.open_seconds
+
+    def get_stats(self) -> dict:
+        self._trim(time.monotonic())
+        return {
+            "state": self.state,
+            "opened": self.opened,
+            "window_requests": len(self._outcomes),
+            "window_failures": self._failures,
+            "retry_in": max(0.0, self._open_until - time.monotonic()) if self.state == self.OPEN else 0.0,
+        }
+
+
+class HedgePolicy:
+    """When to send a duplicate of a slow Gemini call (request hedging).
+
+    The hedge delay is the percentile of the recent latencies of first attempts
+    (time to the first streamed text, or to the whole answer of a plain call;
+    kept apart for the two), and at least min_delay. There is no hedge until
+    min_samples latencies are known, for priorities other than the given ones,
+    or while max_rate of the last window requests were already hedged.
+    stats and get_stats() compare the latency users got with the latency of the
+    first attempts, against the extra calls and tokens the hedges cost.
+    """
+
+    def __init__(self, quantile: float, min_delay: float, max_rate: float, window: int, min_samples: int,
+                 priorities: Iterable[str], other_model: bool = False):
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.priorities = frozenset(priorities)
+        self.other_model = other_model
+        self._primary = {True: deque(maxlen=window), False: deque(maxlen=window)}
+        self._served = {True: deque(maxlen=window), False: deque(maxlen=window)}
+        self._hedged = deque(maxlen=window)
+        self.stats = {"requests": 0, "hedged": 0, "won": 0, "capped": 0, "no_key": 0, "extra_tokens": 0}
+
+    def delay(self, streaming: bool) -> Optional[float]:
+        """Seconds to wait for the first attempt before hedging, None while too few latencies are known."""
+        samples = self._primary[streaming]
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(list(samples), self.quantile))
+
+    def allow(self) -> bool:
+        if self._hedged and sum(self._hedged) / len(self._hedged) >= self.max_rate:
+            self.stats["capped"] += 1
+            return False
+        return True
+
+    def record(self, streaming: bool, primary: Optional[float], served: Optional[float], hedged: bool) -> None:
+        """primary: latency of the first attempt (when it was abandoned, how long it had run);
+        served: latency of the attempt that answered."""
+        self.stats["requests"] += 1
+        self._hedged.append(hedged)
+        if primary is not None:
+            self._primary[streaming].append(primary)
+        if served is not None:
+            self._served[streaming].append(served)
+
+    def get_stats(self) -> dict:
+        kinds = {}
+        for streaming, name in ((True, "stream"), (False, "post")):
+            primary, served = list(self._primary[streaming]), list(self._served[streaming])
+            kinds[name] = {
+                "delay": self.delay(streaming),
+                "p99": percentile(primary, 0.99) if primary else None,
+                "served_p50": percentile(served, 0.5) if served else None,
+                "served_p99": percentile(served, 0.99) if served else None,
+            }
+        return dict(self.stats, rate=sum(self._hedged) / len(self._hedged) if self._hedged else 0.0, kinds=kinds)
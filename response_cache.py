@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from search_index import normalize_text
+from storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# Bookkeeping bytes counted per entry on top of the key and the text
+ENTRY_OVERHEAD = 100
+
+
+def make_key(prompt: str, config: Optional[dict] = None, model: str = "") -> str:
+    """Cache key of a prompt: case, diacritics and whitespace don't matter, the model and config do."""
+    normalized = " ".join(normalize_text(prompt).split())
+    raw = json.dumps([model, normalized, config or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Exact-match cache of Gemini answers with a TTL and a byte budget.
+
+    Entries are kept in LRU order; when the texts go over max_bytes the least
+    recently used ones are evicted. With persist_file the cache is loaded on
+    start and written back by save() (expired entries are dropped both ways).
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, persist_file: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persist_file = persist_file
+        self.enabled = True
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, text, size)
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "purges": 0}
+        if persist_file:
+            self.load()
+
+    @staticmethod
+    def _size(key: str, text: str) -> int:
+        return len(key) + len(text.encode('utf-8')) + ENTRY_OVERHEAD
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.time():
+            self._drop(key)
+            self.stats["expirations"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key: str, text: str, ttl: Optional[float] = None) -> None:
+        if not self.enabled or not text:
+            return
+        size = self._size(key, text)
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), text, size)
+        self._bytes += size
+        self.stats["stores"] += 1
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def purge(self) -> int:
+        """Remove every entry. Returns how many were removed."""
+        count = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        self.stats["purges"] += 1
+        return count
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            enabled=self.enabled,
+            entries=len(self._entries),
+            bytes=self._bytes,
+            max_bytes=self.max_bytes,
+            hit_rate=self.stats["hits"] / lookups if lookups else 0.0,
+        )
+
+    def load(self) -> None:
+        if not self.persist_file or not os.path.exists(self.persist_file):
+            return
+        try:
+            with open(self.persist_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.error(f"Could not load response cache {self.persist_file}: {str(e)}")
+            return
+        now = time.time()
+        for key, expires_at, text in entries:
+            if expires_at > now:
+                self.put(key, text, ttl=expires_at - now)
+        self.stats["stores"] = 0
+        logger.info(f"Loaded {len(self._entries)} cached responses from {self.persist_file}")
+
+    def save(self) -> None:
+        """Write the live entries to persist_file, least recently used first."""
+        if not self.persist_file:
+            return
+        now = time.time()
+        entries = [[key, expires_at, text] for key, (expires_at, text, _) in self._entries.items() if expires_at > now]
+        try:
+            write_json_atomic(self.persist_file, entries, indent=None)
+        except Exception as e:
+            logger.error(f"Could not save response cache {self.persist_file}: {str(e)}")
@@ -0,0 +1,111 @@
+import time
+from collections import deque
+from typing import Dict, List
+
+from tokens import estimate_payload_tokens
+
+ROUTE_SHORT = "short"
+ROUTE_LONG = "long"
+ROUTE_IMAGE = "image"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ModelHealth:
+    """Latencies and outcomes of the calls to one model during the last window seconds."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._samples = deque()  # (time, seconds, ok)
+
+    def record(self, seconds: float, ok: bool) -> None:
+        now = time.monotonic()
+        self._samples.append((now, seconds, ok))
+        self._trim(now)
+
+    def _trim(self, now: float) -> None:
+        while self._samples and self._samples[0][0] <= now - self.window:
+            self._samples.popleft()
+
+    def get_stats(self) -> dict:
+        self._trim(time.monotonic())
+        latencies = [seconds for _, seconds, ok in self._samples if ok]
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        return {
+            "samples": len(self._samples),
+            "p50": percentile(latencies, 0.5) if latencies else None,
+            "p95": percentile(latencies, 0.95) if latencies else None,
+            "error_rate": errors / len(self._samples) if self._samples else 0.0,
+        }
+
+
+class ModelRouter:
+    """Picks the Gemini model for a request from a table of routes.
+
+    routes maps a request class (short text, long conversation, image) to its
+    models, preferred first. A model is healthy while its rolling p95 latency
+    stays under max_p95[route] and its error rate under max_error_rate (with
+    fewer than min_samples calls in the window it counts as healthy). order()
+    lists the healthy models first, in table order, then the others from best to
+    worst; the client falls back along that list when a call fails. Samples
+    expire after window seconds, so a model that was skipped gets tried again.
+    """
+
+    def __init__(self, base_url: str, routes: Dict[str, List[str]], max_p95: Dict[str, float],
+                 max_error_rate: float, min_samples: int, window: float, long_tokens: int):
+        self.base_url = base_url.rstrip("/")
+        self.routes = {route: list(models) for route, models in routes.items()}
+        self.max_p95 = dict(max_p95)
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.long_tokens = long_tokens
+        # kept per route: the same model is slower on long conversations than on short questions
+        self._health = {
+            (route, model): ModelHealth(window) for route, models in self.routes.items() for model in models
+        }
+        self.stats = {"fallbacks": 0, "rerouted": 0}
+
+    def url(self, model: str) -> str:
+        return f"{self.base_url}/{model}:generateContent"
+
+    def classify(self, payload: dict) -> str:
+        """Request class of a payload: image, long conversation or short text."""
+        for content in payload.get("contents", []):
+            if any("inline_data" in part for part in content.get("parts", [])):
+                return ROUTE_IMAGE
+        if estimate_payload_tokens(payload) > self.long_tokens:
+            return ROUTE_LONG
+        return ROUTE_SHORT
+
+    def _healthy(self, route: str, stats: dict) -> bool:
+        if stats["samples"] < self.min_samples:
+            return True
+        if stats["error_rate"] > self.max_error_rate:
+            return False
+        return stats["p95"] is None or stats["p95"] <= self.max_p95.get(route, float("inf"))
+
+    def order(self, route: str) -> List[str]:
+        models = self.routes[route]
+        stats = {model: self._health[route, model].get_stats() for model in models}
+        healthy = [model for model in models if self._healthy(route, stats[model])]
+        others = sorted(
+            (model for model in models if model not in healthy),
+            key=lambda model: (stats[model]["error_rate"], stats[model]["p95"] or 0.0),
+        )
+        return healthy + others
+
+    def record(self, route: str, model: str, seconds: float, ok: bool) -> None:
+        health = self._health.get((route, model))
+        if health is not None:
+            health.record(seconds, ok)
+
+    def get_stats(self) -> dict:
+        return dict(
+            self.stats,
+            models={f"{route}/{model}": health.get_stats() for (route, model), health in self._health.items()},
+            routes={route: self.order(route)[0] for route in self.routes},
+        )
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable
+
+PRIORITY_PREMIUM = "premium"
+PRIORITY_PRIVATE = "private"
+PRIORITY_GROUP = "group"
+PRIORITY_BACKGROUND = "background"  # work nobody is waiting for, e.g. conversation summaries
+
+
+class QueueTimeout(Exception):
+    """No slot became free before the request's queue deadline."""
+
+
+class RequestScheduler:
+    """Concurrency cap with weighted priority classes and per-user fair queuing.
+
+    At most max_concurrent requests hold a slot. When all are taken, requests
+    wait in the queue of their class (premium / private / group / background);
+    free slots go to the classes by smooth weighted round-robin (weights), so
+    premium users are served first without starving groups. Inside a class every user has
+    their own queue and users take turns, so one user flooding the bot only
+    delays themselves. A request waiting longer than max_wait[class] seconds
+    gives up with QueueTimeout.
+    """
+
+    def __init__(self, max_concurrent: int, weights: Dict[str, int], max_wait: Dict[str, float]):
+        self.max_concurrent = max_concurrent
+        self.weights = dict(weights)
+        self.max_wait = dict(max_wait)
+        self._current = dict.fromkeys(self.weights, 0)
+        self._queues: Dict[str, "OrderedDict[Hashable, deque]"] = {p: OrderedDict() for p in self.weights}
+        self._depth = dict.fromkeys(self.weights, 0)
+        self._running = 0
+        self.stats = {
+            p: {"granted": 0, "expired": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "max_depth": 0}
+            for p in self.weights
+        }
+
+    @asynccontextmanager
+    async def slot(self, priority: str, user_id: Hashable = None):
+        await self.acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: str, user_id: Hashable = None) -> None:
+        started = time.monotonic()
+        if self._running < self.max_concurrent and not any(self._depth.values()):
+            self._running += 1
+            self._record(priority, 0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(future)
+        self._depth[priority] += 1
+        stats = self.stats[priority]
+        stats["max_depth"] = max(stats["max_depth"], self._depth[priority])
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait[priority])
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self._remove(priority, user_id, future)
+                stats["expired"] += 1
+                raise QueueTimeout(f"no free slot within {self.max_wait[priority]}s ({priority})") from None
+            # the slot was granted just as the deadline passed
+        except asyncio.CancelledError:
+            if future.done():
+                self.release()
+            else:
+                future.cancel()
+                self._remove(priority, user_id, future)
+            raise
+        self._record(priority, time.monotonic() - started)
+
+    def release(self) -> None:
+        self._running -= 1
+        self._dispatch()
+
+    def _record(self, priority: str, waited: float) -> None:
+        stats = self.stats[priority]
+        stats["granted"] += 1
+        stats["wait_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def _remove(self, priority: str, user_id: Hashable, future: asyncio.Future) -> None:
+        queue = self._queues[priority].get(user_id)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        self._depth[priority] -= 1
+        if not queue:
+            del self._queues[priority][user_id]
+
+    def _pick(self):
+        """Next class to serve (smooth weighted round-robin over the classes with waiters)."""
+        active = [p for p in self.weights if self._depth[p]]
+        if not active:
+            return None
+        for p in active:
+            self._current[p] += self.weights[p]
+        best = max(active, key=lambda p: self._current[p])
+        self._current[best] -= sum(self.weights[p] for p in active)
+        return best
+
+    def _dispatch(self) -> None:
+        while self._running < self.max_concurrent:
+            priority = self._pick()
+            if priority is None:
+                return
+            users = self._queues[priority]
+            user_id, queue = next(iter(users.items()))
+            future = queue.popleft()
+            self._depth[priority] -= 1
+            # The user goes to the back of the line; their next request waits for everyone else's turn
+            if queue:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            self._running += 1
+            future.set_result(None)
+
+    def get_stats(self) -> dict:
+        classes = {}
+        for p, stats in self.stats.items():
+            classes[p] = dict(stats, depth=self._depth[p], waiting_users=len(self._queues[p]))
+            classes[p]["avg_wait_seconds"] = stats["wait_seconds"] / stats["granted"] if stats["granted"] else 0.0
+        return {"running": self._running, "max_concurrent": self.max_concurrent, "classes": classes}
@@ -0,0 +1,115 @@
+import re
+import unicodedata
+from typing import Dict, List, Set, Tuple
+
+# Letters folded together after diacritics are stripped: alef wasla, alef maqsura,
+# teh marbuta; tatweel (kashida) is dropped
+_FOLD = str.maketrans({"ٱ": "ا", "ى": "ي", "ة": "ه", "ـ": None})
+_WORD = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> str:
+    """Case-fold and strip diacritics so that "أحمد", "إحمد" and "احمَد" all match "احمد"."""
+    # NFKD splits hamza/madda forms of alef (أ إ آ) into a bare alef plus a combining mark
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return text.translate(_FOLD)
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(normalize_text(text))
+
+
+class GroupSearchIndex:
+    """In-memory search index over group titles and chat ids.
+
+    Every word is indexed by its trigrams, so words of three letters or more
+    are found as substrings without a scan; one and two letter words are
+    matched as substrings by scanning the indexed words. A query matches a
+    group when each of its words occurs in the title or the chat id; results
+    are ranked by how well the words match (whole word > prefix > substring).
+    """
+
+    def __init__(self):
+        self._docs: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @staticmethod
+    def _keys(words) -> Set[str]:
+        return {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+
+    def add(self, chat_id, title: str):
+        """Index a group, replacing its previous title if it was indexed already."""
+        chat_id = str(chat_id)
+        self.remove(chat_id)
+        title = normalize_text(title or "")
+        words = tuple(_WORD.findall(title)) + tuple(_WORD.findall(chat_id))
+        self._docs[chat_id] = (title, words)
+        for gram in self._keys(words):
+            self._grams.setdefault(gram, set()).add(chat_id)
+
+    def remove(self, chat_id):
+        doc = self._docs.pop(str(chat_id), None)
+        if doc is None:
+            return
+        for gram in self._keys(doc[1]):
+            postings = self._grams[gram]
+            postings.discard(str(chat_id))
+            if not postings:
+                del self._grams[gram]
+
+    def _candidates(self, term: str) -> Set[str]:
+        if len(term) < 3:
+            # Too short for a trigram: scan the words, like the old substring search did
+            return {chat_id for chat_id, (_, words) in self._docs.items() if any(term in word for word in words)}
+        postings = sorted((self._grams.get(term[i:i + 3], set()) for i in range(len(term) - 2)), key=len)
+        candidates = set(postings[0])
+        for other in postings[1:]:
+            candidates &= other
+            if not candidates:
+                break
+        return candidates
+
+    @staticmethod
+    def _term_score(term: str, words: Tuple[str, ...]) -> int:
+        best = 0
+        for word in words:
+            if word == term:
+                return 3
+            if word.startswith(term):
+                best = 2
+            elif best == 0 and term in word:
+                best = 1
+        return best
+
+    def search(self, query: str) -> List[str]:
+        """Chat ids of the groups matching every word of query, best match first."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        candidates = None
+        for term in sorted(set(terms), key=len, reverse=True):
+            matches = self._candidates(term)
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return []
+
+        normalized_query = " ".join(terms)
+        ranked = []
+        for chat_id in candidates:
+            title, words = self._docs[chat_id]
+            scores = [self._term_score(term, words) for term in terms]
+            if not all(scores):
+                continue  # trigrams matched but the word itself doesn't occur
+            score = sum(scores)
+            if chat_id == query.strip():
+                score += 10
+            elif " ".join(_WORD.findall(title)) == normalized_query:
+                score += 5
+            ranked.append((-score, len(title), chat_id))
+        ranked.sort()
+        return [chat_id for _, _, chat_id in ranked]
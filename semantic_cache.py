@@ -0,0 +1,196 @@
+import itertools
+import random
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from search_index import tokenize
+
+# Question and filler words that don't change what is being asked (already normalized)
+STOPWORDS = frozenset("""
+ما ماذا ماهو ماهي هو هي هل في من الى على عن مع او ثم كيف لماذا ليش متى اين اي ايش شو كم هذا هذه ذلك تلك
+التي الذي اللي يا لو ممكن عندي ابي ابغي اريد اشرح وضح عرف معني يعني
+what whats is are was the a an of in on to for how why when which who do does can could you me
+i please explain define tell about
+""".split())
+
+# Words that flip the meaning: questions only match when they have the same ones
+NEGATIONS = frozenset("غير لا ليس ليست بدون بلا not non without".split())
+
+# Definite article and prefixed conjunction/prepositions stripped from longer words
+ARTICLE_PREFIXES = ("وال", "بال", "كال", "فال", "لل", "ال")
+
+_PRIME = (1 << 61) - 1
+
+
+def question_tokens(text: str) -> List[str]:
+    """Normalized content words of a question, without stopwords and article prefixes."""
+    tokens = []
+    for token in tokenize(text):
+        if token in STOPWORDS:
+            continue
+        for prefix in ARTICLE_PREFIXES:
+            if token.startswith(prefix) and len(token) - len(prefix) >= 3:
+                token = token[len(prefix):]
+                break
+        tokens.append(token)
+    return tokens
+
+
+def shingles(text: str, tokens: Optional[List[str]] = None) -> FrozenSet[str]:
+    """Character trigrams of each word (with word boundaries), so spelling and word order matter little."""
+    grams = set()
+    for token in tokens if tokens is not None else tokenize(text):
+        padded = f"#{token}#"
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SemanticMatch:
+    """A cached answer to a similar question."""
+
+    __slots__ = ("entry_id", "question", "answer", "similarity", "audit")
+
+    def __init__(self, entry_id: int, question: str, answer: str, similarity: float, audit: bool):
+        self.entry_id = entry_id
+        self.question = question
+        self.answer = answer
+        self.similarity = similarity
+        self.audit = audit
+
+
+class SemanticCache:
+    """Answers to recently asked questions, found again for near-duplicate questions.
+
+    Questions are reduced to trigram sets of their normalized content words and
+    indexed with MinHash + LSH banding (bands x rows hash functions); candidates that
+    share a band are verified with the exact Jaccard similarity against threshold.
+    Everything runs locally, no embedding service is needed.
+
+    A share of the hits (audit_rate) is still answered by Gemini: the caller
+    passes the fresh answer to record_audit(), and when it has little in common
+    with the cached one the hit is counted as a false positive.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl: float, audit_rate: float = 0.0,
+                 audit_agreement: float = 0.25, bands: int = 16, rows: int = 4, seed: int = 1):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.audit_rate = audit_rate
+        self.audit_agreement = audit_agreement
+        self.bands = bands
+        self.rows = rows
+        self.enabled = True
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(bands * rows)]
+        self._random = random.Random()
+        self._ids = itertools.count()
+        # entry id -> (expires_at, namespace, question, grams, answer, band keys, negations), in LRU order
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._buckets: Dict[Tuple, Set[int]] = {}
+        self.stats = {"lookups": 0, "hits": 0, "near_hits": 0, "misses": 0, "stores": 0,
+                      "evictions": 0, "audits": 0, "false_positives": 0}
+
+    def _band_keys(self, namespace: str, grams: FrozenSet[str]) -> List[Tuple]:
+        hashes = [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+        signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms]
+        return [
+            (namespace, band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.bands)
+        ]
+
+    def lookup(self, question: str, namespace: str = "") -> Optional[SemanticMatch]:
+        """The cached answer of the most similar question, if it reaches the threshold."""
+        if not self.enabled:
+            return None
+        tokens = question_tokens(question)
+        grams = shingles(question, tokens)
+        if not grams:
+            return None
+        self.stats["lookups"] += 1
+        negations = NEGATIONS.intersection(tokens)
+
+        now = time.time()
+        best_id, best_similarity = None, 0.0
+        candidates = set()
+        for key in self._band_keys(namespace, grams):
+            candidates.update(self._buckets.get(key, ()))
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry[0] <= now:
+                self._drop(entry_id)
+                continue
+            if entry[6] != negations:
+                continue
+            similarity = jaccard(grams, entry[3])
+            if similarity > best_similarity:
+                best_id, best_similarity = entry_id, similarity
+
+        if best_id is None or best_similarity < self.threshold:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(best_id)
+        self.stats["hits"] += 1
+        if best_similarity < 1.0:
+            self.stats["near_hits"] += 1
+        entry = self._entries[best_id]
+        audit = self._random.random() < self.audit_rate
+        return SemanticMatch(best_id, entry[2], entry[4], best_similarity, audit)
+
+    def add(self, question: str, answer: str, namespace: str = "") -> None:
+        if not self.enabled or not answer:
+            return
+        tokens = question_tokens(question)
+        grams = shingles(question, tokens)
+        if not grams:
+            return
+        entry_id = next(self._ids)
+        keys = self._band_keys(namespace, grams)
+        self._entries[entry_id] = (
+            time.time() + self.ttl, namespace, question, grams, answer, keys, NEGATIONS.intersection(tokens)
+        )
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(entry_id)
+        self.stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def record_audit(self, match: SemanticMatch, fresh_answer: str) -> bool:
+        """Compare an audited hit with Gemini's own answer. Returns True for a false positive."""
+        self.stats["audits"] += 1
+        false_positive = jaccard(shingles(match.answer), shingles(fresh_answer)) < self.audit_agreement
+        if false_positive:
+            self.stats["false_positives"] += 1
+        return false_positive
+
+    def _drop(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for key in entry[5]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def purge(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self._buckets.clear()
+        return count
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats, enabled=self.enabled, entries=len(self._entries), threshold=self.threshold)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["false_positive_rate"] = stats["false_positives"] / stats["audits"] if stats["audits"] else 0.0
+        return stats
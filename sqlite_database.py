@@ -0,0 +1,572 @@
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from config import DB_FILE, DB_SQLITE_FILE, GROUP_SEARCH_PAGE_SIZE
+from database import COUNTER_METRICS, USER_FIELDS, TimeSeriesCounters
+from search_index import GroupSearchIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    first_name TEXT NOT NULL DEFAULT '',
+    join_date TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    image_count INTEGER NOT NULL DEFAULT 0,
+    daily_image_date TEXT,
+    daily_image_count INTEGER NOT NULL DEFAULT 0,
+    last_active TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active);
+
+CREATE TABLE IF NOT EXISTS groups (
+    chat_id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    join_date TEXT NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    last_active TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_groups_last_active ON groups (last_active);
+CREATE INDEX IF NOT EXISTS idx_groups_inactive ON groups (chat_id) WHERE message_count = 0;
+
+CREATE TABLE IF NOT EXISTS banned_users (
+    seq INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL UNIQUE,
+    added_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS premium_users (
+    seq INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL UNIQUE,
+    added_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS statistics (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+INSERT OR IGNORE INTO statistics (name, value) VALUES ('total_messages', 0), ('total_images', 0);
+
+CREATE TABLE IF NOT EXISTS counters (
+    bucket TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, metric)
+) WITHOUT ROWID;
+"""
+
+USER_COLUMNS = "user_id, username, first_name, join_date, message_count, image_count, daily_image_date, daily_image_count, last_active, extra"
+GROUP_COLUMNS = "chat_id, title, join_date, message_count, last_active, extra"
+GROUP_FIELDS = ("title", "join_date", "message_count", "last_active")
+
+
+class SQLiteDatabase:
+    """Database backed by SQLite tables, with the same public API as database.Database.
+
+    Only the rows a call needs are read, so memory does not grow with the number
+    of users. The connection is shared between threads and guarded by a lock;
+    sqlite3 caches the compiled statements, so the constant SQL strings below are
+    prepared once per connection.
+    """
+
+    def __init__(self, db_file: str = DB_SQLITE_FILE):
+        self.db_file = db_file
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # Databases created before users had an extra column
+        if "extra" not in {row["name"] for row in self.conn.execute("PRAGMA table_info(users)")}:
+            self.conn.execute("ALTER TABLE users ADD COLUMN extra TEXT NOT NULL DEFAULT '{}'")
+        # Only used for bucket keys and retention cutoffs, the counts live in the counters table
+        self.counters = TimeSeriesCounters({})
+        self._current_hour = None
+        # (bucket, metric) -> count of record_event() calls not written yet
+        self._pending_counts: Dict[Tuple[str, str], int] = {}
+        # Group titles are searched in memory, the index is rebuilt from the groups table on start
+        self.group_index = GroupSearchIndex()
+        for row in self.conn.execute("SELECT chat_id, title FROM groups"):
+            self.group_index.add(row["chat_id"], row["title"])
+
+    def close(self):
+        with self.lock:
+            if self._pending_counts:
+                self.conn.execute("BEGIN")
+                self._write_pending_counts()
+                self.conn.execute("COMMIT")
+            self.conn.close()
+
+    def get_storage_stats(self) -> dict:
+        """Size of the SQLite database file."""
+        page_size = self._fetchone("PRAGMA page_size")[0]
+        page_count = self._fetchone("PRAGMA page_count")[0]
+        return {"mode": "sqlite", "file_bytes": page_size * page_count}
+
+    def _execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def _fetchone(self, sql: str, params=()) -> Optional[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def _fetchall(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _user_dict(row: sqlite3.Row) -> dict:
+        daily = {}
+        if row["daily_image_date"]:
+            daily[row["daily_image_date"]] = row["daily_image_count"]
+        user = {
+            "username": row["username"],
+            "first_name": row["first_name"],
+            "join_date": row["join_date"],
+            "message_count": row["message_count"],
+            "image_count": row["image_count"],
+            "daily_image_count": daily,
+            "last_active": row["last_active"],
+        }
+        user.update(json.loads(row["extra"]))
+        return user
+
+    @staticmethod
+    def _group_dict(row: sqlite3.Row) -> dict:
+        group = json.loads(row["extra"])
+        group.update({
+            "title": row["title"],
+            "join_date": row["join_date"],
+            "message_count": row["message_count"],
+            "last_active": row["last_active"],
+        })
+        return group
+
+    # ---- time-series counters ----
+
+    def _count(self, metric: str, amount: int = 1):
+        """Increment a time-series counter; the caller holds the lock and a transaction."""
+        now = datetime.now()
+        hour_key, day_key = self.counters.bucket_keys(now)
+        for key in (hour_key, day_key):
+            self._add_count(key, metric, amount)
+        self._write_pending_counts()
+        if hour_key != self._current_hour:
+            self._current_hour = hour_key
+            hour_cutoff, day_cutoff = self.counters.cutoffs(now)
+            self.conn.execute("DELETE FROM counters WHERE bucket >= 'h:' AND bucket < ?", (hour_cutoff,))
+            self.conn.execute(
+                "INSERT INTO counters (bucket, metric, value) "
+                "SELECT 'm:' || substr(bucket, 3, 7), metric, SUM(value) FROM counters "
+                "WHERE bucket >= 'd:' AND bucket < ? GROUP BY 1, 2 "
+                "ON CONFLICT (bucket, metric) DO UPDATE SET value = value + excluded.value",
+                (day_cutoff,)
+            )
+            self.conn.execute("DELETE FROM counters WHERE bucket >= 'd:' AND bucket < ?", (day_cutoff,))
+
+    def _add_count(self, bucket: str, metric: str, amount: int):
+        self.conn.execute(
+            "INSERT INTO counters (bucket, metric, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (bucket, metric) DO UPDATE SET value = value + excluded.value",
+            (bucket, metric, amount)
+        )
+
+    def _write_pending_counts(self):
+        """Write the counts of record_event(); the caller holds the lock and a transaction."""
+        pending, self._pending_counts = self._pending_counts, {}
+        for (bucket, metric), amount in pending.items():
+            self._add_count(bucket, metric, amount)
+
+    def record_event(self, metric: str, amount: int = 1):
+        """Count an event (group_messages, gemini_calls...) in the hourly and daily buckets.
+
+        The count is kept in memory and written with the next counted write or on close().
+        """
+        with self.lock:
+            for key in self.counters.bucket_keys(datetime.now()):
+                self._pending_counts[(key, metric)] = self._pending_counts.get((key, metric), 0) + amount
+
+    def _bucket_counts(self, keys: List[str]) -> Dict[str, dict]:
+        placeholders = ", ".join("?" * len(keys))
+        counts = {key: dict.fromkeys(COUNTER_METRICS, 0) for key in keys}
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT bucket, metric, value FROM counters WHERE bucket IN ({placeholders})", keys
+            ).fetchall()
+            pending = [(key, amount) for key, amount in self._pending_counts.items() if key[0] in counts]
+        for row in rows:
+            counts[row["bucket"]][row["metric"]] = row["value"]
+        for (bucket, metric), amount in pending:
+            counts[bucket][metric] = counts[bucket].get(metric, 0) + amount
+        return counts
+
+    def get_daily_stats(self) -> dict:
+        key = date.today().strftime("d:%Y-%m-%d")
+        return self._bucket_counts([key])[key]
+
+    def get_daily_series(self, days: int = 7) -> List[Tuple[str, dict]]:
+        """Per-day counters of the last `days` days, oldest first."""
+        labels = [label for label, _ in self.counters.get_days(days)]
+        counts = self._bucket_counts([f"d:{label}" for label in labels])
+        return [(label, counts[f"d:{label}"]) for label in labels]
+
+    def get_hourly_series(self, hours: int = 24) -> List[Tuple[str, dict]]:
+        """Per-hour counters of the last `hours` hours, oldest first."""
+        labels = [label for label, _ in self.counters.get_hours(hours)]
+        counts = self._bucket_counts([f"h:{label}" for label in labels])
+        return [(label, counts[f"h:{label}"]) for label in labels]
+
+    # ---- users ----
+
+    def add_user(self, user_id: int, username: str, first_name: str):
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO users (user_id, username, first_name, join_date, last_active) VALUES (?, ?, ?, ?, ?)",
+                    (int(user_id), username, first_name, now, now)
+                )
+                if cursor.rowcount:
+                    self._count("new_users")
+                    self._count("active_users")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def user_exists(self, user_id: int) -> bool:
+        return self._fetchone("SELECT 1 FROM users WHERE user_id = ?", (int(user_id),)) is not None
+
+    def update_user_activity(self, user_id: int, message_type: str = "text"):
+        now = datetime.now()
+        today = now.strftime("%Y-%m-%d")
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                previous = self.conn.execute("SELECT last_active FROM users WHERE user_id = ?", (int(user_id),)).fetchone()
+                if previous is not None and previous[0] < today:
+                    self._count("active_users")
+                if message_type == "text":
+                    cursor = self.conn.execute(
+                        "UPDATE users SET message_count = message_count + 1, last_active = ? WHERE user_id = ?",
+                        (now.isoformat(), int(user_id))
+                    )
+                    counter, metric = "total_messages", "messages"
+                elif message_type in ["photo", "image"]:
+                    cursor = self.conn.execute(
+                        "UPDATE users SET image_count = image_count + 1, "
+                        "daily_image_count = CASE WHEN daily_image_date = ? THEN daily_image_count + 1 ELSE 1 END, "
+                        "daily_image_date = ?, last_active = ? WHERE user_id = ?",
+                        (today, today, now.isoformat(), int(user_id))
+                    )
+                    counter, metric = "total_images", "images"
+                else:
+                    cursor = self.conn.execute(
+                        "UPDATE users SET last_active = ? WHERE user_id = ?",
+                        (now.isoformat(), int(user_id))
+                    )
+                    counter = metric = None
+                if cursor.rowcount and counter:
+                    self.conn.execute("UPDATE statistics SET value = value + 1 WHERE name = ?", (counter,))
+                    self._count(metric)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_user_stats(self, user_id: int) -> Optional[dict]:
+        row = self._fetchone(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (int(user_id),))
+        return self._user_dict(row) if row else None
+
+    def get_user_info(self, user_id: int) -> dict:
+        """Get user information by ID."""
+        return self.get_user_stats(user_id)
+
+    def get_all_users(self) -> List[dict]:
+        return [self._user_dict(row) for row in self._fetchall(f"SELECT {USER_COLUMNS} FROM users")]
+
+    def get_all_user_ids(self) -> List[str]:
+        return [str(row[0]) for row in self._fetchall("SELECT user_id FROM users")]
+
+    def get_total_users(self) -> int:
+        return self._fetchone("SELECT COUNT(*) FROM users")[0]
+
+    def get_active_today_count(self) -> int:
+        """Number of distinct users active today."""
+        return self.get_daily_stats()["active_users"]
+
+    def get_recent_active_users(self, limit: int = 5) -> List[dict]:
+        """The `limit` most recently active users, newest first, each with its user_id."""
+        rows = self._fetchall(f"SELECT {USER_COLUMNS} FROM users ORDER BY last_active DESC LIMIT ?", (limit,))
+        return [{"user_id": str(row["user_id"]), **self._user_dict(row)} for row in rows]
+
+    def get_total_stats(self) -> dict:
+        stats = {row["name"]: row["value"] for row in self._fetchall("SELECT name, value FROM statistics")}
+        return {
+            "total_messages": stats.get("total_messages", 0),
+            "total_images": stats.get("total_images", 0),
+            "total_users": self.get_total_users()
+        }
+
+    def get_daily_image_count(self, user_id: int) -> int:
+        today = datetime.now().strftime("%Y-%m-%d")
+        row = self._fetchone(
+            "SELECT daily_image_count FROM users WHERE user_id = ? AND daily_image_date = ?",
+            (int(user_id), today)
+        )
+        return row[0] if row else 0
+
+    def can_send_image(self, user_id: int) -> bool:
+        """Check if user can send more images today."""
+        if self.is_user_premium(user_id):
+            return True  # Premium users have unlimited images
+        if not self.user_exists(user_id):
+            return False
+        return self.get_daily_image_count(user_id) < 5  # Regular users limited to 5 images per day
+
+    def increment_daily_image_count(self, user_id: int):
+        """Increment the user's daily image count."""
+        today = datetime.now().strftime("%Y-%m-%d")
+        self._execute(
+            "UPDATE users SET image_count = image_count + 1, "
+            "daily_image_count = CASE WHEN daily_image_date = ? THEN daily_image_count + 1 ELSE 1 END, "
+            "daily_image_date = ? WHERE user_id = ?",
+            (today, today, int(user_id))
+        )
+
+    def broadcast_message(self, message: str) -> List[str]:
+        return self.get_all_user_ids()
+
+    # ---- bans and premium membership ----
+
+    def ban_user(self, user_id: int):
+        self._execute(
+            "INSERT OR IGNORE INTO banned_users (user_id, added_at) VALUES (?, ?)",
+            (int(user_id), datetime.now().isoformat())
+        )
+
+    def unban_user(self, user_id: int):
+        self._execute("DELETE FROM banned_users WHERE user_id = ?", (int(user_id),))
+
+    def get_banned_users(self) -> list:
+        """Get list of banned user IDs."""
+        return [str(row[0]) for row in self._fetchall("SELECT user_id FROM banned_users ORDER BY seq")]
+
+    def is_user_banned(self, user_id: int) -> bool:
+        """Check if user is banned."""
+        return self._fetchone("SELECT 1 FROM banned_users WHERE user_id = ?", (int(user_id),)) is not None
+
+    def is_user_premium(self, user_id: int) -> bool:
+        """Check if user is premium."""
+        return self._fetchone("SELECT 1 FROM premium_users WHERE user_id = ?", (int(user_id),)) is not None
+
+    def add_premium_user(self, user_id: int) -> bool:
+        """Add user to premium users list. Returns True if user was added, False if already premium."""
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO premium_users (user_id, added_at) VALUES (?, ?)",
+            (int(user_id), datetime.now().isoformat())
+        )
+        return cursor.rowcount > 0
+
+    def remove_premium_user(self, user_id: int) -> bool:
+        """Remove user from premium users list. Returns True if user was removed, False if not premium."""
+        cursor = self._execute("DELETE FROM premium_users WHERE user_id = ?", (int(user_id),))
+        return cursor.rowcount > 0
+
+    def get_premium_users(self) -> List[str]:
+        return [str(row[0]) for row in self._fetchall("SELECT user_id FROM premium_users ORDER BY seq")]
+
+    # ---- groups ----
+
+    def add_group(self, chat_id: int, title: str):
+        """إضافة مجموعة جديدة أو تحديث معلوماتها"""
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO groups (chat_id, title, join_date, last_active) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET title = excluded.title, last_active = excluded.last_active",
+                (int(chat_id), title, now, now)
+            )
+            self.group_index.add(int(chat_id), title)
+
+    @staticmethod
+    def _group_summary(row: sqlite3.Row) -> Dict:
+        return {
+            "chat_id": str(row["chat_id"]),
+            "title": row["title"],
+            "join_date": row["join_date"],
+            "message_count": row["message_count"],
+            "last_active": row["last_active"]
+        }
+
+    def get_all_groups(self, limit: Optional[int] = None) -> List[Dict]:
+        """الحصول على قائمة جميع المجموعات (أو أول limit مجموعة)"""
+        rows = self._fetchall(
+            f"SELECT {GROUP_COLUMNS} FROM groups ORDER BY rowid LIMIT ?",
+            (-1 if limit is None else limit,)
+        )
+        return [self._group_summary(row) for row in rows]
+
+    def get_group_counts(self) -> Dict[str, int]:
+        """عدد المجموعات الكلي والنشطة وغير النشطة"""
+        total = self._fetchone("SELECT COUNT(*) FROM groups")[0]
+        inactive = self._fetchone("SELECT COUNT(*) FROM groups WHERE message_count = 0")[0]
+        return {"total": total, "active": total - inactive, "inactive": inactive}
+
+    def get_inactive_groups(self) -> List[Dict]:
+        """المجموعات التي لم تُرسل فيها أي رسالة"""
+        rows = self._fetchall(f"SELECT {GROUP_COLUMNS} FROM groups WHERE message_count = 0 ORDER BY rowid")
+        return [self._group_summary(row) for row in rows]
+
+    def update_group_activity(self, chat_id: int):
+        """تحديث نشاط المجموعة"""
+        self._execute(
+            "UPDATE groups SET message_count = message_count + 1, last_active = ? WHERE chat_id = ?",
+            (datetime.now().isoformat(), int(chat_id))
+        )
+
+    def update_group_info(self, chat_id: str, info: dict) -> None:
+        """تحديث معلومات المجموعة."""
+        with self.lock:
+            row = self.conn.execute(f"SELECT {GROUP_COLUMNS} FROM groups WHERE chat_id = ?", (int(chat_id),)).fetchone()
+            if row is None:
+                return
+            group = self._group_dict(row)
+            group.update(info)
+            extra = {k: v for k, v in group.items() if k not in GROUP_FIELDS}
+            self.conn.execute(
+                "UPDATE groups SET title = ?, join_date = ?, message_count = ?, last_active = ?, extra = ? WHERE chat_id = ?",
+                (group["title"], group["join_date"], group["message_count"], group["last_active"],
+                 json.dumps(extra, ensure_ascii=False), int(chat_id))
+            )
+            if "title" in info:
+                self.group_index.add(int(chat_id), group["title"])
+
+    def remove_group(self, chat_id: str) -> None:
+        """حذف مجموعة من قاعدة البيانات."""
+        with self.lock:
+            self.conn.execute("DELETE FROM groups WHERE chat_id = ?", (int(chat_id),))
+            self.group_index.remove(int(chat_id))
+
+    def search_groups(self, query: str) -> list:
+        """البحث عن مجموعات باسمها أو معرفها."""
+        with self.lock:
+            matches = [int(chat_id) for chat_id in self.group_index.search(query)]
+        return [self._group_dict(row) for row in self._groups_by_id(matches)]
+
+    def search_groups_page(self, query: str, page: int = 1,
+                           page_size: int = GROUP_SEARCH_PAGE_SIZE) -> Tuple[List[Dict], int]:
+        """صفحة من نتائج البحث عن المجموعات.
+
+        ترجع نتائج الصفحة المطلوبة مرتبة حسب التطابق، مع العدد الكلي للنتائج.
+        """
+        with self.lock:
+            matches = self.group_index.search(query)
+        start = (max(page, 1) - 1) * page_size
+        chat_ids = [int(chat_id) for chat_id in matches[start:start + page_size]]
+        return [self._group_summary(row) for row in self._groups_by_id(chat_ids)], len(matches)
+
+    def _groups_by_id(self, chat_ids: List[int]) -> List[sqlite3.Row]:
+        """Rows of the given groups, in the order of chat_ids."""
+        rows = {}
+        # Stay under SQLite's limit of bound parameters per statement
+        for start in range(0, len(chat_ids), 500):
+            batch = chat_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(batch))
+            for row in self._fetchall(f"SELECT {GROUP_COLUMNS} FROM groups WHERE chat_id IN ({placeholders})", batch):
+                rows[row["chat_id"]] = row
+        return [rows[chat_id] for chat_id in chat_ids if chat_id in rows]
+
+    def cleanup_inactive_groups(self) -> tuple:
+        """حذف المجموعات غير النشطة وإرجاع عدد المجموعات المحذوفة."""
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {GROUP_COLUMNS} FROM groups WHERE message_count = 0").fetchall()
+            self.conn.execute("DELETE FROM groups WHERE message_count = 0")
+            for row in rows:
+                self.group_index.remove(row["chat_id"])
+        return len(rows), [self._group_dict(row) for row in rows]
+
+
+def migrate_json_to_sqlite(json_file: str = DB_FILE, sqlite_file: str = DB_SQLITE_FILE) -> dict:
+    """Copy every user, group, ban, premium membership and statistic from the JSON database into SQLite."""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    db = SQLiteDatabase(sqlite_file)
+    now = datetime.now().isoformat()
+    with db.lock:
+        conn = db.conn
+        conn.execute("BEGIN")
+        try:
+            for user_id, user in data.get("users", {}).items():
+                daily = user.get("daily_image_count") or {}
+                daily_date = max(daily) if daily else None
+                extra = {k: v for k, v in user.items() if k not in USER_FIELDS}
+                conn.execute(
+                    f"INSERT OR REPLACE INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (int(user_id), user.get("username") or "", user.get("first_name") or "",
+                     user.get("join_date", now), user.get("message_count", 0), user.get("image_count", 0),
+                     daily_date, daily.get(daily_date, 0), user.get("last_active", now),
+                     json.dumps(extra, ensure_ascii=False))
+                )
+            for chat_id, group in data.get("groups", {}).items():
+                extra = {k: v for k, v in group.items() if k not in GROUP_FIELDS}
+                conn.execute(
+                    f"INSERT OR REPLACE INTO groups ({GROUP_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                    (int(chat_id), group.get("title") or "", group.get("join_date", now),
+                     group.get("message_count", 0), group.get("last_active", now),
+                     json.dumps(extra, ensure_ascii=False))
+                )
+            for table in ("banned_users", "premium_users"):
+                for user_id in data.get(table, []):
+                    conn.execute(
+                        f"INSERT OR IGNORE INTO {table} (user_id, added_at) VALUES (?, ?)",
+                        (int(user_id), now)
+                    )
+            statistics = data.get("statistics", {})
+            for name in ("total_messages", "total_images"):
+                conn.execute(
+                    "INSERT OR REPLACE INTO statistics (name, value) VALUES (?, ?)",
+                    (name, statistics.get(name, 0))
+                )
+            series = TimeSeriesCounters(dict(data.get("timeseries", {})))
+            series.import_legacy(statistics.get("daily_messages", {}))
+            for bucket, counts in series.buckets.items():
+                for metric, value in counts.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO counters (bucket, metric, value) VALUES (?, ?, ?)",
+                        (bucket, metric, value)
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    counts = {
+        "users": len(data.get("users", {})),
+        "groups": len(data.get("groups", {})),
+        "banned_users": len(data.get("banned_users", [])),
+        "premium_users": len(data.get("premium_users", [])),
+    }
+    db.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the JSON bot database into SQLite.")
+    parser.add_argument("--json", default=DB_FILE, help="source JSON database file")
+    parser.add_argument("--sqlite", default=DB_SQLITE_FILE, help="target SQLite database file")
+    args = parser.parse_args()
+
+    result = migrate_json_to_sqlite(args.json, args.sqlite)
+    print(f"Migrated {args.json} -> {args.sqlite}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
@@ -0,0 +1,642 @@
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from array import array
+from typing import Iterable, Optional, Tuple, Union
+
+from config import (
+    DB_STORAGE_MODE,
+    DB_JOURNAL_FILE,
+    DB_JOURNAL_COMPACT_BYTES,
+    DB_FLUSH_INTERVAL,
+    DB_FLUSH_MAX_MUTATIONS,
+    DB_SHARD_DIR,
+    DB_SHARD_COUNT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Tables stored on disk as a list of ids, every other table is a dict keyed by id
+LIST_TABLES = ("banned_users", "premium_users")
+
+
+def write_json_atomic(path: str, data: dict, indent: Optional[int] = 2) -> int:
+    """Write data to a temp file, fsync it and rename it over path. Returns bytes written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+def write_bytes_atomic(path: str, payload: bytes) -> int:
+    """Same as write_json_atomic for an already encoded payload."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(payload)
+
+
+def make_record(source, table: str, key=None) -> dict:
+    """Build a journal record holding the current on-disk value of one entry of source."""
+    if key is None:
+        return {"t": table, "v": source.export_entry(table)}
+    return {"t": table, "k": str(key), "v": source.export_entry(table, key)}
+
+
+def apply_record(data: dict, record: dict) -> None:
+    """Apply a journal record produced by make_record to data."""
+    table, value = record["t"], record.get("v")
+    if "k" not in record:
+        data[table] = value
+        return
+
+    key = record["k"]
+    if table in LIST_TABLES:
+        members = data.setdefault(table, [])
+        if value and key not in members:
+            members.append(key)
+        elif not value and key in members:
+            members.remove(key)
+    elif value is None:
+        data.setdefault(table, {}).pop(key, None)
+    else:
+        data.setdefault(table, {})[key] = value
+
+
+def replay_journal(data: dict, path: str) -> int:
+    """Apply every record of the journal at path to data. Returns the number of records."""
+    if not os.path.exists(path):
+        return 0
+    count = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # سطر غير مكتمل بسبب توقف مفاجئ أثناء الكتابة
+                logger.warning(f"Ignoring torn journal record at {path}:{line_number}")
+                break
+            apply_record(data, record)
+            count += 1
+    return count
+
+
+class JsonStore:
+    """Rewrite the whole database file on every change (the original behaviour).
+
+    Stores load() the on-disk dict once; save() receives the Database itself and
+    reads what it needs through to_dict() and export_entry().
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.stats = {"mode": "json", "mutations": 0, "writes": 0, "bytes_written": 0}
+
+    def load(self, default: dict, base: Optional[dict] = None) -> dict:
+        if base is not None:
+            return base
+        if os.path.exists(self.db_file):
+            with open(self.db_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return default
+
+    def save(self, source, changes: Iterable[Tuple]) -> None:
+        with open(self.db_file, 'w', encoding='utf-8') as f:
+            json.dump(source.to_dict(), f, ensure_ascii=False, indent=2)
+            self.stats["bytes_written"] += f.tell()
+        self.stats["mutations"] += 1
+        self.stats["writes"] += 1
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+    def close(self) -> None:
+        pass
+
+
+class JournalStore:
+    """Append each change to a journal and fold it into the snapshot in the background.
+
+    The snapshot is the regular database file. Once the journal grows past
+    compact_bytes it is renamed to a ".compacting" segment and a fresh journal is
+    started, then a worker thread replays that segment onto the snapshot on disk
+    and atomically replaces it. The worker never touches the live data, so the
+    bot keeps appending while compaction runs.
+    """
+
+    def __init__(self, snapshot_file: str, journal_file: str, compact_bytes: int):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.segment_file = f"{journal_file}.compacting"
+        self.compact_bytes = compact_bytes
+        self._journal = None
+        self._journal_size = 0
+        self._empty = "{}"
+        self._compaction: Optional[threading.Thread] = None
+        self.stats = {"mode": "journal", "mutations": 0, "writes": 0, "bytes_written": 0, "compactions": 0}
+
+    def load(self, default: dict, base: Optional[dict] = None) -> dict:
+        self._empty = json.dumps(default)
+        data = self._read_snapshot() if base is None else base
+
+        # Compaction interrupted by a restart: finish folding the old segment first
+        if os.path.exists(self.segment_file):
+            replay_journal(data, self.segment_file)
+            if base is None:
+                write_json_atomic(self.snapshot_file, data)
+                os.remove(self.segment_file)
+            else:
+                # base may not hold every user, fold the segment into the file on disk instead
+                self._compact_segment()
+
+        replayed = replay_journal(data, self.journal_file)
+        if replayed:
+            logger.info(f"Replayed {replayed} journal records from {self.journal_file}")
+
+        self._journal = open(self.journal_file, 'ab')
+        self._journal_size = self._journal.tell()
+        return data
+
+    def save(self, source, changes: Iterable[Tuple]) -> None:
+        changes = list(changes) or [(table,) for table in source.to_dict()]
+        payload = "".join(
+            json.dumps(make_record(source, *change), ensure_ascii=False) + "\n"
+            for change in changes
+        ).encode('utf-8')
+        self._journal.write(payload)
+        self._journal.flush()
+        self._journal_size += len(payload)
+        self.stats["mutations"] += 1
+        self.stats["writes"] += 1
+        self.stats["bytes_written"] += len(payload)
+
+        if self._journal_size >= self.compact_bytes:
+            self._start_compaction()
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, journal_bytes=self._journal_size)
+
+    def close(self) -> None:
+        if self._compaction is not None:
+            self._compaction.join()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _read_snapshot(self) -> dict:
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return json.loads(self._empty)
+
+    def _start_compaction(self) -> None:
+        if self._compaction is not None and self._compaction.is_alive():
+            return  # the previous segment is still being folded
+
+        # A failed compaction leaves its segment behind: retry it before rotating again
+        if not os.path.exists(self.segment_file):
+            self._journal.close()
+            os.replace(self.journal_file, self.segment_file)
+            self._journal = open(self.journal_file, 'ab')
+            self._journal_size = 0
+
+        self._compaction = threading.Thread(target=self._compact_segment, name="db-compaction", daemon=True)
+        self._compaction.start()
+
+    def _compact_segment(self) -> None:
+        try:
+            data = self._read_snapshot()
+            replayed = replay_journal(data, self.segment_file)
+            size = write_json_atomic(self.snapshot_file, data)
+            os.remove(self.segment_file)
+            self.stats["compactions"] += 1
+            logger.info(f"Compacted {replayed} journal records into {self.snapshot_file} ({size} bytes)")
+        except Exception as e:
+            # الجزء يبقى على القرص وسيتم دمجه عند التشغيل التالي
+            logger.error(f"Journal compaction failed: {str(e)}")
+
+
+class WriteBehindStore:
+    """Keep changes in memory and write coalesced snapshots from a background thread.
+
+    save() only counts the mutation. The flusher thread wakes up every
+    flush_interval seconds, or as soon as max_mutations changes are pending,
+    encodes the data while holding the database lock and writes it with
+    temp file + fsync + rename outside of it. Only that thread writes the file;
+    close() wakes it up for a final flush and waits for it.
+    """
+
+    def __init__(self, db_file: str, lock, flush_interval: float, max_mutations: int):
+        self.db_file = db_file
+        self.lock = lock
+        self.flush_interval = flush_interval
+        self.max_mutations = max_mutations
+        self._source = None
+        self._pending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {
+            "mode": "write_behind",
+            "mutations": 0,
+            "writes": 0,
+            "bytes_written": 0,
+            "coalesced_mutations": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def load(self, default: dict, base: Optional[dict] = None) -> dict:
+        data = default if base is None else base
+        if base is None and os.path.exists(self.db_file):
+            with open(self.db_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        self._thread = threading.Thread(target=self._run, name="db-flusher", daemon=True)
+        self._thread.start()
+        return data
+
+    def save(self, source, changes: Iterable[Tuple]) -> None:
+        with self._cond:
+            self._source = source
+            self._pending += 1
+            self.stats["mutations"] += 1
+            if self._pending >= self.max_mutations:
+                self._cond.notify()
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["pending_mutations"] = self._pending
+        if stats["writes"]:
+            stats["avg_flush_ms"] = stats["total_flush_ms"] / stats["writes"]
+        return stats
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and self._pending < self.max_mutations:
+                    self._cond.wait(self.flush_interval)
+                pending, self._pending = self._pending, 0
+                closed = self._closed
+            if pending:
+                self._flush(pending)
+            if closed:
+                return
+
+    def _flush(self, pending: int) -> None:
+        started = time.perf_counter()
+        try:
+            with self.lock:
+                payload = json.dumps(self._source.to_dict(), ensure_ascii=False, separators=(',', ':'))
+            size = write_bytes_atomic(self.db_file, payload.encode('utf-8'))
+        except Exception as e:
+            # إعادة التعديلات إلى قائمة الانتظار لمحاولة الكتابة في الدورة التالية
+            logger.error(f"Database flush failed: {str(e)}")
+            with self._cond:
+                self._pending += pending
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["writes"] += 1
+        self.stats["bytes_written"] += size
+        self.stats["coalesced_mutations"] += pending - 1
+        self.stats["last_flush_ms"] = elapsed_ms
+        self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+        self.stats["total_flush_ms"] += elapsed_ms
+
+
+class ShardedStore:
+    """Split users over shard files and keep every other table in its own file.
+
+    Layout of shard_dir:
+        manifest.json      shard count, user count per shard, list of tables
+        users-0000.json    users whose id % shard count == 0
+        ...
+        <table>.json       one file per other table (groups, statistics, ...)
+
+    Users are loaded one shard at a time by database.UserTable and save() only
+    rewrites the shards and tables named in the changes.
+    """
+
+    def __init__(self, shard_dir: str, shard_count: int, legacy_file: str):
+        self.shard_dir = shard_dir
+        self.shard_count = shard_count
+        self.legacy_file = legacy_file
+        self.manifest = {}
+        self.stats = {"mode": "sharded", "mutations": 0, "writes": 0, "bytes_written": 0, "shards_loaded": 0}
+
+    def load(self, default: dict, base: Optional[dict] = None) -> dict:
+        manifest_file = os.path.join(self.shard_dir, "manifest.json")
+        if not os.path.exists(manifest_file):
+            source = self.legacy_file if os.path.exists(self.legacy_file) else default
+            logger.info(f"Creating sharded database in {self.shard_dir} ({self.shard_count} shards)")
+            write_sharded(self.shard_dir, read_database(source), self.shard_count)
+
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.shard_count = self.manifest["shards"]
+
+        data = {}
+        for table in self.manifest["tables"]:
+            with open(self._table_file(table), 'r', encoding='utf-8') as f:
+                data[table] = json.load(f)
+        return data
+
+    def shard_size(self, index: int) -> int:
+        return self.manifest["user_counts"][index]
+
+    def load_shard(self, index: int) -> dict:
+        path = self._shard_file(index)
+        self.stats["shards_loaded"] += 1
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, source, changes: Iterable[Tuple]) -> None:
+        changes = list(changes) or [("users",)] + [(table,) for table in source.to_dict(include_users=False)]
+        shards, tables = set(), set()
+        for change in changes:
+            if change[0] != "users":
+                tables.add(change[0])
+            elif len(change) > 1:
+                shards.add(int(change[1]) % self.shard_count)
+            else:
+                shards.update(range(self.shard_count))
+
+        manifest_changed = False
+        for index in sorted(shards):
+            users = source.export_shard(index)
+            self._write(self._shard_file(index), users)
+            if len(users) != self.manifest["user_counts"][index]:
+                self.manifest["user_counts"][index] = len(users)
+                manifest_changed = True
+        for table in sorted(tables):
+            self._write(self._table_file(table), source.export_entry(table))
+            if table not in self.manifest["tables"]:
+                self.manifest["tables"].append(table)
+                manifest_changed = True
+        if manifest_changed:
+            self._write(os.path.join(self.shard_dir, "manifest.json"), self.manifest)
+        self.stats["mutations"] += 1
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, shards=self.shard_count)
+
+    def close(self) -> None:
+        pass
+
+    def _write(self, path: str, value) -> None:
+        self.stats["bytes_written"] += write_json_atomic(path, value, indent=None)
+        self.stats["writes"] += 1
+
+    def _shard_file(self, index: int) -> str:
+        return os.path.join(self.shard_dir, f"users-{index:04d}.json")
+
+    def _table_file(self, table: str) -> str:
+        return os.path.join(self.shard_dir, f"{table}.json")
+
+
+def read_database(source) -> dict:
+    """Read a whole database from a JSON file or a sharded directory (a dict is returned as is)."""
+    if isinstance(source, dict):
+        return json.loads(json.dumps(source))
+    if not os.path.isdir(source):
+        with open(source, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    with open(os.path.join(source, "manifest.json"), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    data = {"users": {}}
+    for index in range(manifest["shards"]):
+        path = os.path.join(source, f"users-{index:04d}.json")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                data["users"].update(json.load(f))
+    for table in manifest["tables"]:
+        with open(os.path.join(source, f"{table}.json"), 'r', encoding='utf-8') as f:
+            data[table] = json.load(f)
+    return data
+
+
+def write_sharded(shard_dir: str, data: dict, shard_count: int) -> None:
+    """Write data as a sharded directory, replacing shard_dir only once it is complete."""
+    staging_dir = f"{shard_dir}.staging"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+
+    shards = [{} for _ in range(shard_count)]
+    for user_id, user in data.get("users", {}).items():
+        shards[int(user_id) % shard_count][user_id] = user
+    for index, users in enumerate(shards):
+        if users:
+            write_json_atomic(os.path.join(staging_dir, f"users-{index:04d}.json"), users, indent=None)
+
+    tables = [table for table in data if table != "users"]
+    for table in tables:
+        write_json_atomic(os.path.join(staging_dir, f"{table}.json"), data[table], indent=None)
+    write_json_atomic(os.path.join(staging_dir, "manifest.json"), {
+        "version": 1,
+        "shards": shard_count,
+        "user_counts": [len(users) for users in shards],
+        "tables": tables,
+    })
+
+    old_dir = f"{shard_dir}.old"
+    if os.path.exists(shard_dir):
+        os.replace(shard_dir, old_dir)
+    os.replace(staging_dir, shard_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def reshard(source: str, shard_dir: str, shard_count: int) -> dict:
+    """Split a JSON database file, or re-split a sharded directory, into shard_count shards."""
+    data = read_database(source)
+    write_sharded(shard_dir, data, shard_count)
+    return {"users": len(data.get("users", {})), "shards": shard_count}
+
+
+# Binary snapshot: header, JSON of every table but users, then three int64 columns
+# (sorted user ids, record index of each sorted id, record offsets) and the records
+SNAPSHOT_MAGIC = b"BOTSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")  # magic, meta bytes, user count, records bytes
+# user_id, join_ts, last_active_ts, message_count, image_count, image_day, image_day_count,
+# then the byte lengths of username, first_name and extra (JSON) which follow the fixed part
+USER_STRUCT = struct.Struct("<qddqqiiHHI")
+_NONE_STR = 0xFFFF  # length marker of a None username/first_name
+
+UserFields = Tuple  # (user_id, username, first_name, join_ts, last_active_ts, message_count,
+                    #  image_count, image_day, image_day_count, extra)
+
+
+def _pad8(size: int) -> int:
+    return -size % 8
+
+
+def _encode_str(value: Optional[str]) -> Tuple[int, bytes]:
+    if value is None:
+        return _NONE_STR, b""
+    encoded = value.encode('utf-8')[:_NONE_STR - 1]
+    return len(encoded), encoded
+
+
+def _decode_str(buffer, start: int, length: int) -> Tuple[Optional[str], int]:
+    if length == _NONE_STR:
+        return None, start
+    return str(buffer[start:start + length], 'utf-8'), start + length
+
+
+def encode_user(fields: UserFields) -> bytes:
+    user_id, username, first_name, join_ts, last_active_ts, messages, images, day, day_count, extra = fields
+    name_len, name = _encode_str(username)
+    first_len, first = _encode_str(first_name)
+    extra_bytes = json.dumps(extra, ensure_ascii=False).encode('utf-8') if extra else b""
+    return USER_STRUCT.pack(user_id, join_ts, last_active_ts, messages, images, day, day_count,
+                            name_len, first_len, len(extra_bytes)) + name + first + extra_bytes
+
+
+class Snapshot:
+    """Memory-mapped binary snapshot of the database.
+
+    Opening it only parses the small tables (self.data); users stay encoded in the
+    mapped file and are decoded one at a time, found by binary search over the
+    sorted id column.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        magic, meta_len, count, records_len = SNAPSHOT_HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a database snapshot")
+
+        offset = SNAPSHOT_HEADER.size
+        self.data = json.loads(self._map[offset:offset + meta_len])
+        offset += meta_len + _pad8(meta_len)
+        self.count = count
+        self._view = memoryview(self._map)
+        self.ids = self._view[offset:offset + 8 * count].cast('q')
+        offset += 8 * count
+        self.positions = self._view[offset:offset + 8 * count].cast('q')
+        offset += 8 * count
+        self.offsets = self._view[offset:offset + 8 * (count + 1)].cast('q')
+        self._records = offset + 8 * (count + 1)
+        if self._records + records_len > len(self._map):
+            self.close()
+            raise ValueError(f"{path} is truncated")
+
+    def find(self, user_id: int) -> int:
+        """Record index of user_id, or -1."""
+        index = bisect.bisect_left(self.ids, user_id)
+        if index < self.count and self.ids[index] == user_id:
+            return self.positions[index]
+        return -1
+
+    def user_id_at(self, position: int) -> int:
+        return struct.unpack_from("<q", self._map, self._records + self.offsets[position])[0]
+
+    def raw(self, position: int) -> bytes:
+        return self._map[self._records + self.offsets[position]:self._records + self.offsets[position + 1]]
+
+    def fields(self, position: int) -> UserFields:
+        start = self._records + self.offsets[position]
+        (user_id, join_ts, last_active_ts, messages, images, day, day_count,
+         name_len, first_len, extra_len) = USER_STRUCT.unpack_from(self._map, start)
+        start += USER_STRUCT.size
+        username, start = _decode_str(self._map, start, name_len)
+        first_name, start = _decode_str(self._map, start, first_len)
+        extra = json.loads(self._map[start:start + extra_len]) if extra_len else None
+        return user_id, username, first_name, join_ts, last_active_ts, messages, images, day, day_count, extra
+
+    def close(self) -> None:
+        for name in ("ids", "positions", "offsets", "_view"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._map.close()
+        self._file.close()
+
+
+def write_snapshot(path: str, data: dict, users: Iterable[Union[bytes, UserFields]]) -> int:
+    """Write a binary snapshot of data (without users) and the users in iteration order.
+
+    Each user is either its fields or a record already encoded by encode_user
+    (copied as is from a previous snapshot). Returns the file size.
+    """
+    records, offsets, ids = [], array('q', [0]), array('q')
+    size = 0
+    for user in users:
+        record = user if isinstance(user, (bytes, bytearray)) else encode_user(user)
+        ids.append(struct.unpack_from("<q", record)[0])
+        records.append(record)
+        size += len(record)
+        offsets.append(size)
+
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    meta = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    payload = b"".join([
+        SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(meta), len(ids), size),
+        meta,
+        b"\0" * _pad8(len(meta)),
+        array('q', (ids[i] for i in order)).tobytes(),
+        array('q', order).tobytes(),
+        offsets.tobytes(),
+        *records,
+    ])
+    return write_bytes_atomic(path, payload)
+
+
+def create_store(db_file: str, lock):
+    """Create the storage engine selected by DB_STORAGE_MODE in config.py."""
+    if DB_STORAGE_MODE == "json":
+        return JsonStore(db_file)
+    if DB_STORAGE_MODE == "journal":
+        return JournalStore(db_file, DB_JOURNAL_FILE, DB_JOURNAL_COMPACT_BYTES)
+    if DB_STORAGE_MODE == "write_behind":
+        return WriteBehindStore(db_file, lock, DB_FLUSH_INTERVAL, DB_FLUSH_MAX_MUTATIONS)
+    if DB_STORAGE_MODE == "sharded":
+        return ShardedStore(DB_SHARD_DIR, DB_SHARD_COUNT, db_file)
+    raise ValueError(f"Unknown DB_STORAGE_MODE: {DB_STORAGE_MODE}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline tools for the bot database files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reshard_parser = subparsers.add_parser("reshard", help="split a JSON database or re-split a sharded one")
+    reshard_parser.add_argument("source", help="JSON database file or sharded directory")
+    reshard_parser.add_argument("--out", default=DB_SHARD_DIR, help="target sharded directory")
+    reshard_parser.add_argument("--shards", type=int, default=DB_SHARD_COUNT, help="number of user shards")
+    args = parser.parse_args()
+
+    result = reshard(args.source, args.out, args.shards)
+    print(f"Resharded {args.source} -> {args.out}: {result['users']} users in {result['shards']} shards")
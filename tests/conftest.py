@@ -0,0 +1,33 @@
+import pytest
+
+import database
+import storage
+
+
+@pytest.fixture
+def make_database(tmp_path, monkeypatch):
+    """Factory of json-backend Databases whose files all live in tmp_path.
+
+    make_database(mode) opens (or reopens) the database in that storage mode;
+    keyword arguments override other settings of database.py / storage.py,
+    e.g. DB_JOURNAL_COMPACT_BYTES=1.
+    """
+    opened = []
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "bot_database.json"))
+    monkeypatch.setattr(database, "DB_BINARY_SNAPSHOT", False)
+    monkeypatch.setattr(database, "DB_SNAPSHOT_FILE", str(tmp_path / "bot_database.snapshot"))
+    monkeypatch.setattr(storage, "DB_JOURNAL_FILE", str(tmp_path / "bot_database.journal"))
+    monkeypatch.setattr(storage, "DB_SHARD_DIR", str(tmp_path / "shards"))
+    monkeypatch.setattr(storage, "DB_SHARD_COUNT", 4)
+
+    def make(mode: str = "json", **settings) -> database.Database:
+        monkeypatch.setattr(storage, "DB_STORAGE_MODE", mode)
+        for name, value in settings.items():
+            monkeypatch.setattr(storage if hasattr(storage, name) else database, name, value)
+        db = database.Database()
+        opened.append(db)
+        return db
+
+    yield make
+    for db in opened:
+        db.store.close()
@@ -0,0 +1,55 @@
+from conversation import SUMMARY_PREFIX, ConversationWindow
+from tokens import IMAGE_TOKENS, estimate_content_tokens, estimate_tokens
+
+
+def turn(role, text):
+    return {"role": role, "parts": [{"text": text}]}
+
+
+def test_estimate_tokens_by_kind_of_text():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hello") == 2  # 5 letters / 4
+    assert estimate_tokens("مرحبا") == 2  # 5 letters / 2.5
+    assert estimate_tokens("1234567") == 3  # 7 digits / 3
+    assert estimate_tokens("hi you") == 2  # a single space is free
+    assert estimate_tokens("a\n\n\n\nb") == 3  # other whitespace costs 1 per 4
+    assert estimate_tokens("a += b;") == 5  # "+=" counts 2, ";" 1
+    assert estimate_tokens("😀😀") == 2
+
+
+def test_images_count_as_fixed_tokens():
+    content = {"parts": [{"text": "hello"}, {"inline_data": {"mime_type": "image/jpeg", "data": ""}}]}
+    assert estimate_content_tokens(content) == 2 + IMAGE_TOKENS
+
+
+def test_window_keeps_the_newest_turns_that_fit():
+    history = [turn("user", "one two"), turn("assistant", "three four"),
+               turn("user", "five six"), turn("assistant", "seven eight"),
+               turn("user", "nine ten")]
+    tokens = [estimate_content_tokens(t) for t in history]
+    window = ConversationWindow(sum(tokens[-3:])).build(history)
+    assert [t["parts"][0]["text"] for t in window] == ["five six", "seven eight", "nine ten"]
+    assert [t["role"] for t in window] == ["user", "model", "user"]
+
+
+def test_window_starts_with_a_user_turn():
+    history = [turn("user", "question"), turn("assistant", "a long answer here"), turn("user", "next")]
+    budget = estimate_content_tokens(history[1]) + estimate_content_tokens(history[2])
+    window = ConversationWindow(budget).build(history)
+    assert window == [turn("user", "next")]
+
+
+def test_newest_turn_is_sent_even_over_budget():
+    history = [turn("user", "word " * 100)]
+    window = ConversationWindow(1).build(history)
+    assert window == history
+
+
+def test_summary_goes_in_front_of_the_first_turn():
+    history = [turn("user", "old"), turn("assistant", "reply"), turn("user", "new")]
+    window_builder = ConversationWindow(1000)
+    window = window_builder.build(history, summary="earlier talk")
+    assert window[0]["parts"][0] == {"text": SUMMARY_PREFIX + "earlier talk"}
+    assert window[0]["parts"][1] == {"text": "old"}
+    assert history[0]["parts"] == [{"text": "old"}]
+    assert window_builder.get_stats()["summarized"] == 1
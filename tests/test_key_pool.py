@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import pytest
+
+from key_pool import KeyPool, KeyPoolExhausted, TokenBucket
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(None)
+    bucket.take(10 ** 9)
+    assert bucket.wait_time(10 ** 9, time.monotonic()) == 0
+    assert bucket.utilization() == 0
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(60)  # one per second
+    bucket.take(60)
+    now = time.monotonic()
+    assert bucket.wait_time(1, now) == pytest.approx(1, abs=0.05)
+    assert bucket.utilization() == pytest.approx(1, abs=0.05)
+    # More than the capacity only waits for a full bucket
+    assert bucket.wait_time(1000, now) == pytest.approx(60, abs=0.5)
+
+
+def test_calls_go_to_the_least_loaded_key():
+    async def main():
+        pool = KeyPool(["key-aaaa", "key-bbbb"], rpm=10)
+        first = await pool.acquire(0)
+        second = await pool.acquire(0)
+        assert first is not second
+
+    asyncio.run(main())
+
+
+def test_rate_limited_key_is_skipped():
+    async def main():
+        pool = KeyPool(["key-aaaa", "key-bbbb"], cooldown=60)
+        pool.rate_limited(pool.keys[0])
+        for _ in range(3):
+            assert await pool.acquire(0) is pool.keys[1]
+        assert pool.try_acquire(0, avoid=pool.keys[1]) is pool.keys[1]
+        pool.rate_limited(pool.keys[1], retry_after=60)
+        assert pool.try_acquire(0) is None
+        assert not pool.has_available()
+
+    asyncio.run(main())
+
+
+def test_acquire_gives_up_after_max_wait():
+    async def main():
+        pool = KeyPool(["key-aaaa"], rpm=1, max_wait=0.1)
+        await pool.acquire(0)
+        with pytest.raises(KeyPoolExhausted):
+            await pool.acquire(0)
+
+    asyncio.run(main())
+
+
+def test_settle_corrects_the_token_reservation():
+    async def main():
+        pool = KeyPool(["key-aaaa"], tpm=1000)
+        key = await pool.acquire(600)
+        assert key.tokens.level == pytest.approx(400, abs=1)
+        pool.settle(key, reserved=600, used=100)
+        assert key.tokens.level == pytest.approx(900, abs=1)
+        assert key.stats["tokens"] == 100
+
+    asyncio.run(main())
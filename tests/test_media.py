@@ -0,0 +1,83 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+
+import pytest
+
+from gemini_client import encode_body
+from media import Base64Writer, InlineImage, MediaBudget, MediaBusyError
+
+
+@pytest.mark.parametrize("pieces", [[1], [2, 5], [3, 3, 3], [7, 1, 1, 4, 10], [1000, 1, 999]])
+def test_base64_writer_matches_b64encode(pieces):
+    data = os.urandom(sum(pieces))
+    writer = Base64Writer()
+    offset = 0
+    for size in pieces:
+        writer.write(data[offset:offset + size])
+        offset += size
+    image = writer.finish()
+
+    assert b"".join(image.chunks) == base64.b64encode(data)
+    assert image.size == len(data)
+    assert image.digest == hashlib.sha256(data).hexdigest()
+    assert image.decode() == data
+
+
+def test_encode_body_matches_json_dumps():
+    data = os.urandom(1001)
+    writer = Base64Writer()
+    writer.write(data[:500])
+    writer.write(data[500:])
+
+    def payload(jpeg, png):
+        return {"contents": [{"role": "user", "parts": [
+            {"text": "ما هذا؟ \"quoted\""},
+            {"inline_data": {"mime_type": "image/jpeg", "data": jpeg}},
+            {"inline_data": {"mime_type": "image/png", "data": png}},
+        ]}]}
+
+    chunks = encode_body(payload(writer.finish(), InlineImage.from_bytes(b"png")))
+
+    expected = payload(base64.b64encode(data).decode(), base64.b64encode(b"png").decode())
+    assert b"".join(chunks) == json.dumps(expected, ensure_ascii=False).encode("utf-8")
+
+
+def test_encode_body_without_images_is_one_chunk():
+    payload = {"contents": [{"parts": [{"text": "hi"}]}]}
+    assert encode_body(payload) == [json.dumps(payload, ensure_ascii=False).encode("utf-8")]
+
+
+def test_media_budget_waits_for_room():
+    async def main():
+        budget = MediaBudget(max_bytes=100, max_wait=1)
+        order = []
+
+        async def photo(name, size, seconds):
+            async with budget.hold(size):
+                order.append(name)
+                await asyncio.sleep(seconds)
+
+        await asyncio.gather(photo("a", 80, 0.05), photo("b", 50, 0), photo("c", 500, 0))
+        assert order == ["a", "b", "c"]
+        assert budget.in_flight == 0
+        stats = budget.get_stats()
+        assert stats["waited"] == 2 and stats["rejected"] == 0
+        assert stats["max_in_flight"] <= 100
+
+    asyncio.run(main())
+
+
+def test_media_budget_rejects_after_max_wait():
+    async def main():
+        budget = MediaBudget(max_bytes=100, max_wait=0.05)
+        async with budget.hold(100):
+            with pytest.raises(MediaBusyError):
+                async with budget.hold(1):
+                    pass
+        assert budget.in_flight == 0
+        assert budget.get_stats()["rejected"] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from gemini_client import GeminiAPIError, GeminiBusyError, GeminiClient
+from key_pool import KeyPool
+from resilience import CircuitBreaker, RetryPolicy, parse_retry_after
+
+PAYLOAD = {"contents": [{"role": "user", "parts": [{"text": "hi"}]}]}
+OK = {"candidates": [{"content": {"parts": [{"text": "ok"}]}}]}
+
+
+def open_breaker(open_seconds=0.05):
+    breaker = CircuitBreaker(window=60, min_requests=2, failure_rate=0.5, open_seconds=open_seconds)
+    breaker.record(False)
+    breaker.record(False)
+    return breaker
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    breaker = open_breaker()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # only one trial at a time
+
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_released_trial_is_replaced_right_away():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_breaker_needs_min_requests():
+    breaker = CircuitBreaker(window=60, min_requests=3, failure_rate=0.5, open_seconds=1)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_retry_policy_bounds():
+    policy = RetryPolicy(attempts=3, base_delay=0.5, max_delay=2, budget=10)
+    for attempt in range(1, 10):
+        assert 0 <= policy.delay(attempt) <= 2
+    assert policy.delay(1, retry_after=5) >= 5
+    assert policy.should_retry(1, 0, 1)
+    assert not policy.should_retry(3, 0, 1)
+    assert not policy.should_retry(1, 9.5, 1)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7
+    assert parse_retry_after(None, '{"retryDelay": "27s"}') == 27
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after(None) is None
+
+
+def make_client(responses, breaker=None):
+    """GeminiClient answering each attempt with the next (status, json) of responses."""
+    answers = iter(responses)
+
+    def handler(request):
+        status, body = next(answers)
+        return httpx.Response(status, json=body)
+
+    client = GeminiClient(keys=KeyPool(["key-1234"]), retry=RetryPolicy(3, 0.001, 0.01, 5), breaker=breaker)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_transient_errors_are_retried():
+    client = make_client([(503, {}), (500, {}), (200, OK)])
+    result = asyncio.run(client.generate(PAYLOAD))
+    assert result.text == "ok"
+    assert client.stats["retries"] == 2
+    assert client.stats["attempts"] == 3
+    assert client.stats["succeeded_after_retry"] == 1
+
+
+def test_client_errors_are_not_retried_and_do_not_close_the_breaker():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    client = make_client([(400, {"error": "bad"}), (200, OK)], breaker)
+
+    with pytest.raises(GeminiAPIError):
+        asyncio.run(client.generate(PAYLOAD))
+    assert client.stats["attempts"] == 1
+    assert breaker.state == "half_open"
+
+    assert asyncio.run(client.generate(PAYLOAD)).text == "ok"
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_short_circuits():
+    client = make_client([], open_breaker(open_seconds=60))
+    with pytest.raises(GeminiBusyError):
+        asyncio.run(client.generate(PAYLOAD))
+    assert client.stats["short_circuited"] == 1
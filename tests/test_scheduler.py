@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from scheduler import QueueTimeout, RequestScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def serve(scheduler, requests):
+    """Queue requests (priority, user) behind one held slot and return the order they get a slot."""
+    order = []
+    await scheduler.acquire(requests[0][0])
+
+    async def request(priority, user):
+        async with scheduler.slot(priority, user):
+            order.append((priority, user))
+
+    tasks = [asyncio.ensure_future(request(priority, user)) for priority, user in requests]
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_users_of_a_class_take_turns():
+    scheduler = RequestScheduler(1, {"private": 1}, {"private": 5})
+    requests = [("private", "flood")] * 3 + [("private", "a"), ("private", "b")]
+    order = run(serve(scheduler, requests))
+    assert [user for _, user in order] == ["flood", "a", "b", "flood", "flood"]
+
+
+def test_classes_share_slots_by_weight():
+    scheduler = RequestScheduler(1, {"premium": 3, "group": 1}, {"premium": 5, "group": 5})
+    requests = [("group", f"g{i}") for i in range(4)] + [("premium", f"p{i}") for i in range(6)]
+    order = run(serve(scheduler, requests))
+    first = [priority for priority, _ in order[:8]]
+    assert first.count("premium") == 6
+    assert first.count("group") == 2
+
+
+def test_request_gives_up_after_max_wait():
+    async def main():
+        scheduler = RequestScheduler(1, {"group": 1}, {"group": 0.05})
+        await scheduler.acquire("group")
+        with pytest.raises(QueueTimeout):
+            await scheduler.acquire("group", "late")
+        stats = scheduler.get_stats()["classes"]["group"]
+        assert stats["expired"] == 1
+        assert stats["depth"] == 0
+        scheduler.release()
+        assert scheduler.get_stats()["running"] == 0
+
+    run(main())
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def main():
+        scheduler = RequestScheduler(1, {"private": 1}, {"private": 5})
+        await scheduler.acquire("private")
+        waiter = asyncio.ensure_future(scheduler.acquire("private", "u"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release()
+        assert scheduler.get_stats()["running"] == 0
+        await asyncio.wait_for(scheduler.acquire("private"), 1)
+
+    run(main())
@@ -0,0 +1,64 @@
+from search_index import GroupSearchIndex, normalize_text
+
+
+def make_index():
+    index = GroupSearchIndex()
+    index.add(-1001, "Cyber Security Arabia")
+    index.add(-1002, "Cyber")
+    index.add(-1003, "Cybersecurity News")
+    index.add(-1004, "Python Devs")
+    index.add(-1005, "مجموعة الأمن السيبراني")
+    return index
+
+
+def test_whole_word_beats_prefix_beats_substring():
+    index = make_index()
+    assert index.search("cyber") == ["-1002", "-1001", "-1003"]
+    assert index.search("security") == ["-1001", "-1003"]
+
+
+def test_every_term_must_match():
+    index = make_index()
+    assert index.search("cyber arabia") == ["-1001"]
+    assert index.search("cyber python") == []
+
+
+def test_arabic_is_matched_without_hamza_or_diacritics():
+    index = make_index()
+    assert normalize_text("الأمن") == "الامن"
+    assert index.search("الامن") == ["-1005"]
+    assert index.search("السَّيبراني") == ["-1005"]
+
+
+def test_short_terms_match_anywhere_in_a_word():
+    index = make_index()
+    assert index.search("py") == ["-1004"]
+    assert index.search("ws") == ["-1003"]
+
+
+def test_chat_id_is_searchable():
+    index = make_index()
+    assert index.search("-1004")[0] == "-1004"
+
+
+def test_titles_are_reindexed_and_removed():
+    index = make_index()
+    index.add(-1004, "Go Devs")
+    assert index.search("python") == []
+    assert index.search("go") == ["-1004"]
+    index.remove(-1004)
+    assert index.search("devs") == []
+    assert len(index) == 4
+
+
+def test_database_search_groups_and_pages(make_database):
+    db = make_database("json")
+    for chat_id in range(1, 26):
+        db.add_group(-chat_id, f"Group {chat_id}")
+
+    assert len(db.search_groups("group")) == 25
+    # "7" is also a substring of "17"; the whole word ranks first
+    assert db.search_groups("group 7") == [db.data["groups"]["-7"], db.data["groups"]["-17"]]
+    results, total = db.search_groups_page("group", page=3, page_size=10)
+    assert total == 25
+    assert len(results) == 5
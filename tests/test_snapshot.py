@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+from database import UserRecord
+from storage import Snapshot, encode_user, write_snapshot
+
+
+def user_fields(user_id, **changes):
+    fields = dict(username=f"user{user_id}", first_name="أحمد", join_ts=1700000000.5, last_active_ts=1700003600.25,
+                  message_count=user_id * 3, image_count=1, image_day=738000, image_day_count=2, extra=None)
+    fields.update(changes)
+    return UserRecord(**fields).fields(user_id)
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "db.snapshot")
+    users = [user_fields(30), user_fields(-5, username=None), user_fields(12, extra={"language": "ar"})]
+    data = {"groups": {"-100": {"title": "Cyber"}}, "statistics": {"total_messages": 7}}
+    write_snapshot(path, data, users)
+
+    snapshot = Snapshot(path)
+    try:
+        assert snapshot.data == data
+        assert snapshot.count == 3
+        for position, fields in enumerate(users):
+            assert snapshot.find(fields[0]) == position
+            assert snapshot.user_id_at(position) == fields[0]
+            assert snapshot.fields(position) == fields
+        assert snapshot.find(999) == -1
+    finally:
+        snapshot.close()
+
+
+def test_encoded_records_are_copied_as_is(tmp_path):
+    first, second = str(tmp_path / "a.snapshot"), str(tmp_path / "b.snapshot")
+    write_snapshot(first, {}, [user_fields(1), user_fields(2)])
+    snapshot = Snapshot(first)
+    try:
+        assert snapshot.raw(0) == encode_user(user_fields(1))
+        write_snapshot(second, {}, [snapshot.raw(0), user_fields(2, message_count=99)])
+    finally:
+        snapshot.close()
+
+    snapshot = Snapshot(second)
+    try:
+        assert snapshot.fields(snapshot.find(1)) == user_fields(1)
+        assert snapshot.fields(snapshot.find(2))[5] == 99
+    finally:
+        snapshot.close()
+
+
+def test_not_a_snapshot_is_rejected(tmp_path):
+    path = tmp_path / "db.snapshot"
+    path.write_bytes(b"NOTASNAP" + bytes(64))
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+
+
+def test_database_starts_from_the_snapshot(make_database, tmp_path):
+    db = make_database("json", DB_BINARY_SNAPSHOT=True)
+    db.add_user(1, "alice", "Alice")
+    db.add_user(2, "bob", "Bob")
+    db.update_user_activity(2)
+    db.add_group(-100, "Cyber")
+    db.close()
+    assert (tmp_path / "bot_database.snapshot").exists()
+
+    db = make_database("json", DB_BINARY_SNAPSHOT=True)
+    assert db.snapshot is not None
+    assert db.get_total_users() == 2
+    assert db.get_user_stats(2)["message_count"] == 1
+    assert db.data["groups"]["-100"]["title"] == "Cyber"
+
+    db.add_user(3, "carol", "Carol")
+    db.update_user_activity(1)
+    db.close()
+
+    db = make_database("json", DB_BINARY_SNAPSHOT=True)
+    assert sorted(db.get_all_user_ids()) == ["1", "2", "3"]
+    assert db.get_user_stats(1)["message_count"] == 1
+
+
+def test_older_snapshot_is_ignored(make_database, tmp_path):
+    db = make_database("json", DB_BINARY_SNAPSHOT=True)
+    db.add_user(1, "alice", "Alice")
+    db.close()
+
+    # The JSON file was written after the snapshot (e.g. by a run with snapshots off)
+    db = make_database("json")
+    db.add_user(2, "bob", "Bob")
+    db.close()
+    future = time.time() + 10
+    os.utime(tmp_path / "bot_database.json", (future, future))
+
+    db = make_database("json", DB_BINARY_SNAPSHOT=True)
+    assert db.snapshot is None
+    assert db.get_total_users() == 2
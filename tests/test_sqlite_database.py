@@ -0,0 +1,97 @@
+import json
+import sqlite3
+
+import pytest
+
+from sqlite_database import SQLiteDatabase, migrate_json_to_sqlite
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "bot.sqlite3"))
+    yield db
+    db.close()
+
+
+def test_users_bans_and_premium(sqlite_db):
+    sqlite_db.add_user(1, "alice", "Alice")
+    sqlite_db.add_user(1, "alice", "Alice")
+    sqlite_db.update_user_activity(1)
+    sqlite_db.update_user_activity(1, "photo")
+    assert sqlite_db.get_total_users() == 1
+    assert sqlite_db.get_user_stats(1)["message_count"] == 1
+    assert sqlite_db.get_daily_image_count(1) == 1
+    assert sqlite_db.get_total_stats()["total_images"] == 1
+
+    sqlite_db.ban_user(1)
+    assert sqlite_db.is_user_banned(1)
+    sqlite_db.unban_user(1)
+    assert sqlite_db.get_banned_users() == []
+    assert sqlite_db.add_premium_user(1) and not sqlite_db.add_premium_user(1)
+    assert sqlite_db.get_premium_users() == ["1"]
+
+
+def test_record_event_is_counted_before_and_after_close(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / "bot.sqlite3"))
+    db.record_event("group_messages", 2)
+    assert db.get_daily_stats()["group_messages"] == 2
+    db.close()
+
+    db = SQLiteDatabase(str(tmp_path / "bot.sqlite3"))
+    assert db.get_daily_stats()["group_messages"] == 2
+    db.close()
+
+
+def test_migration_keeps_every_field(tmp_path):
+    source = {
+        "users": {
+            "5": {
+                "username": "alice", "first_name": "Alice", "join_date": "2024-01-01T10:00:00",
+                "message_count": 3, "image_count": 1, "daily_image_count": {"2024-01-02": 1},
+                "last_active": "2024-01-02T10:00:00", "language": "ar", "notes": {"level": 2},
+            },
+        },
+        "groups": {
+            "-100": {"title": "Cyber", "join_date": "2024-01-01T10:00:00", "message_count": 4,
+                     "last_active": "2024-01-02T10:00:00", "members": 12},
+        },
+        "banned_users": ["7"],
+        "premium_users": ["5"],
+        "statistics": {"total_messages": 3, "total_images": 1, "daily_messages": {}},
+    }
+    json_file = tmp_path / "bot_database.json"
+    json_file.write_text(json.dumps(source), encoding="utf-8")
+
+    counts = migrate_json_to_sqlite(str(json_file), str(tmp_path / "bot.sqlite3"))
+    assert counts == {"users": 1, "groups": 1, "banned_users": 1, "premium_users": 1}
+
+    db = SQLiteDatabase(str(tmp_path / "bot.sqlite3"))
+    try:
+        assert db.get_user_stats(5) == source["users"]["5"]
+        assert db.search_groups("cyber") == [source["groups"]["-100"]]
+        assert db.get_banned_users() == ["7"]
+        assert db.get_premium_users() == ["5"]
+        assert db.get_total_stats()["total_messages"] == 3
+    finally:
+        db.close()
+
+
+def test_users_table_without_extra_column_is_upgraded(tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT NOT NULL DEFAULT '', "
+        "first_name TEXT NOT NULL DEFAULT '', join_date TEXT NOT NULL, message_count INTEGER NOT NULL DEFAULT 0, "
+        "image_count INTEGER NOT NULL DEFAULT 0, daily_image_date TEXT, "
+        "daily_image_count INTEGER NOT NULL DEFAULT 0, last_active TEXT NOT NULL);"
+        "INSERT INTO users (user_id, username, join_date, last_active) "
+        "VALUES (1, 'alice', '2024-01-01T10:00:00', '2024-01-01T10:00:00');"
+    )
+    conn.commit()
+    conn.close()
+
+    db = SQLiteDatabase(path)
+    try:
+        assert db.get_user_stats(1)["username"] == "alice"
+    finally:
+        db.close()
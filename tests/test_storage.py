@@ -0,0 +1,182 @@
+import json
+import os
+import time
+
+import storage
+
+
+def fill(db):
+    db.add_user(1, "alice", "Alice")
+    db.add_user(2, "bob", "Bob")
+    db.update_user_activity(1)
+    db.ban_user(2)
+    db.add_premium_user(1)
+    db.add_group(-100, "Cyber Security")
+    db.update_group_activity(-100)
+
+
+def snapshot_of(db):
+    return {
+        "users": {user_id: (user["username"], user["message_count"]) for user_id, user in db.to_dict()["users"].items()},
+        "banned_users": db.get_banned_users(),
+        "premium_users": db.get_premium_users(),
+        "groups": {chat_id: group["message_count"] for chat_id, group in db.data["groups"].items()},
+        "total_messages": db.get_total_stats()["total_messages"],
+    }
+
+
+def test_json_mode_round_trip(make_database):
+    db = make_database("json")
+    fill(db)
+    expected = snapshot_of(db)
+    db.close()
+    assert snapshot_of(make_database("json")) == expected
+
+
+def test_journal_is_replayed_on_start(make_database, tmp_path):
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)
+    fill(db)
+    expected = snapshot_of(db)
+    db.close()
+
+    # Nothing was compacted: everything is in the journal only
+    assert not (tmp_path / "bot_database.json").exists()
+    assert (tmp_path / "bot_database.journal").stat().st_size > 0
+    assert snapshot_of(make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)) == expected
+
+
+def test_journal_unban_and_removal_are_replayed(make_database):
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)
+    fill(db)
+    db.unban_user(2)
+    db.remove_premium_user(1)
+    db.remove_group(-100)
+    db.close()
+
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)
+    assert db.get_banned_users() == []
+    assert db.get_premium_users() == []
+    assert db.data["groups"] == {}
+
+
+def test_torn_journal_record_is_ignored(make_database, tmp_path):
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)
+    fill(db)
+    expected = snapshot_of(db)
+    db.close()
+    with open(tmp_path / "bot_database.journal", "ab") as f:
+        f.write(b'{"t": "users", "k": "3", "v": {"userna')
+
+    assert snapshot_of(make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)) == expected
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(make_database, tmp_path):
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1)
+    fill(db)
+    expected = snapshot_of(db)
+    db.close()
+
+    assert db.store.stats["compactions"] >= 1
+    assert not (tmp_path / "bot_database.journal.compacting").exists()
+    # At least the first segment is in the snapshot; later records may still be in the journal
+    on_disk = json.loads((tmp_path / "bot_database.json").read_text(encoding="utf-8"))
+    assert "1" in on_disk["users"]
+    assert snapshot_of(make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)) == expected
+
+
+def test_interrupted_compaction_is_finished_on_start(make_database, tmp_path):
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)
+    fill(db)
+    expected = snapshot_of(db)
+    db.close()
+    # Crash right after the journal was rotated into a segment
+    os.replace(tmp_path / "bot_database.journal", tmp_path / "bot_database.journal.compacting")
+
+    db = make_database("journal", DB_JOURNAL_COMPACT_BYTES=1 << 30)
+    assert snapshot_of(db) == expected
+    assert not (tmp_path / "bot_database.journal.compacting").exists()
+
+
+def test_write_behind_coalesces_mutations_until_close(make_database, tmp_path):
+    db = make_database("write_behind", DB_FLUSH_INTERVAL=3600, DB_FLUSH_MAX_MUTATIONS=10 ** 6)
+    fill(db)
+    expected = snapshot_of(db)
+    mutations = db.store.get_stats()["mutations"]
+    assert mutations > 1
+    assert db.store.get_stats()["pending_mutations"] == mutations
+    assert not (tmp_path / "bot_database.json").exists()
+    db.close()
+
+    stats = db.store.get_stats()
+    assert stats["writes"] == 1
+    assert stats["pending_mutations"] == 0
+    assert stats["coalesced_mutations"] == mutations - 1
+    assert stats["bytes_written"] == (tmp_path / "bot_database.json").stat().st_size
+    assert snapshot_of(make_database("json")) == expected
+
+
+def test_write_behind_flushes_after_max_mutations(make_database):
+    db = make_database("write_behind", DB_FLUSH_INTERVAL=3600, DB_FLUSH_MAX_MUTATIONS=2)
+    db.add_user(1, "alice", "Alice")
+    db.add_user(2, "bob", "Bob")
+    deadline = time.monotonic() + 5
+    while db.store.get_stats()["writes"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db.store.get_stats()["writes"] == 1
+    db.close()
+
+
+def test_apply_record_keeps_list_tables_as_sets():
+    data = {}
+    storage.apply_record(data, {"t": "banned_users", "k": "5", "v": True})
+    storage.apply_record(data, {"t": "banned_users", "k": "5", "v": True})
+    storage.apply_record(data, {"t": "banned_users", "k": "6", "v": True})
+    storage.apply_record(data, {"t": "banned_users", "k": "5", "v": False})
+    assert data["banned_users"] == ["6"]
+
+
+def test_sharded_mode_is_created_from_the_json_file(make_database, tmp_path):
+    db = make_database("json")
+    fill(db)
+    expected = snapshot_of(db)
+    db.close()
+
+    db = make_database("sharded")
+    manifest = json.loads((tmp_path / "shards" / "manifest.json").read_text(encoding="utf-8"))
+    assert manifest["shards"] == 4
+    assert sum(manifest["user_counts"]) == 2
+    assert db.get_total_users() == 2
+    assert snapshot_of(db) == expected
+
+
+def test_sharded_mode_only_loads_and_writes_touched_shards(make_database, tmp_path):
+    db = make_database("sharded")
+    fill(db)
+    db.close()
+
+    db = make_database("sharded")
+    assert db.get_total_users() == 2
+    assert db.store.stats["shards_loaded"] == 0
+    writes = db.store.stats["writes"]
+    db.update_user_activity(1)
+    assert db.store.stats["shards_loaded"] == 1
+    # users-0001.json, statistics.json and the counter buckets
+    assert db.store.stats["writes"] - writes == 3
+    db.close()
+
+    assert make_database("sharded").get_user_stats(1)["message_count"] == 2
+
+
+def test_reshard_keeps_every_user(make_database, tmp_path):
+    db = make_database("sharded")
+    for user_id in range(20):
+        db.add_user(user_id, f"user{user_id}", "")
+    db.close()
+
+    result = storage.reshard(str(tmp_path / "shards"), str(tmp_path / "resharded"), 3)
+    assert result == {"users": 20, "shards": 3}
+    data = storage.read_database(str(tmp_path / "resharded"))
+    assert sorted(map(int, data["users"])) == list(range(20))
+    for index in range(3):
+        shard = json.loads((tmp_path / "resharded" / f"users-{index:04d}.json").read_text(encoding="utf-8"))
+        assert all(int(user_id) % 3 == index for user_id in shard)
@@ -0,0 +1,68 @@
+import json
+from datetime import datetime
+
+from database import TimeSeriesCounters
+
+
+def test_increment_counts_hour_and_day():
+    counters = TimeSeriesCounters({})
+    now = datetime(2024, 5, 10, 14, 30)
+    changed = counters.increment("messages", now=now)
+    counters.increment("messages", 2, now=now)
+
+    assert set(changed) == {"h:2024-05-10T14", "d:2024-05-10"}
+    assert counters.buckets["h:2024-05-10T14"] == {"messages": 3}
+    assert counters.buckets["d:2024-05-10"] == {"messages": 3}
+
+
+def test_old_hours_are_dropped_and_old_days_rolled_up_into_months():
+    counters = TimeSeriesCounters({}, daily_retention=2, hourly_retention=3)
+    counters.increment("messages", now=datetime(2024, 4, 29, 9))
+    counters.increment("messages", 4, now=datetime(2024, 4, 30, 9))
+    counters.increment("images", now=datetime(2024, 4, 30, 10))
+
+    counters.increment("messages", now=datetime(2024, 5, 3, 12))
+    assert "h:2024-04-30T10" not in counters.buckets
+    assert "d:2024-04-29" not in counters.buckets
+    assert counters.buckets["m:2024-04"] == {"messages": 5, "images": 1}
+    assert counters.buckets["d:2024-05-03"] == {"messages": 1}
+
+
+def test_series_are_oldest_first_with_zeros():
+    counters = TimeSeriesCounters({})
+    counters.increment("new_users", now=datetime(2024, 5, 9, 8))
+    days = counters.get_days(3, now=datetime(2024, 5, 10, 8))
+    assert [day for day, _ in days] == ["2024-05-08", "2024-05-09", "2024-05-10"]
+    assert [counts["new_users"] for _, counts in days] == [0, 1, 0]
+
+    hours = counters.get_hours(2, now=datetime(2024, 5, 9, 9))
+    assert [(hour, counts["new_users"]) for hour, counts in hours] == [("2024-05-09T08", 1), ("2024-05-09T09", 0)]
+
+
+def test_legacy_daily_messages_are_imported_once():
+    counters = TimeSeriesCounters({"m:2000-01": {"messages": 9}})
+    counters.import_legacy({"2000-01-05": {"messages": 9}, datetime.now().strftime("%Y-%m-%d"): {"messages": 2}})
+    assert "d:2000-01-05" not in counters.buckets
+    assert counters.get_day(datetime.now().date())["messages"] == 2
+
+
+def test_record_event_does_not_write_until_the_next_save(make_database, tmp_path):
+    db = make_database("json")
+    db.add_user(1, "alice", "Alice")
+    writes = db.get_storage_stats()["writes"]
+    for _ in range(50):
+        db.record_event("group_messages")
+    assert db.get_storage_stats()["writes"] == writes
+    assert db.get_daily_stats()["group_messages"] == 50
+
+    db.update_user_activity(1)
+    on_disk = json.loads((tmp_path / "bot_database.json").read_text(encoding="utf-8"))
+    today = datetime.now().strftime("d:%Y-%m-%d")
+    assert on_disk["timeseries"][today]["group_messages"] == 50
+
+
+def test_record_event_is_written_on_close(make_database):
+    db = make_database("json")
+    db.record_event("gemini_calls", 3)
+    db.close()
+    assert make_database("json").get_daily_stats()["gemini_calls"] == 3
@@ -0,0 +1,69 @@
+import math
+import re
+from functools import lru_cache
+
+# Gemini bills an image as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+# One alternative per kind of run, each counted at its own rate (approximate
+# characters per token of Gemini's tokenizer for that kind of text)
+_RUNS = re.compile(
+    r"(?P<latin>[A-Za-z]+)"
+    r"|(?P<digits>[0-9]+)"
+    r"|(?P<arabic>[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]+)"
+    r"|(?P<space>\s+)"
+    r"|(?P<symbol>[!-/:-@\[-`{-~]+)"
+    r"|(?P<other>.)",
+    re.DOTALL,
+)
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """Offline token count for Arabic/English text and code.
+
+    English words take about 4 letters per token, Arabic words about 2.5
+    (the tokenizer splits off prefixes like ال and و), numbers 3 digits,
+    punctuation and operators mostly one token each (code is dense), a
+    single space is free but indentation and line breaks cost one per 4
+    characters, and emoji or other scripts one per character. Results are
+    cached, since the same history turns are counted again on every message.
+    """
+    total = 0.0
+    for match in _RUNS.finditer(text):
+        run = match.group()
+        kind = match.lastgroup
+        if kind == "latin":
+            total += math.ceil(len(run) / 4)
+        elif kind == "arabic":
+            total += math.ceil(len(run) / 2.5)
+        elif kind == "digits":
+            total += math.ceil(len(run) / 3)
+        elif kind == "space":
+            if run != " ":
+                total += math.ceil(len(run) / 4)
+        elif kind == "symbol":
+            total += math.ceil(len(run) / 1.5)
+        else:
+            total += 1
+    return int(total)
+
+
+def estimate_content_tokens(content: dict) -> int:
+    """Estimated tokens of one turn (a "contents" entry) of a request."""
+    total = 0
+    for part in content.get("parts", []):
+        if "text" in part:
+            total += estimate_tokens(part["text"])
+        elif "inline_data" in part:
+            total += IMAGE_TOKENS
+    return total
+
+
+def estimate_payload_tokens(payload: dict) -> int:
+    """Estimated input tokens of a generateContent payload."""
+    total = sum(estimate_content_tokens(content) for content in payload.get("contents", []))
+    system = payload.get("systemInstruction")
+    if system:
+        total += estimate_content_tokens(system)
+    return total